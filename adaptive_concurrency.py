@@ -0,0 +1,173 @@
+# adaptive_concurrency.py
+"""Adaptive (AIMD) concurrency limit for the WS RENAPO queries.
+
+Returns:
+    AdaptiveConcurrency object shared by the workers of the WS stage
+"""
+
+import math
+import threading
+import time
+
+# Seconds of results used for each adjustment of the limit
+WINDOW_SECONDS = 2.0
+# Min results on a window before adjusting the limit
+WINDOW_MIN_SAMPLES = 10
+# Additive increase and multiplicative decreases of the limit
+INCREASE_STEP = 1
+ERROR_BACKOFF = 0.5
+LATENCY_BACKOFF = 0.75
+# p95 above LATENCY_TOLERANCE x p95 of last window means latency is rising
+LATENCY_TOLERANCE = 1.5
+# Throughput below THROUGHPUT_TOLERANCE x last window means it fell
+THROUGHPUT_TOLERANCE = 0.95
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers.
+
+    Returns:
+        Value or None for an empty list
+    """
+
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = math.ceil(pct / 100 * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+class AdaptiveConcurrency:
+    """Tune the number of simultaneous WS queries while the stage runs.
+
+    The limit doubles (slow start) until the first back off and then grows
+    by INCREASE_STEP while throughput doesn't fall and the p95 latency
+    stays stable. It is cut multiplicatively when a window has errors
+    (timeouts, HTTP 5xx...) or its p95 latency rises.
+    """
+
+    def __init__(self, initial, minimum, maximum):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.in_flight = 0
+        # (seconds since start, limit, queries/s, p95 seconds, errors)
+        self.history = []
+
+        self._condition = threading.Condition()
+        self._start = time.perf_counter()
+        self._window_start = self._start
+        self._latencies = []
+        self._errors = 0
+        self._last_p95 = None
+        self._last_qps = None
+        self._slow_start = True
+
+    def acquire(self):
+        """Wait until a query can be sent under the current limit."""
+
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    def release(self, latency, error=False):
+        """Register the result of a query and free its slot."""
+
+        with self._condition:
+            self.in_flight -= 1
+            self.record(latency, error)
+            self._condition.notify_all()
+
+    def record(self, latency, error=False):
+        """Register the result of a query, adjusting the limit at the end
+        of each window. Call it with the lock held or from a single thread.
+        """
+
+        if error:
+            self._errors += 1
+        else:
+            self._latencies.append(latency)
+
+        now = time.perf_counter()
+        elapsed = now - self._window_start
+        samples = len(self._latencies) + self._errors
+        if elapsed < WINDOW_SECONDS or samples < WINDOW_MIN_SAMPLES:
+            return
+
+        qps = samples / elapsed
+        p95 = percentile(self._latencies, 95)
+        window_limit = self.limit
+
+        if self._errors:
+            self.limit = max(self.minimum, int(self.limit * ERROR_BACKOFF))
+            self._slow_start = False
+        elif (
+            p95 is not None
+            and self._last_p95 is not None
+            and p95 > self._last_p95 * LATENCY_TOLERANCE
+        ):
+            self.limit = max(self.minimum, int(self.limit * LATENCY_BACKOFF))
+            self._slow_start = False
+        elif (
+            self._last_qps is None
+            or qps >= self._last_qps * THROUGHPUT_TOLERANCE
+        ):
+            if self._slow_start:
+                increase = self.limit
+            else:
+                increase = INCREASE_STEP
+            self.limit = min(self.maximum, self.limit + increase)
+
+        self.history.append(
+            (now - self._start, window_limit, qps, p95, self._errors)
+        )
+        if p95 is not None:
+            self._last_p95 = p95
+        self._last_qps = qps
+        self._window_start = now
+        self._latencies = []
+        self._errors = 0
+
+    def finish(self):
+        """Register the last (partial) window without adjusting the limit."""
+
+        samples = len(self._latencies) + self._errors
+        if not samples:
+            return
+
+        now = time.perf_counter()
+        elapsed = max(now - self._window_start, 1e-9)
+        self.history.append(
+            (
+                now - self._start,
+                self.limit,
+                samples / elapsed,
+                percentile(self._latencies, 95),
+                self._errors,
+            )
+        )
+        self._latencies = []
+        self._errors = 0
+
+    def report_lines(self):
+        """Lines for the report with the limit used over time.
+
+        Returns:
+            List of strings
+        """
+
+        lineas = []
+        for elapsed, limit, qps, p95, errors in self.history:
+            p95_text = "n/a" if p95 is None else f"{p95:.3f}s"
+            lineas.append(
+                f"# Concurrency t={elapsed:.1f}s|limit={limit}"
+                f"|queries/s={qps:.2f}|p95={p95_text}|errors={errors}"
+            )
+
+        if self.history:
+            best = max(self.history, key=lambda window: window[2])
+            lineas.append(
+                f"# Concurrency best queries/s={best[2]:.2f}"
+                f" with limit={best[1]}"
+            )
+        return lineas
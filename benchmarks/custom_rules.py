@@ -0,0 +1,248 @@
+# benchmarks/custom_rules.py
+"""Benchmark of the Custom Rules stage: check_record on each EMPLEADO
+element vs check_records over the dataframe of the xml file, on 1 or more
+processes; results are saved on a JSON file to compare runs across
+versions.
+
+Usage:
+    python benchmarks/custom_rules.py --records 100000
+    python benchmarks/custom_rules.py --records 1000000 --skip-rows \\
+        --rule-jobs 1 2 4 8
+    python benchmarks/custom_rules.py --compare output_files/old_rules.json
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+import lxml.etree as ET
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validate_xml_sie as sie  # noqa: E402
+from custom_rules import load_rule_plan  # noqa: E402
+from end_to_end import (  # noqa: E402
+    benchmark_parser,
+    parse_benchmark_args,
+    save_results,
+    timed,
+    vs_previous,
+)
+from report_writer import close_report_writer  # noqa: E402
+
+VALID_RECORD = {
+    "TRAMITE": "0",
+    "NSS": None,
+    "DIGITO_VERIFICADOR": None,
+    "CURP": "PELJ900110HDFRRN08",
+    "NOMBRE": "JUAN",
+    "APELLIDO_PATERNO": "PEREZ",
+    "APELLIDO_MATERNO": "L#PEZ",
+    "SEXO": "1",
+    "LUGAR_NACIMIENTO": "09",
+    "DIA_NACIMIENTO": "10",
+    "MES_NACIMIENTO": "01",
+    "ANIO_NACIMIENTO": "1990",
+    "NOMBRE_PADRE": None,
+    "APELLIDO_PATERNO_PADRE": None,
+    "APELLIDO_MATERNO_PADRE": None,
+    "NOMBRE_MADRE": None,
+    "APELLIDO_PATERNO_MADRE": None,
+    "APELLIDO_MATERNO_MADRE": None,
+    "DIA_INGRESO": "01",
+    "MES_INGRESO": "02",
+    "ANIO_INGRESO": "2023",
+    "SALARIO_BASE": "0000.00",
+    "JORNADA_SEMANA": "0",
+    "TIPO_SALARIO": "1",
+    "OCUPACION": "ESTUDIANTE",
+    "DESCRIPCION_OCUPACION": "SUPERIOR",
+    "TIPO_TRABAJO": "2",
+    "CODIGO_POSTAL": "01234",
+    "TRAMITADO": "0",
+}
+
+# Wrong values used for some of the records
+WRONG_VALUES = ["X", "13", "00", "1899", "juan", "PEREZ1", "", "99999A"]
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = benchmark_parser(
+        "benchmark of custom rules", "custom_rules", records=100000
+    )
+
+    parser.add_argument(
+        "--rules",
+        default=os.path.join(ROOT, "custom_rules.ini"),
+        help="rules file",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.05,
+        help="share of the values (0 to 1) with a wrong value",
+    )
+    parser.add_argument(
+        "--rule-jobs",
+        nargs="+",
+        type=int,
+        default=[1],
+        help="processes of check_records to measure (e.g. 1 2 4 8)",
+    )
+    parser.add_argument(
+        "--skip-rows",
+        action="store_true",
+        help="don't run check_record (no xml tree, for 1M records)",
+    )
+
+    return parse_benchmark_args(parser)
+
+
+def build_records(records, error_rate):
+    """Synthetic EMPLEADO records with some wrong values.
+
+    Returns:
+        List of dicts tag: text (None for an empty tag)
+    """
+
+    random.seed(1)
+    data = []
+    for _ in range(records):
+        row = {}
+        for tag, value in VALID_RECORD.items():
+            if tag != "CURP" and random.random() < error_rate:
+                value = random.choice(WRONG_VALUES) or None
+            row[tag] = value
+        data.append(row)
+    return data
+
+
+def build_document(data):
+    """SIE xml file of the records.
+
+    Returns:
+        XmlDocument
+    """
+
+    root = ET.Element("SIE")
+    for row in data:
+        registro = ET.SubElement(root, "EMPLEADO")
+        for tag, value in row.items():
+            ET.SubElement(registro, tag).text = value
+    return sie.XmlDocument(ET.ElementTree(root))
+
+
+def run_rows(document, rule_plan, output_filename):
+    for num_registros, registro in enumerate(document.registros, 1):
+        sie.check_record(registro, num_registros, rule_plan, output_filename)
+    close_report_writer(output_filename)
+
+
+def run_columns(df_datos, rule_plan, rule_jobs, output_filename):
+    sie.check_records(df_datos, rule_plan, rule_jobs, output_filename)
+    close_report_writer(output_filename)
+
+
+def read_report(output_filename):
+    with open(output_filename, encoding="utf-8") as f:
+        return f.read()
+
+
+def print_results(results, previous=None):
+    seconds = results["seconds"]
+    print(f"\tRecords:\t{results['params']['records']}")
+    print(f"\tCPUs:\t{results['cpus']}")
+    print(f"\tIncidences:\t{results['incidences']}")
+    print(f"\tSame incidences:\t{results['same_incidences']}")
+    if seconds["check_record"] is not None:
+        print(
+            f"\tcheck_record:\t{seconds['check_record']:.3f} s"
+            + vs_previous(
+                previous,
+                ("seconds", "check_record"),
+                seconds["check_record"],
+                lower_is_better=True,
+            )
+        )
+    print(f"\tDataframe:\t{seconds['dataframe']:.3f} s")
+
+    first_time = None
+    for rule_jobs, columns_time in seconds["check_records"].items():
+        if first_time is None:
+            first_time = columns_time
+        linea = f"\tcheck_records, {rule_jobs} process(es):\t"
+        linea += f"{columns_time:.3f} s"
+        linea += f"|{first_time / columns_time:.1f}x"
+        if seconds["check_record"] is not None:
+            ratio = seconds["check_record"] / columns_time
+            linea += f"|{ratio:.1f}x vs check_record"
+        linea += vs_previous(
+            previous,
+            ("seconds", "check_records", rule_jobs),
+            columns_time,
+            lower_is_better=True,
+        )
+        print(linea)
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+    data = build_records(user_args.records, user_args.error_rate)
+    rule_plan = load_rule_plan(user_args.rules)
+
+    with tempfile.TemporaryDirectory() as folder:
+        rows_time = None
+        reports = []
+        if not user_args.skip_rows:
+            document = build_document(data)
+            rows_report = os.path.join(folder, "rows.csv")
+            _, rows_time = timed(run_rows, document, rule_plan, rows_report)
+            reports.append(read_report(rows_report))
+            del document
+
+        df_datos, dataframe_time = timed(pd.DataFrame, data)
+        del data
+
+        # Processes (as text, like the keys of the JSON file): seconds
+        columns_times = {}
+        for rule_jobs in user_args.rule_jobs:
+            columns_report = os.path.join(folder, f"columns_{rule_jobs}.csv")
+            _, columns_times[str(rule_jobs)] = timed(
+                run_columns, df_datos, rule_plan, rule_jobs, columns_report
+            )
+            reports.append(read_report(columns_report))
+
+    same = all(report == reports[0] for report in reports[1:])
+    results = save_results(
+        user_args,
+        {
+            "cpus": os.cpu_count(),
+            "params": {
+                "records": user_args.records,
+                "error_rate": user_args.error_rate,
+                "rule_jobs": user_args.rule_jobs,
+                "skip_rows": user_args.skip_rows,
+            },
+            "incidences": reports[0].count("\n"),
+            "same_incidences": same,
+            "seconds": {
+                "check_record": rows_time and round(rows_time, 4),
+                "dataframe": round(dataframe_time, 4),
+                "check_records": {
+                    rule_jobs: round(seconds, 4)
+                    for rule_jobs, seconds in columns_times.items()
+                },
+            },
+        },
+        print_results,
+    )
+
+    sys.exit(0 if same else 1)
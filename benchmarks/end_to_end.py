@@ -0,0 +1,597 @@
+# benchmarks/end_to_end.py
+"""End to end benchmark: a synthetic SIE xml file (and its XSD) checked
+stage by stage, with WS RENAPO answered by a local fake_renapo.py server.
+Wall time and records/s of each stage are saved on a JSON file, to compare
+runs across versions.
+
+Usage:
+    python benchmarks/end_to_end.py --records 100000 --ws-records 2000
+    python benchmarks/end_to_end.py --latency 0.05 --ws-error-rate 0.05 \\
+        --engines serial threads async
+    python benchmarks/end_to_end.py --compare output_files/old.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validate_xml_sie as sie  # noqa: E402
+from custom_rules import curp_check_digit, load_rule_plan  # noqa: E402
+from fake_renapo import build_wsdl  # noqa: E402
+from report_writer import close_report_writers  # noqa: E402
+
+# Tags of an EMPLEADO record, in the order of the XSD
+TAGS = (
+    "TRAMITE",
+    "NSS",
+    "DIGITO_VERIFICADOR",
+    "CURP",
+    "NOMBRE",
+    "APELLIDO_PATERNO",
+    "APELLIDO_MATERNO",
+    "SEXO",
+    "LUGAR_NACIMIENTO",
+    "DIA_NACIMIENTO",
+    "MES_NACIMIENTO",
+    "ANIO_NACIMIENTO",
+    "NOMBRE_PADRE",
+    "APELLIDO_PATERNO_PADRE",
+    "APELLIDO_MATERNO_PADRE",
+    "NOMBRE_MADRE",
+    "APELLIDO_PATERNO_MADRE",
+    "APELLIDO_MATERNO_MADRE",
+    "DIA_INGRESO",
+    "MES_INGRESO",
+    "ANIO_INGRESO",
+    "SALARIO_BASE",
+    "JORNADA_SEMANA",
+    "TIPO_SALARIO",
+    "OCUPACION",
+    "DESCRIPCION_OCUPACION",
+    "TIPO_TRABAJO",
+    "CODIGO_POSTAL",
+    "TRAMITADO",
+)
+
+# Wrong values used for the broken records
+WRONG_VALUES = ["X", "13", "00", "1899", "juan", "PEREZ1", None, "99999A"]
+
+# WS RENAPO engines: name, engine, use_threads
+ENGINES = {
+    "serial": ("threads", False),
+    "threads": ("threads", True),
+    "async": ("async", False),
+}
+
+# Seconds to wait for the fake WS RENAPO server to listen
+SERVER_START_TIMEOUT = 10
+
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def benchmark_parser(description, name, records=None, broken=None):
+    """Parser with the options shared by the benchmarks: --output (default
+    output_files/<time_stamp>_<name>.json) and --compare, plus --records
+    and --broken of the synthetic xml file when their defaults are given.
+
+    Returns:
+        argparse.ArgumentParser
+    """
+    parser = argparse.ArgumentParser(description=description)
+
+    if records is not None:
+        parser.add_argument(
+            "--records",
+            type=int,
+            default=records,
+            help="EMPLEADO records of the synthetic xml file",
+        )
+    if broken is not None:
+        parser.add_argument(
+            "--broken",
+            type=float,
+            default=broken,
+            help="share of the records (0 to 1) with a wrong value",
+        )
+    parser.add_argument(
+        "--output",
+        help="JSON results file (default: output_files/<time_stamp>"
+        f"_{name}.json)",
+    )
+    parser.add_argument(
+        "--compare",
+        help="JSON results file of a previous run to compare with",
+    )
+    parser.set_defaults(benchmark_name=name)
+
+    return parser
+
+
+def parse_benchmark_args(parser):
+    """Parse the CLI arguments of a benchmark_parser, adding the timestamp
+    of the run, the absolute --output path and the results of --compare
+    (previous, None without it).
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+
+    user_args = parser.parse_args()
+    user_args.timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S")
+    user_args.output = os.path.abspath(
+        user_args.output
+        or os.path.join(
+            ROOT,
+            "output_files",
+            f"{user_args.timestamp}_{user_args.benchmark_name}.json",
+        )
+    )
+
+    user_args.previous = None
+    if user_args.compare:
+        with open(user_args.compare, encoding="utf-8") as f:
+            user_args.previous = json.load(f)
+    return user_args
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = benchmark_parser(
+        "end to end benchmark", "benchmark", records=100000, broken=0.05
+    )
+
+    parser.add_argument(
+        "--rules",
+        default=os.path.join(ROOT, "custom_rules.ini"),
+        help="rules file",
+    )
+    parser.add_argument(
+        "--rule-jobs",
+        type=int,
+        default=1,
+        help="processes of the Custom Rules stage",
+    )
+    parser.add_argument(
+        "--ws-records",
+        type=int,
+        default=1000,
+        help="records of the xml file searched on WS RENAPO",
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=ENGINES,
+        default=["threads", "async"],
+        help="WS RENAPO engines to measure (serial: threads without -u)",
+    )
+    parser.add_argument(
+        "--soap",
+        choices=sie.SOAP_CLIENTS,
+        default="raw",
+        help="client of the serial and threads engines",
+    )
+    parser.add_argument(
+        "--in-flight",
+        type=int,
+        default=200,
+        help="max simultaneous queries of the async engine",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="retries of each failed WS RENAPO query",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.02,
+        help="seconds the fake WS RENAPO waits before each response",
+    )
+    parser.add_argument(
+        "--ws-error-rate",
+        type=float,
+        default=0.0,
+        help="share of queries (0 to 1) the fake WS RENAPO answers HTTP 500",
+    )
+
+    return parse_benchmark_args(parser)
+
+
+def synthetic_curp(index):
+    """Valid CURP (structure and check digit), different for each index up
+    to 26**4 records.
+
+    Returns:
+        CURP, year, month and day of birth
+    """
+
+    letters = ""
+    number = index % 26**4
+    for _ in range(4):
+        number, letter = divmod(number, 26)
+        letters += LETTERS[letter]
+
+    year = f"{50 + index * 7 % 50:02d}"
+    month = f"{1 + index % 12:02d}"
+    day = f"{1 + index % 28:02d}"
+    curp = letters + year + month + day + "HDFRRN0"
+    return curp + curp_check_digit(curp), year, month, day
+
+
+def synthetic_record(index, broken):
+    """EMPLEADO record that matches the answer of the fake WS RENAPO, with
+    a wrong value (or CURP check digit) when broken is True.
+
+    Returns:
+        Dict tag: text (None for an empty tag)
+    """
+
+    curp, year, month, day = synthetic_curp(index)
+    record = dict.fromkeys(TAGS)
+    record.update(
+        TRAMITE="0",
+        CURP=curp,
+        NOMBRE="JUAN",
+        APELLIDO_PATERNO="PEREZ",
+        APELLIDO_MATERNO="LOPEZ",
+        SEXO="1",
+        LUGAR_NACIMIENTO="09",
+        DIA_NACIMIENTO=day,
+        MES_NACIMIENTO=month,
+        ANIO_NACIMIENTO="19" + year,
+        DIA_INGRESO="01",
+        MES_INGRESO="02",
+        ANIO_INGRESO="2023",
+        SALARIO_BASE="0000.00",
+        JORNADA_SEMANA="0",
+        TIPO_SALARIO="1",
+        OCUPACION="ESTUDIANTE",
+        DESCRIPCION_OCUPACION="SUPERIOR",
+        TIPO_TRABAJO="2",
+        CODIGO_POSTAL="01234",
+        TRAMITADO="0",
+    )
+
+    if broken:
+        tag = random.choice(TAGS)
+        if tag == "CURP":
+            digit = str((int(curp[17]) + 1) % 10)
+            record["CURP"] = curp[:17] + digit
+        else:
+            record[tag] = random.choice(WRONG_VALUES)
+    return record
+
+
+def write_xml_file(xml_filename, records, broken):
+    """Write a synthetic SIE xml file, record by record.
+
+    Returns:
+        Number of broken records
+    """
+
+    random.seed(1)
+    num_broken = 0
+    with open(xml_filename, mode="w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<SIE>\n')
+        for index in range(records):
+            is_broken = random.random() < broken
+            num_broken += is_broken
+            record = synthetic_record(index, is_broken)
+            f.write("<EMPLEADO>")
+            for tag, value in record.items():
+                if value is None:
+                    f.write(f"<{tag}/>")
+                else:
+                    f.write(f"<{tag}>{value}</{tag}>")
+            f.write("</EMPLEADO>\n")
+        f.write("</SIE>\n")
+    return num_broken
+
+
+def write_xsd_file(xsd_filename):
+    """Write the XSD of the synthetic xml files."""
+
+    elements = "".join(
+        f'<xs:element name="{tag}" type="xs:string"/>' for tag in TAGS
+    )
+    with open(xsd_filename, mode="w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+            '<xs:element name="SIE"><xs:complexType><xs:sequence>'
+            '<xs:element name="EMPLEADO" maxOccurs="unbounded">'
+            f"<xs:complexType><xs:sequence>{elements}</xs:sequence>"
+            "</xs:complexType></xs:element>"
+            "</xs:sequence></xs:complexType></xs:element>"
+            "</xs:schema>"
+        )
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_fake_renapo(port, latency, error_rate):
+    """Start fake_renapo.py on its own process and wait until it listens.
+
+    Returns:
+        subprocess.Popen
+    """
+
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(ROOT, "fake_renapo.py"),
+            "--port",
+            str(port),
+            "--latency",
+            str(latency),
+            "--error-rate",
+            str(error_rate),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError(f"fake WS RENAPO didn't start on port {port}")
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def stage_result(seconds, records):
+    return {
+        "seconds": round(seconds, 4),
+        "records": records,
+        "records_per_s": round(records / seconds, 1) if seconds else None,
+    }
+
+
+def count_incidences(output_filename):
+    sie.close_report_writer(output_filename)
+    with open(output_filename, encoding="utf-8") as f:
+        return sum(1 for linea in f if not linea.startswith("#"))
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(user_args, results, print_results):
+    """Save the results of a benchmark on user_args.output, with the git
+    version, timestamp and platform of the run, and show them (vs the
+    results of --compare) with print_results(results, previous).
+
+    Returns:
+        Dict of results
+    """
+
+    results = {
+        "version": git_version(),
+        "timestamp": user_args.timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        **results,
+    }
+
+    os.makedirs(os.path.dirname(user_args.output), exist_ok=True)
+    with open(user_args.output, mode="w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n\tVersion:\t{results['version']}")
+    print_results(results, user_args.previous)
+    print(f"\n\tResults File:\t{user_args.output}")
+    return results
+
+
+def vs_previous(previous, keys, value, lower_is_better=False):
+    """Ratio of a result vs the same result (keys path) of the previous
+    run, > 1 when it improved.
+
+    Returns:
+        Text to append to the result line, "" without a previous result
+    """
+
+    old = previous
+    for key in keys:
+        old = (old or {}).get(key)
+    if not old or not value:
+        return ""
+    ratio = old / value if lower_is_better else value / old
+    return f"|{ratio:.2f}x vs {previous['version']}"
+
+
+def run_stages(user_args, ws_url):
+    """Run each stage over the synthetic xml file of the current folder
+    (with its archivo_xsd, archivo_wsdl and output_files folders).
+
+    Returns:
+        Dict stage: result, dict stage: incidences
+    """
+
+    records = user_args.records
+    stages = {}
+    incidences = {}
+    rule_plan = load_rule_plan(user_args.rules)
+
+    document, seconds = timed(sie.read_xml_tree, "bench.xml")
+    stages["parse"] = stage_result(seconds, records)
+
+    report = "./output_files/xsd_report.csv"
+    _, seconds = timed(
+        sie.validate_vs_xsd, document, "bench.xsd", True, report
+    )
+    stages["xsd"] = stage_result(seconds, records)
+
+    df_datos, seconds = timed(sie.read_xml_to_dataframe, document)
+    stages["dataframe"] = stage_result(seconds, records)
+
+    report = "./output_files/rules_report.csv"
+    _, seconds = timed(
+        sie.check_records, df_datos, rule_plan, user_args.rule_jobs, report
+    )
+    stages["custom_rules"] = stage_result(seconds, records)
+    incidences["custom_rules"] = count_incidences(report)
+    del df_datos
+
+    report = "./output_files/stream_report.csv"
+    _, seconds = timed(
+        sie.validate_xml_stream,
+        "bench.xml",
+        rule_plan,
+        None,
+        None,
+        report,
+        False,
+    )
+    stages["stream"] = stage_result(seconds, records)
+    incidences["stream"] = count_incidences(report)
+
+    for name in user_args.engines:
+        engine, use_threads = ENGINES[name]
+        report = f"./output_files/ws_{name}_report.csv"
+        ws_records = [
+            sie.ws_record(registro)
+            for registro in document.registros[: user_args.ws_records]
+        ]
+        ws_records = sie.exclude_invalid_curps(ws_records, rule_plan, report)
+        _, seconds = timed(
+            sie.search_on_ws,
+            ws_url,
+            "./archivo_wsdl/bench.wsdl",
+            ws_records,
+            True,
+            use_threads,
+            "off",
+            "off",
+            engine,
+            user_args.soap,
+            user_args.in_flight,
+            30,
+            "fixed",
+            64,
+            user_args.retries,
+            10,
+            30,
+            report,
+        )
+        stages["ws_" + name] = stage_result(seconds, len(ws_records))
+        incidences["ws_" + name] = count_incidences(report)
+
+    return stages, incidences
+
+
+def print_results(results, previous=None):
+    print(f"\tRecords:\t{results['params']['records']}")
+    print(f"\tCPUs:\t{results['cpus']}")
+    for stage, result in results["stages"].items():
+        print(
+            f"\t{stage}:\t{result['seconds']:.3f} s"
+            f"|{result['records_per_s']} records/s"
+            + vs_previous(
+                previous,
+                ("stages", stage, "records_per_s"),
+                result["records_per_s"],
+            )
+        )
+    for stage, total in results["incidences"].items():
+        print(f"\tIncidences {stage}:\t{total}")
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+    user_args.rules = os.path.abspath(user_args.rules)
+
+    port = free_port()
+    ws_url = f"http://127.0.0.1:{port}/ws"
+    server = start_fake_renapo(
+        port, user_args.latency, user_args.ws_error_rate
+    )
+
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            os.chdir(folder)
+            for subfolder in ("archivo_xsd", "archivo_wsdl", "output_files"):
+                os.makedirs(subfolder)
+            with open("archivo_wsdl/bench.wsdl", "w", encoding="utf-8") as f:
+                f.write(build_wsdl(ws_url))
+            write_xsd_file("archivo_xsd/bench.xsd")
+
+            num_broken, seconds = timed(
+                write_xml_file,
+                "bench.xml",
+                user_args.records,
+                user_args.broken,
+            )
+            print(
+                f"\tXML File:\t{user_args.records} records, "
+                f"{num_broken} broken, {seconds:.1f} s"
+            )
+
+            stages, incidences = run_stages(user_args, ws_url)
+            close_report_writers()
+    finally:
+        os.chdir(cwd)
+        server.terminate()
+        server.wait()
+
+    save_results(
+        user_args,
+        {
+            "cpus": os.cpu_count(),
+            "params": {
+                "records": user_args.records,
+                "broken": user_args.broken,
+                "rule_jobs": user_args.rule_jobs,
+                "ws_records": user_args.ws_records,
+                "engines": user_args.engines,
+                "soap": user_args.soap,
+                "in_flight": user_args.in_flight,
+                "retries": user_args.retries,
+                "latency": user_args.latency,
+                "ws_error_rate": user_args.ws_error_rate,
+                "broken_records": num_broken,
+            },
+            "stages": stages,
+            "incidences": incidences,
+        },
+        print_results,
+    )
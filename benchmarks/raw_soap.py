@@ -0,0 +1,147 @@
+# benchmarks/raw_soap.py
+"""Benchmark of the clients for ConsultaDatosCURP: suds vs RawSoapClient
+(--soap raw). Each client runs --queries queries on --threads threads
+against fake_renapo.py on its own process, measuring queries/s and CPU
+time per query; results are saved on a JSON file to compare runs across
+versions. That both clients get the same responses is checked apart, by
+check_soap_parity.py.
+
+Usage:
+    python benchmarks/raw_soap.py --queries 5000 --threads 4
+    python benchmarks/raw_soap.py --compare output_files/old_soap.json
+"""
+
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from check_soap_parity import client_factory_for  # noqa: E402
+from end_to_end import (  # noqa: E402
+    benchmark_parser,
+    free_port,
+    parse_benchmark_args,
+    save_results,
+    start_fake_renapo,
+    synthetic_curp,
+    vs_previous,
+)
+from renapo_client import RawSoapClientFactory  # noqa: E402
+
+# Client name: factory(RenapoClientFactory)
+CLIENTS = {
+    "suds": lambda client_factory: client_factory,
+    "raw": RawSoapClientFactory,
+}
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = benchmark_parser("raw SOAP client benchmark", "soap")
+
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=2000,
+        help="queries of each client",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=4,
+        help="threads of each client",
+    )
+
+    return parse_benchmark_args(parser)
+
+
+def run_client(name, client_factory, queries, threads):
+    """Send queries queries on threads threads with a client.
+
+    Returns:
+        Dict with seconds, queries/s and CPU ms per query
+    """
+
+    factory = CLIENTS[name](client_factory)
+    curps = [synthetic_curp(index)[0] for index in range(queries)]
+
+    def worker(share):
+        for curp in share:
+            factory.get_client().service.ConsultaDatosCURP(curp)
+
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        for future in [
+            ex.submit(worker, curps[index::threads])
+            for index in range(threads)
+        ]:
+            future.result()
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - cpu_start
+    if factory is not client_factory:
+        factory.close()
+
+    return {
+        "seconds": round(seconds, 4),
+        "queries_per_s": round(queries / seconds, 1),
+        "cpu_ms_per_query": round(cpu_seconds * 1000 / queries, 3),
+    }
+
+
+def print_results(results, previous=None):
+    print(f"\tQueries:\t{results['params']['queries']}")
+    print(f"\tThreads:\t{results['params']['threads']}")
+    for name, result in results["clients"].items():
+        print(
+            f"\t{name}:\t{result['queries_per_s']} queries/s"
+            f"|{result['cpu_ms_per_query']} CPU ms/query"
+            + vs_previous(
+                previous,
+                ("clients", name, "queries_per_s"),
+                result["queries_per_s"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        # Server on its own process, the CPU time is the client's only
+        port = free_port()
+        server = start_fake_renapo(port, 0.0, 0.0)
+        try:
+            client_factory = client_factory_for(
+                f"http://127.0.0.1:{port}/ws",
+                os.path.join(folder, "bench.wsdl"),
+            )
+            clients = {
+                name: run_client(
+                    name, client_factory, user_args.queries, user_args.threads
+                )
+                for name in CLIENTS
+            }
+        finally:
+            server.terminate()
+            server.wait()
+
+    save_results(
+        user_args,
+        {
+            "params": {
+                "queries": user_args.queries,
+                "threads": user_args.threads,
+            },
+            "clients": clients,
+        },
+        print_results,
+    )
@@ -0,0 +1,182 @@
+# benchmarks/startup.py
+"""Startup benchmark: import time of validate_xml_sie.py (python -X
+importtime) and wall time of `--help`, on new processes. The heaviest
+imports and any module of LAZY_MODULES imported at load time are shown,
+and the results are saved on a JSON file to compare runs across versions.
+
+Usage:
+    python benchmarks/startup.py --repeat 10
+    python benchmarks/startup.py --compare output_files/old_startup.json
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from end_to_end import (  # noqa: E402
+    benchmark_parser,
+    parse_benchmark_args,
+    save_results,
+    vs_previous,
+)
+
+# Modules that validate_xml_sie.py must not import at load time
+LAZY_MODULES = ("numpy", "pandas", "tqdm", "suds", "aiohttp")
+
+# "import time: self [us] | cumulative | imported package"
+IMPORTTIME_PREFIX = "import time:"
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = benchmark_parser("startup benchmark", "startup")
+
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="new processes per measure, the median is saved",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="heaviest imports to show",
+    )
+
+    return parse_benchmark_args(parser)
+
+
+def import_times():
+    """Import validate_xml_sie on a new process with -X importtime.
+
+    Returns:
+        Dict module: cumulative microseconds, and the names of the
+        LAZY_MODULES imported at load time
+    """
+
+    check = (
+        "import sys, validate_xml_sie; "
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    cumulative = {}
+    for linea in completed.stderr.splitlines():
+        if not linea.startswith(IMPORTTIME_PREFIX):
+            continue
+        _, total, module = linea[len(IMPORTTIME_PREFIX) :].split("|")
+        if total.strip().isdigit():
+            cumulative[module.strip()] = int(total)
+
+    eager = [
+        module for module in completed.stdout.strip().split(",") if module
+    ]
+    return cumulative, eager
+
+
+def help_time():
+    """Wall time of `validate_xml_sie.py --help` on a new process.
+
+    Returns:
+        Seconds
+    """
+
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "validate_xml_sie.py", "--help"],
+        cwd=ROOT,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+def run_startup(user_args):
+    """Measure the import and --help times user_args.repeat times.
+
+    Returns:
+        Dict of results
+    """
+
+    totals = []
+    runs = []
+    eager = []
+    for _ in range(user_args.repeat):
+        cumulative, eager = import_times()
+        totals.append(cumulative["validate_xml_sie"])
+        runs.append(cumulative)
+
+    # Heaviest imports of the median run
+    median_run = sorted(runs, key=lambda run: run["validate_xml_sie"])[
+        len(runs) // 2
+    ]
+    heaviest = sorted(
+        (
+            (module, total)
+            for module, total in median_run.items()
+            if module != "validate_xml_sie"
+        ),
+        key=lambda item: item[1],
+        reverse=True,
+    )[: user_args.top]
+
+    return {
+        "import_ms": statistics.median(totals) / 1000,
+        "help_ms": statistics.median(
+            [help_time() * 1000 for _ in range(user_args.repeat)]
+        ),
+        "heaviest_imports_ms": {
+            module: total / 1000 for module, total in heaviest
+        },
+        "eager_modules": eager,
+    }
+
+
+def print_results(results, previous=None):
+    for measure in ("import_ms", "help_ms"):
+        print(
+            f"\t{measure}:\t{results['startup'][measure]:.1f} ms"
+            + vs_previous(
+                previous,
+                ("startup", measure),
+                results["startup"][measure],
+                lower_is_better=True,
+            )
+        )
+    for module, total in results["startup"]["heaviest_imports_ms"].items():
+        print(f"\t{module}:\t{total:.1f} ms")
+    eager = results["startup"]["eager_modules"]
+    if eager:
+        print(f"\tImported at load time:\t{', '.join(eager)}")
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+
+    results = save_results(
+        user_args,
+        {
+            "params": {"repeat": user_args.repeat},
+            "startup": run_startup(user_args),
+        },
+        print_results,
+    )
+
+    # A heavy module back at load time is a regression
+    sys.exit(1 if results["startup"]["eager_modules"] else 0)
@@ -0,0 +1,175 @@
+# benchmarks/ws_compare.py
+"""Benchmark of the comparison of WS RENAPO responses with the XML data:
+each response compared on the WS worker as it arrives (report_ws_response,
+the former way) vs collected by the workers and compared in batches
+(WsResponses and report_ws_batch). Measures the time spent on the worker
+loop per response and the total time, over the records of a synthetic xml
+file all answered with the same response; results are saved on a JSON
+file to compare runs across versions.
+
+Usage:
+    python benchmarks/ws_compare.py --records 200000 --broken 0.05
+    python benchmarks/ws_compare.py --compare output_files/old_compare.json
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validate_xml_sie as sie  # noqa: E402
+from checkpoint import close_checkpoint  # noqa: E402
+from end_to_end import (  # noqa: E402
+    benchmark_parser,
+    parse_benchmark_args,
+    save_results,
+    vs_previous,
+    write_xml_file,
+)
+from renapo_cache import RenapoResponse  # noqa: E402
+from report_writer import close_report_writers  # noqa: E402
+
+# Answer of the fake WS RENAPO for every synthetic CURP
+RESPONSE = RenapoResponse(0, "JUAN", "PEREZ", "LOPEZ")
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = benchmark_parser(
+        "WS compare benchmark", "compare", records=100000, broken=0.05
+    )
+
+    return parse_benchmark_args(parser)
+
+
+def compare_each(unique_records, duplicates, report):
+    """Former way: compare each response on the worker.
+
+    Returns:
+        Results dict, seconds on the worker loop
+    """
+
+    results = {}
+    start = time.perf_counter()
+    for record_data in unique_records:
+        try:
+            sie.report_ws_response(
+                record_data, RESPONSE, duplicates, results, report
+            )
+        except Exception as mensaje:
+            sie.report_ws_error(
+                record_data, mensaje, duplicates, results, report
+            )
+    return results, time.perf_counter() - start
+
+
+def compare_batches(unique_records, duplicates, report):
+    """Collect the responses on the worker, compare them in batches.
+
+    Returns:
+        Results dict, seconds on the worker loop
+    """
+
+    results = {}
+    responses = sie.WsResponses(duplicates, results, report)
+    start = time.perf_counter()
+    for record_data in unique_records:
+        responses.add(record_data, RESPONSE)
+    seconds = time.perf_counter() - start
+    responses.finish()
+    return results, seconds
+
+
+# Way name: function(unique_records, duplicates, report)
+WAYS = {
+    "each": compare_each,
+    "batches": compare_batches,
+}
+
+
+def run_ways(xml_filename, folder):
+    """Compare the records of the xml file with RESPONSE each way.
+
+    Returns:
+        Dict way: result, True if all the ways find the same incidences
+    """
+
+    # Records with a NOMBRE only, as measured by the former runs
+    document = sie.read_xml_tree(xml_filename)
+    ws_records = [
+        sie.ws_record(registro)
+        for registro in document.registros
+        if registro.findtext("NOMBRE")
+    ]
+    unique_records, duplicates = sie.dedupe_ws_records(ws_records)
+
+    ways = {}
+    all_results = []
+    for name, function in WAYS.items():
+        report = os.path.join(folder, f"{name}_report.csv")
+        start = time.perf_counter()
+        results, worker_seconds = function(unique_records, duplicates, report)
+        seconds = time.perf_counter() - start
+        close_checkpoint(report)
+        all_results.append(results)
+        ways[name] = {
+            "seconds": round(seconds, 4),
+            "worker_seconds": round(worker_seconds, 4),
+            "worker_us_per_response": round(
+                worker_seconds * 1e6 / len(unique_records), 2
+            ),
+            "records_per_s": round(len(ws_records) / seconds, 1),
+            "incidences": sum(len(value) for value in results.values()),
+        }
+    close_report_writers()
+
+    same = all(results == all_results[0] for results in all_results[1:])
+    return ways, same
+
+
+def print_results(results, previous=None):
+    print(f"\tRecords:\t{results['params']['records']}")
+    print(f"\tSame incidences:\t{results['same_incidences']}")
+    for name, result in results["ways"].items():
+        print(
+            f"\t{name}:\t{result['seconds']:.3f} s"
+            f"|{result['records_per_s']} records/s"
+            f"|worker {result['worker_us_per_response']} us/response"
+            f"|{result['incidences']} incidences"
+            + vs_previous(
+                previous,
+                ("ways", name, "records_per_s"),
+                result["records_per_s"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        xml_filename = os.path.join(folder, "bench.xml")
+        write_xml_file(xml_filename, user_args.records, user_args.broken)
+        ways, same = run_ways(xml_filename, folder)
+
+    save_results(
+        user_args,
+        {
+            "params": {
+                "records": user_args.records,
+                "broken": user_args.broken,
+            },
+            "same_incidences": same,
+            "ways": ways,
+        },
+        print_results,
+    )
+
+    sys.exit(0 if same else 1)
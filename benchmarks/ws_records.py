@@ -0,0 +1,177 @@
+# benchmarks/ws_records.py
+"""Memory benchmark of the WS RENAPO records: bytes per record of the data
+searched on WS RENAPO and of its incidences, as one list per record with
+the incidences appended (the former layout) vs WsRecord tuples and the
+results dict of the stage. Measured with tracemalloc over a synthetic xml
+file; results are saved on a JSON file to compare runs across versions.
+
+Usage:
+    python benchmarks/ws_records.py --records 200000 --broken 0.05
+    python benchmarks/ws_records.py --compare output_files/old_ws.json
+"""
+
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validate_xml_sie as sie  # noqa: E402
+from end_to_end import (  # noqa: E402
+    benchmark_parser,
+    parse_benchmark_args,
+    save_results,
+    vs_previous,
+    write_xml_file,
+)
+from renapo_cache import RenapoResponse  # noqa: E402
+
+# Answer of the fake WS RENAPO for every synthetic CURP
+RESPONSE = RenapoResponse(0, "JUAN", "PEREZ", "LOPEZ")
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = benchmark_parser(
+        "WS records benchmark", "ws_records", records=100000, broken=0.05
+    )
+
+    return parse_benchmark_args(parser)
+
+
+def measured(function, *args):
+    """Run function, measuring the memory still allocated by its result.
+
+    Returns:
+        Result, bytes allocated, seconds
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, allocated, seconds
+
+
+def incidences(record):
+    """Incidences of a record vs RESPONSE, like report_ws_response (or
+    report_ws_error when the values of a broken record can't be compared).
+
+    Returns:
+        List of incidences
+    """
+
+    try:
+        return sie.compare_ws_response(record, RESPONSE)
+    except Exception as error:
+        return [record[0] + sie.WS_ERROR + str(error)]
+
+
+def list_records(registros):
+    """Former layout: a list per record with its own strings, incidences
+    appended to it."""
+
+    records = [
+        [registro.find(tag).text for tag in sie.WS_RECORD_TAGS]
+        for registro in registros
+    ]
+    for record in records:
+        record.extend(incidences(record))
+    return records
+
+
+def tuple_records(registros):
+    """WsRecord per record, incidences only for the records with any."""
+
+    records = [sie.ws_record(registro) for registro in registros]
+    results = {}
+    for record in records:
+        incidencias = incidences(record)
+        if incidencias:
+            results[record] = incidencias
+    return records, results
+
+
+def layout_result(allocated, seconds, records):
+    return {
+        "bytes": allocated,
+        "bytes_per_record": round(allocated / records, 1),
+        "seconds": round(seconds, 4),
+    }
+
+
+def run_layouts(xml_filename):
+    """Measure both layouts over the records of the xml file.
+
+    Returns:
+        Dict layout: result, number of records with incidences
+    """
+
+    # Records with a NOMBRE only, as measured by the former runs
+    document = sie.read_xml_tree(xml_filename)
+    registros = [
+        registro
+        for registro in document.registros
+        if registro.findtext("NOMBRE")
+    ]
+
+    layouts = {}
+    records, allocated, seconds = measured(list_records, registros)
+    layouts["list"] = layout_result(allocated, seconds, len(registros))
+    del records
+
+    (records, results), allocated, seconds = measured(
+        tuple_records, registros
+    )
+    layouts["ws_record"] = layout_result(allocated, seconds, len(registros))
+    return layouts, len(results)
+
+
+def print_results(results, previous=None):
+    print(f"\tRecords:\t{results['params']['records']}")
+    print(f"\tRecords with incidences:\t{results['with_incidences']}")
+    for layout, result in results["layouts"].items():
+        print(
+            f"\t{layout}:\t{result['bytes_per_record']} bytes/record"
+            f"|{result['bytes'] / (1024 * 1024):.1f} MB"
+            f"|{result['seconds']:.3f} s"
+            + vs_previous(
+                previous,
+                ("layouts", layout, "bytes_per_record"),
+                result["bytes_per_record"],
+                lower_is_better=True,
+            )
+        )
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        xml_filename = os.path.join(folder, "bench.xml")
+        write_xml_file(xml_filename, user_args.records, user_args.broken)
+        layouts, with_incidences = run_layouts(xml_filename)
+
+    save_results(
+        user_args,
+        {
+            "params": {
+                "records": user_args.records,
+                "broken": user_args.broken,
+            },
+            "with_incidences": with_incidences,
+            "layouts": layouts,
+        },
+        print_results,
+    )
@@ -0,0 +1,185 @@
+# benchmarks/xml_to_dataframe.py
+"""Benchmark of the dataframe stage: one dict per record given to pandas
+(the former read_xml_to_dataframe) vs the text of each tag extracted
+straight to its column (read_xml_to_dataframe). Each way runs on its own
+process over the same synthetic xml file, measuring records/s and the
+growth of the peak memory (RSS) over the parsed xml tree; results are
+saved on a JSON file to compare runs across versions.
+
+Usage:
+    python benchmarks/xml_to_dataframe.py --records 500000
+    python benchmarks/xml_to_dataframe.py --compare output_files/old.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import validate_xml_sie as sie  # noqa: E402
+from end_to_end import (  # noqa: E402
+    benchmark_parser,
+    parse_benchmark_args,
+    save_results,
+    vs_previous,
+    write_xml_file,
+)
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = benchmark_parser(
+        "xml to dataframe benchmark", "dataframe", records=500000, broken=0.05
+    )
+
+    parser.add_argument(
+        "--path",
+        choices=("rows", "columns"),
+        help=argparse.SUPPRESS,
+    )
+    parser.add_argument(
+        "--xml",
+        help=argparse.SUPPRESS,
+    )
+
+    return parse_benchmark_args(parser)
+
+
+def rows_to_dataframe(document):
+    """Former read_xml_to_dataframe: a dict per record."""
+
+    data = []
+    for elem in document.root:
+        row = {}
+        for subelem in elem:
+            row[subelem.tag] = subelem.text
+        data.append(row)
+    return pd.DataFrame(data)
+
+
+# Path name: function(document) -> dataframe
+PATHS = {
+    "rows": rows_to_dataframe,
+    "columns": sie.read_xml_to_dataframe,
+}
+
+
+def dataframe_fingerprint(frame):
+    """Columns, dtypes and hash of the values (and index) of a dataframe.
+
+    Returns:
+        List
+    """
+
+    return [
+        [str(column) for column in frame.columns],
+        [str(dtype) for dtype in frame.dtypes],
+        int(pd.util.hash_pandas_object(frame).sum()),
+    ]
+
+
+def run_path(name, xml_filename):
+    """Build the dataframe of a xml file one way (on this process).
+
+    Returns:
+        Dict with seconds, peak memory growth and fingerprint
+    """
+
+    document = sie.read_xml_tree(xml_filename)
+    tree_mb = sie.peak_rss_mb()
+
+    start = time.perf_counter()
+    frame = PATHS[name](document)
+    seconds = time.perf_counter() - start
+
+    return {
+        "seconds": seconds,
+        "peak_mb": round(sie.peak_rss_mb() - tree_mb, 1),
+        "fingerprint": dataframe_fingerprint(frame),
+    }
+
+
+def run_paths(xml_filename, num_records):
+    """Run each path on a new process.
+
+    Returns:
+        Dict path: result, True if all the paths build the same dataframe
+    """
+
+    results = {}
+    fingerprints = []
+    for name in PATHS:
+        completed = subprocess.run(
+            [sys.executable, __file__, "--path", name, "--xml", xml_filename],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # Last line, after the progress lines of read_xml_to_dataframe
+        result = json.loads(completed.stdout.splitlines()[-1])
+        fingerprints.append(result["fingerprint"])
+        results[name] = {
+            "seconds": round(result["seconds"], 4),
+            "records_per_s": round(num_records / result["seconds"], 1),
+            "peak_mb": result["peak_mb"],
+        }
+
+    same = all(
+        fingerprint == fingerprints[0] for fingerprint in fingerprints[1:]
+    )
+    return results, same
+
+
+def print_results(results, previous=None):
+    print(f"\tRecords:\t{results['params']['records']}")
+    print(f"\tSame dataframe:\t{results['same_dataframe']}")
+    for name, result in results["paths"].items():
+        print(
+            f"\t{name}:\t{result['seconds']:.3f} s"
+            f"|{result['records_per_s']} records/s"
+            f"|peak +{result['peak_mb']} MB"
+            + vs_previous(
+                previous,
+                ("paths", name, "records_per_s"),
+                result["records_per_s"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+    if user_args.path:
+        print(json.dumps(run_path(user_args.path, user_args.xml)))
+        sys.exit(0)
+
+    with tempfile.TemporaryDirectory() as folder:
+        xml_filename = os.path.join(folder, "bench.xml")
+        write_xml_file(xml_filename, user_args.records, user_args.broken)
+        paths, same = run_paths(xml_filename, user_args.records)
+
+    save_results(
+        user_args,
+        {
+            "params": {
+                "records": user_args.records,
+                "broken": user_args.broken,
+            },
+            "same_dataframe": same,
+            "paths": paths,
+        },
+        print_results,
+    )
+
+    sys.exit(0 if same else 1)
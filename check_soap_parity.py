@@ -0,0 +1,109 @@
+# check_soap_parity.py
+"""Check that suds and RawSoapClient (--soap raw) get the same responses
+of ConsultaDatosCURP. Both clients query the same CURPs on a local fake WS
+RENAPO (names with Ñ and XML special characters, missing fields, CURPs not
+found and SOAP Faults); any difference is shown and the exit code is 1.
+
+Usage:
+    python check_soap_parity.py
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+import style
+from fake_renapo import FakeRenapoServer, build_wsdl
+from renapo_cache import to_renapo_response
+from renapo_client import RawSoapClientFactory, RenapoClientFactory
+
+# CURP: (Nombres, Apellido1, Apellido2) answered by the fake WS RENAPO
+PARITY_PEOPLE = {
+    "PELJ800101HDFRPN09": ("JUAN", "PEREZ", "LOPEZ"),
+    "NUMA900215MJCXXR01": ("MARÍA", "NUÑEZ", "MUÑOZ"),
+    "OBRI750630HNERXN05": ("IAN", "O'BRIEN", None),
+    "SMJO010101HNEXXNA1": ("JOHN & JANE", "<SMITH>", '"JONES"'),
+    "GAXA850505MOCRXN02": ("ANA", "GARCIA", ""),
+}
+# Not on PARITY_PEOPLE, answers CodigoError=1
+CURP_NOT_FOUND = "XEXX010101HNEXXXA4"
+
+
+def client_factory_for(location, wsdl_file):
+    """RenapoClientFactory of a fake WS RENAPO.
+
+    Returns:
+        RenapoClientFactory
+    """
+
+    with open(wsdl_file, mode="w", encoding="utf-8") as f:
+        f.write(build_wsdl(location))
+    return RenapoClientFactory(wsdl_file, location)
+
+
+def query(client_factory, curp):
+    """Response (or "error") of a CURP.
+
+    Returns:
+        RenapoResponse or str
+    """
+
+    client = client_factory.get_client()
+    try:
+        return to_renapo_response(client.service.ConsultaDatosCURP(curp))
+    except Exception:
+        return "error"
+
+
+def check_parity(folder):
+    """Query the parity CURPs with each client, on a server answering them
+    and on a server answering SOAP Faults.
+
+    Returns:
+        List of mismatches (CURP, suds response, raw response)
+    """
+
+    mismatches = []
+    for error_rate in (0.0, 1.0):
+        server = FakeRenapoServer(
+            ("127.0.0.1", 0), PARITY_PEOPLE, error_rate=error_rate
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            suds_factory = client_factory_for(
+                server.location, os.path.join(folder, "parity.wsdl")
+            )
+            raw_factory = RawSoapClientFactory(suds_factory)
+            try:
+                for curp in list(PARITY_PEOPLE) + [CURP_NOT_FOUND]:
+                    expected = query(suds_factory, curp)
+                    got = query(raw_factory, curp)
+                    if got != expected:
+                        mismatches.append((curp, expected, got))
+            finally:
+                raw_factory.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+    return mismatches
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        mismatches = check_parity(folder)
+
+    for curp, expected, got in mismatches:
+        style.change_color(style.RED)
+        print(f"\t{curp}:\tsuds {expected}|raw {got}")
+
+    if mismatches:
+        style.change_color(style.RED)
+        print(f"\tSOAP clients differ on {len(mismatches)} response(s)")
+        sys.exit(1)
+
+    style.change_color(style.GREEN)
+    print(
+        f"\tSame responses:\t{2 * (len(PARITY_PEOPLE) + 1)} queries"
+        " of each client"
+    )
@@ -0,0 +1,112 @@
+# checkpoint.py
+"""Append-only journal of the CURPs already searched on WS RENAPO, so an
+interrupted WS RENAPO stage can be resumed (--resume).
+
+Returns:
+    WsCheckpoint per report file
+"""
+
+import json
+import threading
+
+# Open checkpoint per report file
+_checkpoints = {}
+_checkpoints_lock = threading.Lock()
+
+
+def checkpoint_filename(output_filename):
+    """Checkpoint file of a report file (same timestamp and sequence).
+
+    Returns:
+        .jsonl filename
+    """
+
+    return output_filename.replace("_report.csv", "_checkpoint.jsonl")
+
+
+class WsCheckpoint:
+    """Journal with a JSON line {"curp": ..., "incidences": [...]} for each
+    CURP whose WS RENAPO response was compared with its records.
+
+    Each line is flushed as soon as it's written, so the journal survives
+    a crash of the process. A truncated last line is ignored on load.
+    """
+
+    def __init__(self, checkpoint_file):
+        self.checkpoint_file = checkpoint_file
+        self._lock = threading.Lock()
+        self._file = open(
+            checkpoint_file, mode="a", newline="", encoding="utf-8"
+        )
+
+    def completed(self):
+        """CURPs already on the journal.
+
+        Returns:
+            Dict CURP: list of incidences of its records
+        """
+
+        with self._lock:
+            self._file.flush()
+            completed = {}
+            with open(self.checkpoint_file, encoding="utf-8") as f:
+                for linea in f:
+                    try:
+                        entry = json.loads(linea)
+                    except ValueError:
+                        continue
+                    completed[entry["curp"]] = entry["incidences"]
+        return completed
+
+    def record(self, curp, incidencias):
+        """Journal a completed CURP and the incidences of its records."""
+
+        linea = json.dumps(
+            {"curp": curp, "incidences": incidencias},
+            ensure_ascii=False,
+        )
+        with self._lock:
+            self._file.write(linea + "\n")
+            self._file.flush()
+
+    def record_many(self, entries):
+        """Journal several completed CURPs (curp, incidences) at once."""
+
+        encoder = json.JSONEncoder(ensure_ascii=False)
+        lineas = [
+            encoder.encode({"curp": curp, "incidences": incidencias}) + "\n"
+            for curp, incidencias in entries
+        ]
+        with self._lock:
+            self._file.writelines(lineas)
+            self._file.flush()
+
+    def close(self):
+        """Close the journal file."""
+
+        with self._lock:
+            self._file.close()
+
+
+def get_checkpoint(output_filename):
+    """Get the checkpoint of a report file, opening it on first use only.
+
+    Returns:
+        WsCheckpoint
+    """
+
+    with _checkpoints_lock:
+        checkpoint = _checkpoints.get(output_filename)
+        if checkpoint is None:
+            checkpoint = WsCheckpoint(checkpoint_filename(output_filename))
+            _checkpoints[output_filename] = checkpoint
+    return checkpoint
+
+
+def close_checkpoint(output_filename):
+    """Close the checkpoint of a report file."""
+
+    with _checkpoints_lock:
+        checkpoint = _checkpoints.pop(output_filename, None)
+    if checkpoint is not None:
+        checkpoint.close()
@@ -0,0 +1,216 @@
+# custom_rules.py
+"""Custom Rules of the EMPLEADO tags, read from a config file.
+
+Returns:
+    RulePlan compiled once per rules file
+"""
+
+import hashlib
+import re
+import threading
+from collections import namedtuple
+from configparser import ConfigParser
+
+# Compiled plan per sha256 of the rules file
+_rule_plans = {}
+_rule_plans_lock = threading.Lock()
+
+# Value of each character for the check digit of a CURP
+CURP_ALPHABET = "0123456789ABCDEFGHIJKLMNÑOPQRSTUVWXYZ"
+_CURP_VALUES = {char: value for value, char in enumerate(CURP_ALPHABET)}
+
+# expected: value the tag must have (None: must be empty)
+# regex/allowed/length/check_digit: checks of a non empty value (None: not
+# checked)
+Rule = namedtuple(
+    "Rule",
+    ["tag", "has_expected", "expected", "regex", "allowed", "length",
+     "check_digit", "nullable", "name"],
+)
+
+
+def curp_check_digit(curp):
+    """Check digit of a CURP, from its first 17 characters.
+
+    Returns:
+        Digit as str, None if a character can't be on a CURP
+    """
+
+    total = 0
+    for char, weight in zip(curp[:17], range(18, 1, -1)):
+        value = _CURP_VALUES.get(char)
+        if value is None:
+            return None
+        total += value * weight
+    return str((10 - total % 10) % 10)
+
+
+def valid_curp_check_digit(curp):
+    """Check the last character of a CURP vs its check digit.
+
+    Returns:
+        True or False
+    """
+
+    return len(curp) == 18 and curp_check_digit(curp) == curp[17]
+
+
+# Check digit functions of the rules file (check_digit = curp)
+CHECK_DIGITS = {"curp": valid_curp_check_digit}
+
+
+class RulePlan:
+    """Rules of a rules file, compiled and ready to run.
+
+    Each rule checks one tag, in the order of the file, so the rules are
+    also the columns of the records x rules failure mask.
+    """
+
+    def __init__(self, rules, digest):
+        self.rules = rules
+        self.digest = digest
+        self.tags = [rule.tag for rule in rules]
+        self.column = {tag: index for index, tag in enumerate(self.tags)}
+
+    def failed(self, rule, value):
+        """Check a tag value (None for an empty tag) vs a rule.
+
+        Returns:
+            True if the value breaks the rule
+        """
+
+        if rule.has_expected:
+            return value != rule.expected
+        if value is None:
+            return not rule.nullable
+        if rule.regex is not None and not rule.regex.fullmatch(value):
+            return True
+        if rule.allowed is not None and value not in rule.allowed:
+            return True
+        if rule.length is not None and len(value) != rule.length:
+            return True
+        return rule.check_digit is not None and not rule.check_digit(value)
+
+    def rule_of(self, tag):
+        """Rule of a tag.
+
+        Returns:
+            Rule or None if the tag has no rule
+        """
+
+        index = self.column.get(tag)
+        return None if index is None else self.rules[index]
+
+    def failures(self, frame):
+        """Check every rule over whole columns of a dataframe (one row per
+        EMPLEADO record), checking each distinct value only once.
+
+        Returns:
+            Boolean array records x rules, True on failure
+        """
+
+        # Only the dataframe stage needs them, not --stream
+        import numpy as np
+        import pandas as pd
+
+        frame = frame.reindex(columns=self.tags)
+        masks = []
+        for rule in self.rules:
+            # -1 code: empty value, the last item of failed
+            codes, uniques = pd.factorize(frame[rule.tag])
+            failed = np.array(
+                [self.failed(rule, value) for value in uniques]
+                + [self.failed(rule, None)],
+                dtype=bool,
+            )
+            masks.append(failed[codes])
+
+        return np.column_stack(masks).reshape(len(frame), len(masks))
+
+    def message(self, rule, curp, value):
+        """Incidence of a value that breaks a rule.
+
+        Returns:
+            Report line
+        """
+
+        msg = f"{curp}|Value on xml tag <{rule.tag}>: "
+        if rule.has_expected:
+            return msg + f"{value}, must be {rule.expected}"
+
+        msg += f"{value}, it's not valid"
+        if rule.name:
+            msg += f" ({rule.name})"
+        return msg
+
+
+def compile_rule(tag, section):
+    """Build a Rule from a section of the rules file.
+
+    Returns:
+        Rule
+    """
+
+    has_expected = "expected" in section
+    expected = section.get("expected") or None
+
+    regex = section.get("regex")
+    if regex is not None:
+        regex = re.compile(regex)
+
+    allowed = section.get("allowed")
+    if allowed is not None:
+        allowed = frozenset(value.strip() for value in allowed.split(","))
+
+    length = section.getint("length")
+
+    check_digit = section.get("check_digit")
+    if check_digit is not None:
+        if check_digit not in CHECK_DIGITS:
+            raise ValueError(
+                f"Rule of <{tag}>: unknown check_digit {check_digit}"
+            )
+        check_digit = CHECK_DIGITS[check_digit]
+
+    if has_expected and (regex or allowed or length or check_digit):
+        raise ValueError(
+            f"Rule of <{tag}>: expected can't be used with regex, "
+            "allowed, length or check_digit"
+        )
+
+    return Rule(
+        tag,
+        has_expected,
+        expected,
+        regex,
+        allowed,
+        length,
+        check_digit,
+        section.getboolean("nullable", fallback=True),
+        section.get("name", ""),
+    )
+
+
+def load_rule_plan(rules_file):
+    """Get the compiled plan of a rules file, compiling it only the first
+    time its content is seen on this process.
+
+    Returns:
+        RulePlan
+    """
+
+    with open(rules_file, mode="rb") as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+
+    with _rule_plans_lock:
+        plan = _rule_plans.get(digest)
+        if plan is None:
+            config = ConfigParser(interpolation=None)
+            config.read_string(content.decode("utf-8"), source=rules_file)
+            rules = [
+                compile_rule(tag, config[tag]) for tag in config.sections()
+            ]
+            plan = RulePlan(rules, digest)
+            _rule_plans[digest] = plan
+    return plan
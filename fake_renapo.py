@@ -0,0 +1,264 @@
+# fake_renapo.py
+"""Local stand-in of WS RENAPO (ConsultaDatosCURP) to try the WS engines.
+
+Usage:
+    python fake_renapo.py --write-wsdl archivo_wsdl/fake_renapo.wsdl
+    python fake_renapo.py --port 8099 --xml Example.xml --latency 0.05
+    python fake_renapo.py --port 8099 --error-rate 0.1
+
+With --xml the CURPs of the file answer with their own names (so only the
+CURP vs XML checks report incidences) and any other CURP answers
+CodigoError=1. Without --xml every CURP answers JUAN PEREZ LOPEZ.
+With --error-rate that share of the queries answer HTTP 500 (SOAP Fault).
+"""
+
+import argparse
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+import lxml.etree as ET
+
+import style
+
+NAMESPACE = "urn:fake-renapo"
+
+WSDL_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<definitions xmlns="http://schemas.xmlsoap.org/wsdl/"
+    xmlns:soap="http://schemas.xmlsoap.org/wsdl/soap/"
+    xmlns:xsd="http://www.w3.org/2001/XMLSchema"
+    xmlns:tns="{namespace}"
+    targetNamespace="{namespace}" name="ConsultaCURP">
+  <types>
+    <xsd:schema targetNamespace="{namespace}"
+        elementFormDefault="qualified">
+      <xsd:element name="ConsultaDatosCURP">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="curp" type="xsd:string"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+      <xsd:element name="ConsultaDatosCURPResponse">
+        <xsd:complexType><xsd:sequence>
+          <xsd:element name="CodigoError" type="xsd:int"/>
+          <xsd:element name="Nombres" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="Apellido1" type="xsd:string" minOccurs="0"/>
+          <xsd:element name="Apellido2" type="xsd:string" minOccurs="0"/>
+        </xsd:sequence></xsd:complexType>
+      </xsd:element>
+    </xsd:schema>
+  </types>
+  <message name="ConsultaDatosCURPRequest">
+    <part name="parameters" element="tns:ConsultaDatosCURP"/>
+  </message>
+  <message name="ConsultaDatosCURPResponse">
+    <part name="parameters" element="tns:ConsultaDatosCURPResponse"/>
+  </message>
+  <portType name="ConsultaPort">
+    <operation name="ConsultaDatosCURP">
+      <input message="tns:ConsultaDatosCURPRequest"/>
+      <output message="tns:ConsultaDatosCURPResponse"/>
+    </operation>
+  </portType>
+  <binding name="ConsultaBinding" type="tns:ConsultaPort">
+    <soap:binding style="document"
+        transport="http://schemas.xmlsoap.org/soap/http"/>
+    <operation name="ConsultaDatosCURP">
+      <soap:operation soapAction="ConsultaDatosCURP"/>
+      <input><soap:body use="literal"/></input>
+      <output><soap:body use="literal"/></output>
+    </operation>
+  </binding>
+  <service name="ConsultaService">
+    <port name="ConsultaPort" binding="tns:ConsultaBinding">
+      <soap:address location="{location}"/>
+    </port>
+  </service>
+</definitions>
+"""
+
+RESPONSE_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">'
+    "<S:Body>"
+    '<ns0:ConsultaDatosCURPResponse xmlns:ns0="{namespace}">'
+    "<ns0:CodigoError>{codigo_error}</ns0:CodigoError>"
+    "{datos}"
+    "</ns0:ConsultaDatosCURPResponse>"
+    "</S:Body>"
+    "</S:Envelope>"
+)
+
+FAULT_RESPONSE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<S:Envelope xmlns:S="http://schemas.xmlsoap.org/soap/envelope/">'
+    "<S:Body><S:Fault>"
+    "<faultcode>S:Server</faultcode>"
+    "<faultstring>Servicio no disponible</faultstring>"
+    "</S:Fault></S:Body>"
+    "</S:Envelope>"
+).encode("utf-8")
+
+DEFAULT_PERSON = ("JUAN", "PEREZ", "LOPEZ")
+
+_CURP_XPATH = ET.XPath("string(//*[local-name()='curp'][1])")
+
+
+def read_user_cli_args():
+    """Handles the CLI user interactions.
+
+    Returns:
+        argparse.Namespace: Populated namespace object
+    """
+    parser = argparse.ArgumentParser(description="fake WS RENAPO server")
+
+    parser.add_argument("--host", default="127.0.0.1", help="listen host")
+    parser.add_argument("--port", type=int, default=8099, help="listen port")
+    parser.add_argument(
+        "--xml",
+        help="answer with the names of the CURPs of this xml file",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="seconds to wait before each response",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="share of queries (0 to 1) that answer HTTP 500",
+    )
+    parser.add_argument(
+        "--write-wsdl",
+        help="write the WSDL of this server to a file and exit",
+    )
+
+    return parser.parse_args()
+
+
+def build_wsdl(location):
+    """WSDL of the fake service.
+
+    Returns:
+        WSDL text
+    """
+
+    return WSDL_TEMPLATE.format(namespace=NAMESPACE, location=location)
+
+
+def read_people(xml_filename):
+    """Names of every CURP on a SIE xml file, as RENAPO would answer.
+
+    Returns:
+        Dict CURP: (Nombres, Apellido1, Apellido2)
+    """
+
+    people = {}
+    for registro in ET.parse(xml_filename).getroot().iter("EMPLEADO"):
+        names = []
+        for tag in ("NOMBRE", "APELLIDO_PATERNO", "APELLIDO_MATERNO"):
+            value = registro.findtext(tag)
+            names.append(value.replace("#", "Ñ") if value else None)
+        people[registro.findtext("CURP")] = tuple(names)
+    return people
+
+
+def build_response(person):
+    """ConsultaDatosCURP response for a person (None: CURP not found).
+
+    Returns:
+        bytes
+    """
+
+    if person is None:
+        return RESPONSE_TEMPLATE.format(
+            namespace=NAMESPACE, codigo_error=1, datos=""
+        ).encode("utf-8")
+
+    datos = ""
+    for field, value in zip(("Nombres", "Apellido1", "Apellido2"), person):
+        if value is not None:
+            datos += f"<ns0:{field}>{escape(value)}</ns0:{field}>"
+    return RESPONSE_TEMPLATE.format(
+        namespace=NAMESPACE, codigo_error=0, datos=datos
+    ).encode("utf-8")
+
+
+class FakeRenapoHandler(BaseHTTPRequestHandler):
+    """ConsultaDatosCURP over HTTP/1.1 keep-alive."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body on a single send, like a real server: on a kept-alive
+    # connection a separate small write of the body waits for the delayed
+    # ACK of the client (Nagle)
+    wbufsize = -1
+
+    def do_GET(self):
+        content = build_wsdl(self.server.location).encode("utf-8")
+        self._send(200, content)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        curp = _CURP_XPATH(ET.fromstring(self.rfile.read(length)))
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if random.random() < self.server.error_rate:
+            self._send(500, FAULT_RESPONSE)
+            return
+
+        if self.server.people is None:
+            person = DEFAULT_PERSON
+        else:
+            person = self.server.people.get(curp)
+        self._send(200, build_response(person))
+
+    def _send(self, status, content):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeRenapoServer(ThreadingHTTPServer):
+    """Threaded HTTP server with room for hundreds of pending connections."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, people=None, latency=0.0, error_rate=0.0):
+        super().__init__(address, FakeRenapoHandler)
+        self.people = people
+        self.latency = latency
+        self.error_rate = error_rate
+        host, port = self.server_address[:2]
+        self.location = f"http://{host}:{port}/ws"
+
+
+if __name__ == "__main__":
+    user_args = read_user_cli_args()
+
+    if user_args.write_wsdl:
+        location = f"http://{user_args.host}:{user_args.port}/ws"
+        with open(user_args.write_wsdl, mode="w", encoding="utf-8") as f:
+            f.write(build_wsdl(location))
+        print(f"\tWSDL File:\t{user_args.write_wsdl}")
+    else:
+        people = read_people(user_args.xml) if user_args.xml else None
+        server = FakeRenapoServer(
+            (user_args.host, user_args.port),
+            people,
+            user_args.latency,
+            user_args.error_rate,
+        )
+        style.change_color(style.GREEN)
+        print(f"\tFake WS RENAPO:\t{server.location}")
+        style.change_color(style.RESET)
+        server.serve_forever()
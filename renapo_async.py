@@ -0,0 +1,185 @@
+# renapo_async.py
+"""asyncio engine for WS RENAPO queries (--engine async).
+
+Returns:
+    Responses of ConsultaDatosCURP for a list of records
+"""
+
+import asyncio
+import time
+
+import aiohttp
+
+from renapo_soap import parse_consulta_response
+
+# Seconds an idle keep-alive connection stays open
+KEEPALIVE_TIMEOUT = 30
+
+
+async def _consulta(session, template, curp, ws_timeout):
+    async with session.post(
+        template.url,
+        data=template.render(curp),
+        headers=template.headers,
+        timeout=aiohttp.ClientTimeout(total=ws_timeout),
+    ) as response:
+        content = await response.read()
+        return parse_consulta_response(response.status, content)
+
+
+async def _attempt(
+    session,
+    template,
+    curp,
+    ws_timeout,
+    controller,
+    condition,
+    metrics,
+):
+    # One query, under the limit of the AdaptiveConcurrency controller
+    if controller is not None:
+        async with condition:
+            await condition.wait_for(
+                lambda: controller.in_flight < controller.limit
+            )
+            controller.in_flight += 1
+
+    start = time.perf_counter()
+    try:
+        response_ws = await _consulta(session, template, curp, ws_timeout)
+    except asyncio.TimeoutError:
+        response_ws = TimeoutError(f"timeout after {ws_timeout} s")
+    except Exception as error:
+        response_ws = error
+
+    latency = time.perf_counter() - start
+    if controller is not None:
+        async with condition:
+            controller.in_flight -= 1
+            controller.record(latency, isinstance(response_ws, Exception))
+            condition.notify_all()
+    if metrics is not None:
+        metrics.record_query(latency, isinstance(response_ws, Exception))
+
+    return response_ws
+
+
+async def _worker(
+    session,
+    template,
+    records,
+    ws_timeout,
+    on_response,
+    controller,
+    condition,
+    retry_policy,
+    metrics,
+):
+    for record_data in records:
+        attempt = 0
+        while True:
+            if retry_policy is not None:
+                wait = retry_policy.breaker.wait_time()
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = retry_policy.breaker.wait_time()
+
+            response_ws = await _attempt(
+                session,
+                template,
+                record_data[0],
+                ws_timeout,
+                controller,
+                condition,
+                metrics,
+            )
+            if retry_policy is None:
+                break
+
+            if not isinstance(response_ws, Exception):
+                retry_policy.breaker.record_success()
+                break
+
+            retry_policy.breaker.record_failure()
+            if attempt >= retry_policy.retries:
+                break
+            await asyncio.sleep(retry_policy.delay(attempt))
+            attempt += 1
+
+        on_response(record_data, response_ws)
+
+
+async def _query_all(
+    records,
+    template,
+    in_flight,
+    ws_timeout,
+    on_response,
+    controller,
+    retry_policy,
+    metrics,
+):
+    # Event loop version of AdaptiveConcurrency.acquire/release
+    condition = asyncio.Condition()
+
+    connector = aiohttp.TCPConnector(
+        limit=in_flight,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # All the workers share the same iterator, so each record is sent once
+        records = iter(records)
+        await asyncio.gather(
+            *(
+                _worker(
+                    session,
+                    template,
+                    records,
+                    ws_timeout,
+                    on_response,
+                    controller,
+                    condition,
+                    retry_policy,
+                    metrics,
+                )
+                for _ in range(in_flight)
+            )
+        )
+
+
+def query_all_async(
+    records,
+    template,
+    in_flight,
+    ws_timeout,
+    on_response,
+    controller=None,
+    retry_policy=None,
+    metrics=None,
+):
+    """Send ConsultaDatosCURP for every record with at most in_flight
+    requests at the same time (or the limit of an AdaptiveConcurrency
+    controller), on keep-alive connections. Failed requests are retried
+    according to retry_policy. Each request is registered on metrics
+    (RunMetrics) when given.
+
+    on_response(record_data, response_ws) is called on the event loop
+    thread with a RenapoResponse, or the Exception raised by the request.
+    """
+
+    if not records:
+        return
+
+    in_flight = max(1, min(in_flight, len(records)))
+    asyncio.run(
+        _query_all(
+            records,
+            template,
+            in_flight,
+            ws_timeout,
+            on_response,
+            controller,
+            retry_policy,
+            metrics,
+        )
+    )
@@ -0,0 +1,167 @@
+# renapo_cache.py
+"""Persistent on-disk cache for WS RENAPO (ConsultaDatosCURP) responses.
+
+Returns:
+    RenapoCache object shared by all the WS workers of a run
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+CACHE_MODES = ("use", "refresh", "off")
+
+# Only the fields of ConsultaDatosCURP that we compare against the XML data
+RenapoResponse = namedtuple(
+    "RenapoResponse",
+    ["CodigoError", "Nombres", "Apellido1", "Apellido2"],
+)
+
+# Commit pending writes every N new responses
+COMMIT_EVERY = 200
+
+
+def to_renapo_response(response_ws):
+    """Keep only the fields we need from a WS RENAPO response object.
+
+    Returns:
+        RenapoResponse namedtuple
+    """
+
+    return RenapoResponse(
+        getattr(response_ws, "CodigoError", None),
+        getattr(response_ws, "Nombres", None),
+        getattr(response_ws, "Apellido1", None),
+        getattr(response_ws, "Apellido2", None),
+    )
+
+
+class RenapoCache:
+    """SQLite cache of RENAPO responses keyed by CURP.
+
+    mode="use" reads and writes the cache, mode="refresh" ignores cached
+    values but stores the new responses, mode="off" disables the cache.
+    """
+
+    def __init__(self, cache_file, ttl_days, max_entries, mode="use"):
+        self.cache_file = cache_file
+        self.ttl_seconds = float(ttl_days) * 24 * 60 * 60
+        self.max_entries = int(max_entries)
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if self.mode == "off":
+            return
+
+        cache_dir = os.path.dirname(cache_file)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(cache_file, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS renapo_cache ("
+            " curp TEXT PRIMARY KEY,"
+            " codigo_error INTEGER,"
+            " nombres TEXT,"
+            " apellido1 TEXT,"
+            " apellido2 TEXT,"
+            " fetched_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_renapo_cache_fetched_at"
+            " ON renapo_cache (fetched_at)"
+        )
+        self._conn.commit()
+
+    def get(self, curp):
+        """Look for a non-expired response of a CURP.
+
+        Returns:
+            RenapoResponse or None on a cache miss
+        """
+
+        if self._conn is None:
+            return None
+
+        with self._lock:
+            row = None
+            if self.mode == "use":
+                row = self._conn.execute(
+                    "SELECT codigo_error, nombres, apellido1, apellido2"
+                    " FROM renapo_cache WHERE curp = ? AND fetched_at >= ?",
+                    (curp, time.time() - self.ttl_seconds),
+                ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return RenapoResponse(*row)
+
+    def put(self, curp, response_ws):
+        """Store (or replace) the response of a CURP."""
+
+        if self._conn is None:
+            return
+
+        response = to_renapo_response(response_ws)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO renapo_cache"
+                " (curp, codigo_error, nombres, apellido1, apellido2, fetched_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (curp, *response, time.time()),
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self._conn.commit()
+                self._pending = 0
+
+    def evict(self):
+        """Delete expired responses and the oldest ones above max_entries.
+
+        Returns:
+            Number of deleted rows
+        """
+
+        if self._conn is None:
+            return 0
+
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM renapo_cache WHERE fetched_at < ?",
+                (time.time() - self.ttl_seconds,),
+            ).rowcount
+
+            (total,) = self._conn.execute(
+                "SELECT COUNT(*) FROM renapo_cache"
+            ).fetchone()
+            if total > self.max_entries:
+                deleted += self._conn.execute(
+                    "DELETE FROM renapo_cache WHERE curp IN ("
+                    " SELECT curp FROM renapo_cache"
+                    " ORDER BY fetched_at ASC LIMIT ?)",
+                    (total - self.max_entries,),
+                ).rowcount
+
+            self._conn.commit()
+            self._pending = 0
+
+        return deleted
+
+    def close(self):
+        """Apply eviction and close the database."""
+
+        if self._conn is None:
+            return
+
+        self.evict()
+        self._conn.close()
+        self._conn = None
@@ -0,0 +1,330 @@
+# renapo_client.py
+"""Clients for the WS RENAPO (ConsultaDatosCURP) Web Service.
+
+Returns:
+    Client factories shared by the WS workers of a run
+"""
+
+import os
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import suds.cache
+from suds.client import Client
+
+from renapo_soap import ConsultaDatosCURPTemplate, RawSoapClient
+
+# Parsed WSDL per (wsdl_file, ws_url), loaded once per process
+_client_factories = {}
+_client_factories_lock = threading.Lock()
+
+# Seconds between checks of a half-open circuit breaker
+HALF_OPEN_POLL = 0.5
+
+
+def wsdl_file_url(wsdl_file):
+    """Build the file: URL of a local WSDL file.
+
+    Returns:
+        URL string
+    """
+
+    return urllib.parse.urljoin(
+        "file:",
+        urllib.request.pathname2url(os.path.abspath(wsdl_file)),
+    )
+
+
+class _WsdlMemoryCache(suds.cache.Cache):
+    """suds cache that keeps the parsed WSDL objects in memory."""
+
+    def __init__(self):
+        self._objects = {}
+
+    def get(self, id):
+        return self._objects.get(id)
+
+    def put(self, id, object):
+        self._objects[id] = object
+        return object
+
+    def purge(self, id):
+        self._objects.pop(id, None)
+
+    def clear(self):
+        self._objects.clear()
+
+
+class RenapoClientFactory:
+    """Parse the WSDL once and give each worker thread its own client.
+
+    Client.clone() fails on Python 3.11 (recursion on deepcopy of the
+    options), so the parsed WSDL is shared through a suds object cache
+    (cachingpolicy=1) and each new Client reuses it without parsing.
+    """
+
+    def __init__(self, wsdl_file, ws_url):
+        self.wsdl_url = wsdl_file_url(wsdl_file)
+        self.ws_url = ws_url
+        self._wsdl_cache = _WsdlMemoryCache()
+        self._local = threading.local()
+        self._request_template = None
+
+        start = time.perf_counter()
+        self.new_client()
+        self.load_time = time.perf_counter() - start
+
+    def new_client(self):
+        """New suds client that reuses the parsed WSDL.
+
+        Returns:
+            suds.client.Client
+        """
+
+        client = Client(
+            self.wsdl_url,
+            cache=self._wsdl_cache,
+            cachingpolicy=1,
+        )
+        client.set_options(location=self.ws_url)
+        return client
+
+    def get_client(self):
+        """suds client of the current thread, sharing the parsed WSDL.
+
+        Returns:
+            suds.client.Client
+        """
+
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self.new_client()
+            self._local.client = client
+        return client
+
+    def request_template(self):
+        """Raw request of ConsultaDatosCURP, built on first use only.
+
+        Returns:
+            ConsultaDatosCURPTemplate
+        """
+
+        if self._request_template is None:
+            self._request_template = ConsultaDatosCURPTemplate(self)
+        return self._request_template
+
+
+class RawSoapClientFactory:
+    """Give each worker thread of a run its own RawSoapClient (and its
+    keep-alive connection), built from the request template of a
+    RenapoClientFactory. close() closes all the connections of the run.
+    """
+
+    def __init__(self, client_factory):
+        self.ws_url = client_factory.ws_url
+        self._template = client_factory.request_template()
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        """RawSoapClient of the current thread.
+
+        Returns:
+            RawSoapClient
+        """
+
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = RawSoapClient(self._template)
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    def request_template(self):
+        return self._template
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = self._clients, []
+        for client in clients:
+            client.close()
+
+
+class CircuitBreaker:
+    """Pause all the WS workers while WS RENAPO is down.
+
+    After threshold consecutive failed queries the circuit opens and every
+    worker waits cooldown seconds. Then a single query is let through: if
+    it works the circuit closes, if it fails it opens again. threshold=0
+    turns off the circuit breaker.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.opened = 0
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """Seconds to wait before sending a query (0: send it now).
+
+        Returns:
+            float
+        """
+
+        with self._lock:
+            if not self.threshold or self._failures < self.threshold:
+                return 0.0
+
+            remaining = self._open_until - time.monotonic()
+            if remaining > 0:
+                return remaining
+
+            # Half-open, only one query tests the WS
+            if not self._probing:
+                self._probing = True
+                return 0.0
+            return HALF_OPEN_POLL
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.threshold and (
+                self._probing or self._failures == self.threshold
+            ):
+                self._open_until = time.monotonic() + self.cooldown
+                self._probing = False
+                self.opened += 1
+
+
+class RetryPolicy:
+    """Retries with jittered exponential backoff for each WS query."""
+
+    def __init__(self, retries, base_delay, max_delay, breaker):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def delay(self, attempt):
+        """Seconds to wait before retry number attempt + 1 (full jitter).
+
+        Returns:
+            float
+        """
+
+        with self._lock:
+            self.retried += 1
+        return random.uniform(
+            0,
+            min(self.max_delay, self.base_delay * 2**attempt),
+        )
+
+
+def consulta_datos_curp(
+    client,
+    curp,
+    controller=None,
+    retry_policy=None,
+    metrics=None,
+):
+    """Call ConsultaDatosCURP, retrying failed queries and waiting while
+    the circuit breaker is open when a RetryPolicy is given. Each request
+    is registered on metrics (RunMetrics) when given.
+
+    Returns:
+        suds response object (RenapoResponse with a RawSoapClient)
+    """
+
+    if retry_policy is None:
+        return _consulta_datos_curp(client, curp, controller, metrics)
+
+    attempt = 0
+    while True:
+        wait = retry_policy.breaker.wait_time()
+        while wait > 0:
+            time.sleep(wait)
+            wait = retry_policy.breaker.wait_time()
+
+        try:
+            response_ws = _consulta_datos_curp(
+                client, curp, controller, metrics
+            )
+        except Exception:
+            retry_policy.breaker.record_failure()
+            if attempt >= retry_policy.retries:
+                raise
+            time.sleep(retry_policy.delay(attempt))
+            attempt += 1
+            continue
+
+        retry_policy.breaker.record_success()
+        return response_ws
+
+
+def _consulta_datos_curp(client, curp, controller, metrics):
+    # One query, under the limit of the AdaptiveConcurrency controller
+    if controller is None and metrics is None:
+        return client.service.ConsultaDatosCURP(curp)
+
+    if controller is not None:
+        controller.acquire()
+    start = time.perf_counter()
+    try:
+        response_ws = client.service.ConsultaDatosCURP(curp)
+    except Exception:
+        latency = time.perf_counter() - start
+        if controller is not None:
+            controller.release(latency, error=True)
+        if metrics is not None:
+            metrics.record_query(latency, error=True)
+        raise
+    latency = time.perf_counter() - start
+    if controller is not None:
+        controller.release(latency)
+    if metrics is not None:
+        metrics.record_query(latency)
+    return response_ws
+
+
+def client_factory_loaded(wsdl_file, ws_url):
+    """Was the WSDL already parsed by this process?
+
+    Returns:
+        True if get_client_factory will reuse a parsed WSDL
+    """
+
+    key = (os.path.abspath(wsdl_file), ws_url)
+    with _client_factories_lock:
+        return key in _client_factories
+
+
+def get_client_factory(wsdl_file, ws_url):
+    """Get the client factory of a WSDL, parsing it on first use only.
+
+    Returns:
+        RenapoClientFactory
+    """
+
+    key = (os.path.abspath(wsdl_file), ws_url)
+    with _client_factories_lock:
+        factory = _client_factories.get(key)
+        if factory is None:
+            factory = RenapoClientFactory(wsdl_file, ws_url)
+            _client_factories[key] = factory
+    return factory
@@ -0,0 +1,164 @@
+# renapo_soap.py
+"""Raw SOAP messages of ConsultaDatosCURP, without the suds object model.
+
+Returns:
+    Request template and response parser for the WS RENAPO engines
+"""
+
+import http.client
+import urllib.parse
+from xml.sax.saxutils import escape
+
+import lxml.etree as ET
+
+from renapo_cache import RenapoResponse
+
+# Placeholder CURP used to build the request template with suds
+CURP_MARKER = "CURPMARKER00000000"
+
+# Seconds to wait for each query of RawSoapClient (same as suds)
+RAW_SOAP_TIMEOUT = 90
+
+# Errors of a keep-alive connection closed by the server between queries
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+_FIELD_XPATH = {
+    field: ET.XPath(f"string(//*[local-name()='{field}'][1])")
+    for field in RenapoResponse._fields
+}
+_HAS_FIELD_XPATH = {
+    field: ET.XPath(f"boolean(//*[local-name()='{field}'][1]/node())")
+    for field in RenapoResponse._fields
+}
+_FAULT_XPATH = ET.XPath("string(//*[local-name()='faultstring'][1])")
+
+
+class RenapoSoapError(Exception):
+    """Error answer (HTTP status or SOAP Fault) of WS RENAPO."""
+
+    def __init__(self, status, message):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+class ConsultaDatosCURPTemplate:
+    """Request envelope of ConsultaDatosCURP, built once with suds."""
+
+    def __init__(self, client_factory):
+        client = client_factory.new_client()
+        client.set_options(nosend=True)
+        method = client.service.ConsultaDatosCURP
+
+        envelope = method(CURP_MARKER).envelope
+        self.prefix, self.suffix = envelope.split(CURP_MARKER.encode())
+        self.url = client_factory.ws_url
+        self.headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": method.method.soap.action,
+        }
+
+    def render(self, curp):
+        """Request envelope for a CURP.
+
+        Returns:
+            bytes
+        """
+
+        return self.prefix + escape(curp).encode("utf-8") + self.suffix
+
+
+def parse_consulta_response(status, content):
+    """Extract the fields of a ConsultaDatosCURP response.
+
+    Returns:
+        RenapoResponse namedtuple
+    """
+
+    try:
+        document = ET.fromstring(content)
+    except ET.XMLSyntaxError as error:
+        raise RenapoSoapError(status, f"invalid response ({error})")
+
+    fault = _FAULT_XPATH(document)
+    if fault or status != 200:
+        raise RenapoSoapError(status, fault or "no SOAP response")
+
+    values = []
+    for field in RenapoResponse._fields:
+        if _HAS_FIELD_XPATH[field](document):
+            values.append(_FIELD_XPATH[field](document))
+        else:
+            values.append(None)
+
+    codigo_error = values[0]
+    values[0] = int(codigo_error) if codigo_error is not None else None
+    return RenapoResponse(*values)
+
+
+class RawSoapClient:
+    """ConsultaDatosCURP without suds: the request template is filled with
+    the CURP and posted over a keep-alive connection, the response is read
+    with the precompiled XPaths of parse_consulta_response.
+
+    Called like a suds client (client.service.ConsultaDatosCURP(curp)), a
+    client (and its connection) is used by one thread only.
+    """
+
+    def __init__(self, template, timeout=RAW_SOAP_TIMEOUT):
+        self.template = template
+        self.timeout = timeout
+        self.service = self
+
+        url = urllib.parse.urlsplit(template.url)
+        if url.scheme == "https":
+            self._connection_class = http.client.HTTPSConnection
+        else:
+            self._connection_class = http.client.HTTPConnection
+        self._netloc = url.netloc
+        self._path = url.path or "/"
+        if url.query:
+            self._path += "?" + url.query
+        self._connection = None
+
+    def ConsultaDatosCURP(self, curp):
+        """Query a CURP.
+
+        Returns:
+            RenapoResponse namedtuple
+        """
+
+        body = self.template.render(curp)
+        try:
+            status, content = self._post(body)
+        except _STALE_CONNECTION_ERRORS:
+            # The server closed the kept-alive connection, once more on a
+            # new one
+            self.close()
+            status, content = self._post(body)
+        except Exception:
+            self.close()
+            raise
+        return parse_consulta_response(status, content)
+
+    def _post(self, body):
+        if self._connection is None:
+            self._connection = self._connection_class(
+                self._netloc, timeout=self.timeout
+            )
+        self._connection.request(
+            "POST", self._path, body, self.template.headers
+        )
+        response = self._connection.getresponse()
+        content = response.read()
+        if response.will_close:
+            self.close()
+        return response.status, content
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,168 @@
+# report_writer.py
+"""Buffered writer of the report files, shared by the worker threads.
+
+Returns:
+    ReportWriter per report file
+"""
+
+import atexit
+import queue
+import threading
+
+# Lines written between flushes of the report file
+FLUSH_EVERY = 500
+# Seconds without new lines before flushing the pending ones
+FLUSH_INTERVAL = 1.0
+
+# Open writer per report file
+_report_writers = {}
+_report_writers_lock = threading.Lock()
+
+# Markers sent through the queue of a writer
+_FLUSH = object()
+_CLOSE = object()
+
+
+class ReportWriter:
+    """Keep a report file open and write its lines from a single thread.
+
+    Lines from any thread go through a queue, so they never interleave and
+    keep the order they were sent. The file is flushed every FLUSH_EVERY
+    lines, after FLUSH_INTERVAL seconds without new lines and on close.
+
+    If a write fails (disk full, encoding error) the later lines are
+    dropped and the error is raised again by flush() and close().
+    """
+
+    def __init__(self, output_filename):
+        self.output_filename = output_filename
+        self._file = open(
+            output_filename, mode="a", newline="", encoding="utf-8"
+        )
+        self._lines = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run,
+            name="report-writer",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def write(self, linea):
+        """Queue a line for the report file."""
+
+        self._lines.put(linea)
+
+    def write_lines(self, lineas):
+        """Queue several lines for the report file, in a single item."""
+
+        self._lines.put(list(lineas))
+
+    def flush(self):
+        """Wait until every queued line is on the report file."""
+
+        self._lines.put(_FLUSH)
+        self._lines.join()
+        self._raise_error()
+
+    def close(self):
+        """Write the queued lines and close the report file."""
+
+        self._lines.put(_CLOSE)
+        self._thread.join()
+        try:
+            self._file.close()
+        except Exception as error:
+            if self._error is None:
+                self._error = error
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        pending = 0
+        while True:
+            try:
+                linea = self._lines.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                if pending:
+                    pending = 0
+                    try:
+                        self._file.flush()
+                    except Exception as error:
+                        self._error = error
+                continue
+
+            try:
+                if linea is _CLOSE:
+                    return
+                # Lines after a failed write are dropped
+                if self._error is not None:
+                    continue
+
+                if linea is _FLUSH:
+                    self._file.flush()
+                    pending = 0
+                    continue
+
+                if isinstance(linea, list):
+                    self._file.write("".join(item + "\n" for item in linea))
+                    pending += len(linea)
+                else:
+                    self._file.write(linea + "\n")
+                    pending += 1
+                if pending >= FLUSH_EVERY:
+                    self._file.flush()
+                    pending = 0
+            except Exception as error:
+                self._error = error
+            finally:
+                self._lines.task_done()
+
+
+def get_report_writer(output_filename):
+    """Get the writer of a report file, opening it on first use only.
+
+    Returns:
+        ReportWriter
+    """
+
+    with _report_writers_lock:
+        writer = _report_writers.get(output_filename)
+        if writer is None:
+            writer = ReportWriter(output_filename)
+            _report_writers[output_filename] = writer
+    return writer
+
+
+def close_report_writer(output_filename):
+    """Write the pending lines of a report file and close it."""
+
+    with _report_writers_lock:
+        writer = _report_writers.pop(output_filename, None)
+    if writer is not None:
+        writer.close()
+
+
+def close_report_writers():
+    """Close every open report file (also run at exit, even after a crash).
+    The first write error of any of them is raised after closing them all.
+    """
+
+    with _report_writers_lock:
+        writers = list(_report_writers.values())
+        _report_writers.clear()
+    first_error = None
+    for writer in writers:
+        try:
+            writer.close()
+        except Exception as error:
+            if first_error is None:
+                first_error = error
+    if first_error is not None:
+        raise first_error
+
+
+atexit.register(close_report_writers)
@@ -0,0 +1,239 @@
+# results_store.py
+"""Persistent on-disk store of the incidences of each EMPLEADO record, so a
+rerun only validates the new or changed records of a xml file.
+
+Returns:
+    ResultsStore object shared by the stages of a run
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+RESULTS_MODES = ("use", "refresh", "off")
+
+# Hashes per SELECT, below the SQLite limit of host parameters
+LOOKUP_BATCH = 500
+
+# Seconds to wait while another process (--jobs) writes on the store
+BUSY_TIMEOUT = 30
+
+
+def _digest(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def record_hash(fields):
+    """Stable hash of the (tag, value) pairs of a record. Empty tags are
+    skipped and the order of the tags doesn't matter.
+
+    Returns:
+        Hex digest
+    """
+
+    return _digest(
+        "\x1e".join(
+            [
+                tag + "\x1f" + value
+                for tag, value in sorted(fields)
+                if value is not None
+            ]
+        )
+    )
+
+
+def record_hashes(frame):
+    """record_hash of each row of a dataframe (one row per record).
+
+    Returns:
+        List of hex digests, in the order of the rows
+    """
+
+    tags = sorted(frame.columns)
+    prefixes = [tag + "\x1f" for tag in tags]
+    rows = frame[tags].to_numpy(dtype=object, na_value=None).tolist()
+    return [
+        _digest(
+            "\x1e".join(
+                [
+                    prefix + value
+                    for prefix, value in zip(prefixes, row)
+                    if value is not None
+                ]
+            )
+        )
+        for row in rows
+    ]
+
+
+def file_digest(filename):
+    """sha256 of the content of a file.
+
+    Returns:
+        Hex digest, empty if the file doesn't exist
+    """
+
+    try:
+        with open(filename, mode="rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return ""
+
+
+def context_hash(*parts):
+    """Hash of what checks the records of a stage (rules file, XSD file,
+    WS URL...), stored along with each result.
+
+    Returns:
+        Hex digest
+    """
+
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+class ResultsStore:
+    """SQLite store of the incidences of each record, keyed by the context
+    of the stage and the record_hash of the record.
+
+    mode="use" reads and writes the store, mode="refresh" ignores stored
+    results but saves the new ones, mode="off" disables the store.
+    """
+
+    def __init__(self, results_file, ttl_days, max_entries, mode="use"):
+        self.results_file = results_file
+        self.ttl_seconds = float(ttl_days) * 24 * 60 * 60
+        self.max_entries = int(max_entries)
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._conn = None
+
+        if self.mode == "off":
+            return
+
+        results_dir = os.path.dirname(results_file)
+        if results_dir:
+            os.makedirs(results_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(
+            results_file,
+            timeout=BUSY_TIMEOUT,
+            check_same_thread=False,
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS record_results ("
+            " context TEXT NOT NULL,"
+            " record_hash TEXT NOT NULL,"
+            " incidences TEXT NOT NULL,"
+            " stored_at REAL NOT NULL,"
+            " PRIMARY KEY (context, record_hash))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_record_results_stored_at"
+            " ON record_results (stored_at)"
+        )
+        self._conn.commit()
+
+    def get_many(self, context, hashes):
+        """Look for the non-expired results of several records.
+
+        Returns:
+            Dict record_hash: list of incidences, only for the stored ones
+        """
+
+        if self._conn is None or self.mode != "use":
+            return {}
+
+        stored = {}
+        hashes = list(dict.fromkeys(hashes))
+        oldest = time.time() - self.ttl_seconds
+        with self._lock:
+            for start in range(0, len(hashes), LOOKUP_BATCH):
+                batch = hashes[start : start + LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    "SELECT record_hash, incidences FROM record_results"
+                    " WHERE context = ? AND stored_at >= ?"
+                    " AND record_hash IN ("
+                    + ",".join("?" * len(batch))
+                    + ")",
+                    (context, oldest, *batch),
+                )
+                for key, incidences in rows:
+                    stored[key] = json.loads(incidences)
+        return stored
+
+    def get(self, context, key):
+        """Look for the non-expired result of a record.
+
+        Returns:
+            List of incidences or None if it isn't stored
+        """
+
+        return self.get_many(context, [key]).get(key)
+
+    def put_many(self, context, results):
+        """Store (or replace) the incidences of several records.
+
+        results: iterable of (record_hash, list of incidences)
+        """
+
+        if self._conn is None:
+            return
+
+        # The last result of each record
+        results = dict(results)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO record_results"
+                " (context, record_hash, incidences, stored_at)"
+                " VALUES (?, ?, ?, ?)",
+                (
+                    (context, key, json.dumps(incidences), now)
+                    for key, incidences in results.items()
+                ),
+            )
+            self._conn.commit()
+
+    def evict(self):
+        """Delete expired results and the oldest ones above max_entries.
+
+        Returns:
+            Number of deleted rows
+        """
+
+        if self._conn is None:
+            return 0
+
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM record_results WHERE stored_at < ?",
+                (time.time() - self.ttl_seconds,),
+            ).rowcount
+
+            (total,) = self._conn.execute(
+                "SELECT COUNT(*) FROM record_results"
+            ).fetchone()
+            if total > self.max_entries:
+                deleted += self._conn.execute(
+                    "DELETE FROM record_results WHERE rowid IN ("
+                    " SELECT rowid FROM record_results"
+                    " ORDER BY stored_at ASC LIMIT ?)",
+                    (total - self.max_entries,),
+                ).rowcount
+
+            self._conn.commit()
+
+        return deleted
+
+    def close(self):
+        """Apply eviction and close the database."""
+
+        if self._conn is None:
+            return
+
+        self.evict()
+        self._conn.close()
+        self._conn = None
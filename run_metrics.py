@@ -0,0 +1,188 @@
+# run_metrics.py
+"""Wall time of each stage and latency of each WS RENAPO query of a run
+(--metrics), saved on a JSON file next to the report file.
+
+Returns:
+    RunMetrics per report file
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from adaptive_concurrency import percentile
+
+# Upper bounds (seconds) of the buckets of the WS RENAPO latency histogram
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Metrics being collected per report file
+_run_metrics = {}
+_run_metrics_lock = threading.Lock()
+
+
+def metrics_filename(output_filename):
+    """Metrics file of a report file (same timestamp and sequence).
+
+    Returns:
+        .json filename
+    """
+
+    return output_filename.replace("_report.csv", "_metrics.json")
+
+
+class RunMetrics:
+    """Stage times, WS RENAPO query latencies and counters of a run.
+
+    record_query is called by the WS workers (threads or event loop) once
+    for each request sent, including the retries.
+    """
+
+    def __init__(self, output_filename):
+        self.output_filename = output_filename
+        self.stages = {}
+        self.ws = {}
+        self.peak_rss_mb = None
+        self.latencies = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        """Add wall time to a stage (a stage can run more than once)."""
+
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record_query(self, latency, error=False):
+        """Register a request to WS RENAPO and its latency."""
+
+        with self._lock:
+            self.latencies.append(latency)
+            if error:
+                self.errors += 1
+
+    def latency_summary(self):
+        """Percentiles and histogram of the WS RENAPO request latencies.
+
+        Returns:
+            Dict (empty if there were no requests)
+        """
+
+        if not self.latencies:
+            return {}
+
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for latency in self.latencies:
+            bucket = 0
+            while (
+                bucket < len(LATENCY_BUCKETS)
+                and latency > LATENCY_BUCKETS[bucket]
+            ):
+                bucket += 1
+            counts[bucket] += 1
+
+        return {
+            "p50_s": percentile(self.latencies, 50),
+            "p95_s": percentile(self.latencies, 95),
+            "p99_s": percentile(self.latencies, 99),
+            "max_s": max(self.latencies),
+            "mean_s": sum(self.latencies) / len(self.latencies),
+            "histogram": [
+                {"up_to_s": upper, "count": count}
+                for upper, count in zip(LATENCY_BUCKETS + (None,), counts)
+            ],
+        }
+
+    def to_dict(self):
+        ws = dict(self.ws)
+        ws["requests"] = len(self.latencies)
+        ws["request_errors"] = self.errors
+        ws["latency"] = self.latency_summary()
+        return {
+            "report": os.path.abspath(self.output_filename),
+            "stages_s": self.stages,
+            "ws_renapo": ws,
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+
+    def load(self, metrics_file):
+        """Continue the metrics saved by another process (--jobs)."""
+
+        with open(metrics_file, encoding="utf-8") as f:
+            saved = json.load(f)
+        self.stages.update(saved["stages_s"])
+        self.peak_rss_mb = saved["peak_rss_mb"]
+
+    def save(self, peak_rss_mb):
+        """Write the metrics file.
+
+        Returns:
+            Metrics filename
+        """
+
+        if peak_rss_mb is not None:
+            self.peak_rss_mb = max(peak_rss_mb, self.peak_rss_mb or 0)
+
+        metrics_file = metrics_filename(self.output_filename)
+        with open(metrics_file, mode="w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return metrics_file
+
+
+def start_metrics(output_filename):
+    """Start collecting the metrics of a report file, continuing its
+    metrics file if a --jobs process already saved one.
+
+    Returns:
+        RunMetrics
+    """
+
+    with _run_metrics_lock:
+        metrics = _run_metrics.get(output_filename)
+        if metrics is None:
+            metrics = RunMetrics(output_filename)
+            metrics_file = metrics_filename(output_filename)
+            if os.path.isfile(metrics_file):
+                metrics.load(metrics_file)
+            _run_metrics[output_filename] = metrics
+    return metrics
+
+
+def get_metrics(output_filename):
+    """Metrics of a report file.
+
+    Returns:
+        RunMetrics or None if --metrics is off
+    """
+
+    with _run_metrics_lock:
+        return _run_metrics.get(output_filename)
+
+
+def finish_metrics(output_filename, peak_rss_mb=None):
+    """Save the metrics file of a report file and stop collecting.
+
+    Returns:
+        Metrics filename or None if --metrics is off
+    """
+
+    with _run_metrics_lock:
+        metrics = _run_metrics.pop(output_filename, None)
+    if metrics is None:
+        return None
+    return metrics.save(peak_rss_mb)
+
+
+@contextlib.contextmanager
+def stage_timer(output_filename, name):
+    """Add the wall time of the with block to a stage of the metrics of a
+    report file (nothing if --metrics is off)."""
+
+    metrics = get_metrics(output_filename)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.add_stage(name, time.perf_counter() - start)
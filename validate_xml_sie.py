@@ -7,159 +7,125 @@ Returns:
 
 import argparse
 import datetime
+import glob
+import importlib
+import itertools
+import json
 import os
 import queue
 import re
-import urllib
-from concurrent.futures import ThreadPoolExecutor
+import sys
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from configparser import ConfigParser
-from io import StringIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
 
 import lxml.etree as ET
-import pandas as pd
-from suds.client import Client
-from tqdm import tqdm
-
-import style
-
-
-def valida_curp(data):
-    """
-
-    Returns:
-
-    """
-
-    curp_ex = re.compile(CURP_PATTERN)
-    return bool(curp_ex.fullmatch(data))
-
-
-def valida_sexo(data):
-    """
-
-    Returns:
-
-    """
-
-    sexo_ex = re.compile(SEXO_PATTERN)
-    return bool(sexo_ex.fullmatch(data))
-
-
-def valida_lug_nac(data):
-    """
-
-    Returns:
-
-    """
-
-    lug_nac_ex = re.compile(LUG_NAC_PATTERN)
-    return bool(lug_nac_ex.fullmatch(data))
-
-
-def valida_dia(data):
-    """
-
-    Returns:
 
-    """
-
-    dia_ex = re.compile(DIA_PATTERN)
-    return bool(dia_ex.fullmatch(data))
-
-
-def valida_mes(data):
-    """
-
-    Returns:
-
-    """
-
-    mes_ex = re.compile(MES_PATTERN)
-    return bool(mes_ex.fullmatch(data))
-
-
-def valida_anio(data):
-    """
-
-    Returns:
-
-    """
-
-    anio_ex = re.compile(ANIO_PATTERN)
-    return bool(anio_ex.fullmatch(data))
-
-
-def valida_desc_ocupa(data):
-    """
-
-    Returns:
-
-    """
-
-    des_ocupa_ex = re.compile(DESC_OCUP_PATTERN)
-    return bool(des_ocupa_ex.fullmatch(data))
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
 
+# pandas, numpy, tqdm, suds (renapo_client) and aiohttp (renapo_async) are
+# imported by the stages that use them, so --help, --stream or a run
+# without --renapo_check don't pay their import time
+import style
+from adaptive_concurrency import AdaptiveConcurrency
+from checkpoint import checkpoint_filename, close_checkpoint, get_checkpoint
+from custom_rules import load_rule_plan
+from renapo_cache import (
+    CACHE_MODES,
+    RenapoCache,
+    RenapoResponse,
+    to_renapo_response,
+)
+from run_metrics import (
+    finish_metrics,
+    get_metrics,
+    stage_timer,
+    start_metrics,
+)
+from results_store import (
+    RESULTS_MODES,
+    ResultsStore,
+    context_hash,
+    file_digest,
+    record_hash,
+    record_hashes,
+)
+from report_writer import (
+    close_report_writer,
+    close_report_writers,
+    get_report_writer,
+)
 
-def valida_cp(data):
-    """
-
-    Returns:
 
-    """
+RENAPO_GENDER = {"H": "1", "M": "2"}
 
-    cp_ex = re.compile(CP_PATTERN)
-    return bool(cp_ex.fullmatch(data))
+EXPORT_FORMATS = ("csv", "parquet", "feather", "none")
+EXPORT_COMPRESSION = "zstd"
+# Tags with a part of a date, exported as integers when their text has no
+# leading zeros
+DATE_PART_PREFIXES = ("DIA_", "MES_", "ANIO_")
+# Columns with up to this share of distinct values are exported as
+# categoricals
+CATEGORY_MAX_SHARE = 0.5
+
+# Heavy modules imported by the stages that use them
+LAZY_MODULES = ("numpy", "pandas", "tqdm", "renapo_client", "renapo_async")
+
+# Tags of the data searched on WS RENAPO (see ws_record)
+WS_RECORD_TAGS = (
+    "CURP",
+    "NOMBRE",
+    "APELLIDO_PATERNO",
+    "APELLIDO_MATERNO",
+    "SEXO",
+    "LUGAR_NACIMIENTO",
+    "DIA_NACIMIENTO",
+    "MES_NACIMIENTO",
+    "ANIO_NACIMIENTO",
+)
 
+# Data of an EMPLEADO element searched on WS RENAPO, a tuple without
+# __dict__. Its incidences are kept apart, on the results dict of the stage
+WsRecord = namedtuple("WsRecord", [tag.lower() for tag in WS_RECORD_TAGS])
 
-def valida_nomb_ap(data):
-    """
+# Clients for ConsultaDatosCURP of the serial and threads engines: raw
+# SOAP over keep-alive connections, or suds (fallback)
+SOAP_CLIENTS = ("raw", "suds")
 
-    Returns:
+# WS RENAPO responses compared at once with their records (see WsResponses)
+WS_COMPARE_BATCH = 2000
+# Max seconds a response waits to be compared, and its CURP journaled
+WS_COMPARE_INTERVAL = 0.5
 
-    """
+# Incidence of a failed WS RENAPO query
+WS_ERROR = "|Error? (WS-RENAPO)"
 
-    nombre_ex = re.compile(NOMBRE_PATTERN)
-    return bool(nombre_ex.fullmatch(data))
+# First line of the WS RENAPO stage on the report, --resume goes on from it
+WS_STAGE_START = "# Search data on WS RENAPO..."
 
+# Records per chunk of the Custom Rules processes (--rule-jobs)
+RULE_CHUNK_RECORDS = 50000
 
-# Dictionaries for simple checks
-simple_checks = {
-    "TRAMITE": "0",
-    "NSS": None,
-    "DIGITO_VERIFICADOR": None,
-    "NOMBRE_PADRE": None,
-    "APELLIDO_PATERNO_PADRE": None,
-    "APELLIDO_MATERNO_PADRE": None,
-    "NOMBRE_MADRE": None,
-    "APELLIDO_PATERNO_MADRE": None,
-    "APELLIDO_MATERNO_MADRE": None,
-    "SALARIO_BASE": "0000.00",
-    "JORNADA_SEMANA": "0",
-    "TIPO_SALARIO": "1",
-    "OCUPACION": "ESTUDIANTE",
-    "TIPO_TRABAJO": "2",
-    "TRAMITADO": "0",
-}
+# New results saved at once on the results store with --stream
+STORE_BATCH_RECORDS = 1000
 
-# Dictionaries for validations
-validation_checks = {
-    "CURP": valida_curp,
-    "NOMBRE": valida_nomb_ap,
-    "APELLIDO_PATERNO": valida_nomb_ap,
-    "APELLIDO_MATERNO": valida_nomb_ap,
-    "SEXO": valida_sexo,
-    "LUGAR_NACIMIENTO": valida_lug_nac,
-    "DIA_NACIMIENTO": valida_dia,
-    "MES_NACIMIENTO": valida_mes,
-    "ANIO_NACIMIENTO": valida_anio,
-    "DIA_INGRESO": valida_dia,
-    "MES_INGRESO": valida_mes,
-    "ANIO_INGRESO": valida_anio,
-    "DESCRIPCION_OCUPACION": valida_desc_ocupa,
-    "CODIGO_POSTAL": valida_cp,
-}
+# Seconds for the jittered exponential backoff between WS RENAPO retries
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 30
 
-RENAPO_GENDER = {"H": "1", "M": "2"}
+# Compiled XSD per (path, modification time), kept between --serve jobs
+_xsd_schemas = {}
 
 RENAPO_ST = {
     "AS": "01",
@@ -197,23 +163,9 @@ RENAPO_ST = {
     "ZS": "32",
 }
 
-SEXO_PATTERN = r"[12]"
-LUG_NAC_PATTERN = r"(0[1-9]|[1-2][0-9]|3[0-2])|35"
-DIA_PATTERN = r"(0[1-9]|1[0-9]|2[0-9]|3[0-1])"
-MES_PATTERN = r"(0[1-9]|1[0-2])"
-ANIO_PATTERN = r"([1][9][0-9][0-9])|([2][0][0-9][0-9])"
-DESC_OCUP_PATTERN = r"(MEDIO SUPERIOR|SUPERIOR|POSGRADO|EDUCACION A DISTANCIA)"
-CP_PATTERN = r"([0-9]{5})"
-NOMBRE_PATTERN = r"[A-Z# ]+$"
-CURP_PATTERN = (
-    r"([A-Z]{4}([0-9]{2})(0[1-9]|1[0-2])(0[1-9]|1[0-9]|2[0-9]|3[0-1])[HM]"
-    r"(AS|BC|BS|CC|CL|CM|CS|CH|DF|DG|GT|GR|HG|JC|MC|MN|MS|NT|NL|OC|PL|QT|QR|SP|SL|SR|TC|TS|TL|VZ|YN|ZS|NE)"
-    r"[A-Z]{3}[0-9A-Z]\d)"
-)
-
 
-def read_user_cli_args():
-    """Handles the CLI user interactions.
+def read_user_cli_args(argv=None):
+    """Handles the CLI user interactions (argv: arguments of a --serve job).
 
     Returns:
         argparse.Namespace: Populated namespace object
@@ -224,9 +176,9 @@ def read_user_cli_args():
 
     parser.add_argument(
         "xml_file",
-        nargs="+",
+        nargs="*",
         type=str,
-        help="enter the xml filename",
+        help="enter the xml filenames (also folders and glob patterns)",
     )
     parser.add_argument(
         "-x",
@@ -246,8 +198,138 @@ def read_user_cli_args():
         action="store_true",
         help="use threads",
     )
+    parser.add_argument(
+        "-s",
+        "--stream",
+        action="store_true",
+        help=(
+            "walk the xml file record by record (flat memory, no CSV; with"
+            " -r the data to search on WS RENAPO is still kept, a small"
+            " tuple per record)"
+        ),
+    )
+    parser.add_argument(
+        "--cache-mode",
+        choices=CACHE_MODES,
+        default="use",
+        help="use, refresh or turn off the local WS RENAPO cache",
+    )
+    parser.add_argument(
+        "--results-mode",
+        choices=RESULTS_MODES,
+        default="use",
+        help="reuse the incidences of records already validated, refresh "
+        "or turn off the local results store",
+    )
+    parser.add_argument(
+        "--export-format",
+        choices=EXPORT_FORMATS,
+        default="csv",
+        help="file format of the dataframe of the xml file (none: don't "
+        "export it)",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=("threads", "async"),
+        default="threads",
+        help="engine for WS RENAPO queries",
+    )
+    parser.add_argument(
+        "--soap",
+        choices=SOAP_CLIENTS,
+        default="raw",
+        help="client for WS RENAPO queries with the serial and threads "
+        "engines (suds: the former, slower one)",
+    )
+    parser.add_argument(
+        "--in-flight",
+        type=int,
+        default=200,
+        help="max simultaneous WS RENAPO queries with --engine async",
+    )
+    parser.add_argument(
+        "--ws-timeout",
+        type=float,
+        default=30,
+        help="seconds to wait for each WS RENAPO query with --engine async",
+    )
+    parser.add_argument(
+        "--concurrency",
+        choices=("fixed", "adaptive"),
+        default="fixed",
+        help="fixed number of WS RENAPO workers or tune it while running",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=64,
+        help="max threads with --concurrency adaptive "
+        "(--in-flight with --engine async)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="retries of each failed WS RENAPO query",
+    )
+    parser.add_argument(
+        "--breaker-threshold",
+        type=int,
+        default=10,
+        help="consecutive failed WS RENAPO queries that pause all the "
+        "workers (0: never pause)",
+    )
+    parser.add_argument(
+        "--breaker-cooldown",
+        type=float,
+        default=30,
+        help="seconds to pause the workers when WS RENAPO is down",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="processes to check several xml files at the same time",
+    )
+    parser.add_argument(
+        "--rule-jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="processes to check the Custom Rules of a big xml file",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="save stage times, WS RENAPO latencies and peak memory on a "
+        "JSON file next to the report file",
+    )
+    parser.add_argument(
+        "--resume",
+        metavar="REPORT",
+        help="continue the WS RENAPO stage of a report file, skipping the "
+        "CURPs already on its checkpoint",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="keep running and take validation jobs over localhost HTTP",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="listen host with --serve",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="listen port with --serve",
+    )
 
-    return parser.parse_args()
+    user_args = parser.parse_args(argv)
+    if not (user_args.xml_file or user_args.serve or user_args.resume):
+        parser.error("the following arguments are required: xml_file")
+    return user_args
 
 
 def _get_ws_url():
@@ -268,12 +350,61 @@ def _get_xsd_file():
     return config["files"]["xsd_file"]
 
 
+def _get_rules_file():
+    config = ConfigParser()
+    config.read("secrets.ini")
+    return config.get("files", "rules_file", fallback="custom_rules.ini")
+
+
+def _get_cache_settings():
+    config = ConfigParser()
+    config.read("secrets.ini")
+    cache_file = config.get(
+        "cache",
+        "cache_file",
+        fallback="./output_files/renapo_cache.sqlite3",
+    )
+    ttl_days = config.getfloat("cache", "ttl_days", fallback=30)
+    max_entries = config.getint("cache", "max_entries", fallback=500000)
+    return cache_file, ttl_days, max_entries
+
+
+def _get_results_settings():
+    config = ConfigParser()
+    config.read("secrets.ini")
+    results_file = config.get(
+        "results",
+        "results_file",
+        fallback="./output_files/results_store.sqlite3",
+    )
+    ttl_days = config.getfloat("results", "ttl_days", fallback=30)
+    max_entries = config.getint("results", "max_entries", fallback=5000000)
+    return results_file, ttl_days, max_entries
+
+
+def open_results_store(results_mode):
+    """Open the local store of the incidences of each record.
+
+    Returns:
+        ResultsStore
+    """
+
+    results_file, ttl_days, max_entries = _get_results_settings()
+    return ResultsStore(results_file, ttl_days, max_entries, results_mode)
+
+
 def create_report_file(
     xml_filename,
     xsd_filename,
     xsd_check,
     renapo_check,
     use_threads,
+    stream,
+    cache_mode,
+    results_mode,
+    export_format,
+    engine,
+    concurrency,
 ):
     """Create output report file.
 
@@ -294,8 +425,32 @@ def create_report_file(
     lineas.append(comment)
     comment = "# use_threads:" + str(use_threads)
     lineas.append(comment)
+    comment = "# stream:" + str(stream)
+    lineas.append(comment)
+    comment = "# cache_mode:" + cache_mode
+    lineas.append(comment)
+    comment = "# results_mode:" + results_mode
+    lineas.append(comment)
+    comment = "# export_format:" + export_format
+    lineas.append(comment)
+    comment = "# engine:" + engine
+    lineas.append(comment)
+    comment = "# concurrency:" + concurrency
+    lineas.append(comment)
+
+    # Jobs of --serve and --jobs can start on the same second
+    sequence = 1
+    while True:
+        try:
+            f = open(output_filename, mode="x", newline="", encoding="utf-8")
+            break
+        except FileExistsError:
+            output_filename = (
+                f"./output_files/{timestamp}_{sequence}_report.csv"
+            )
+            sequence += 1
 
-    with open(output_filename, mode="w+", newline="", encoding="utf-8") as f:
+    with f:
         for linea in lineas:
             f.write(linea + "\n")
 
@@ -313,11 +468,9 @@ def check_xml_input_file(input_xml, output_filename):
         True or False
     """
     xml_file_path = os.path.join("./")
-    file_exist = False
-
-    for filename in os.listdir(xml_file_path):
-        if filename.endswith(".xml") and filename == input_xml:
-            file_exist = True
+    file_exist = input_xml.endswith(".xml") and os.path.isfile(
+        os.path.join(xml_file_path, input_xml)
+    )
 
     if not file_exist:
         style.change_color(style.RED)
@@ -330,68 +483,160 @@ def check_xml_input_file(input_xml, output_filename):
     return file_exist
 
 
+class XmlDocument:
+    """XML file parsed once and shared by all the stages of a run."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.root = tree.getroot()
+        self.registros = self.root.findall(".//EMPLEADO")
+
+
 def read_xml_tree(input_xml_filename):
     """
 
     Returns:
-
+        XmlDocument with the parsed tree and its EMPLEADO elements
     """
     # Parse XML
     xml_file_path = os.path.join("./", input_xml_filename)
 
     tree = ET.parse(xml_file_path)
-    root_xml = tree.getroot()
 
-    return root_xml
+    return XmlDocument(tree)
 
 
-def read_xml_to_dataframe(root_xml):
-    """
+def read_xml_to_dataframe(document):
+    """Dataframe with a row per EMPLEADO element of the xml file and a
+    column per tag, in the order the tags first appear (missing tags are
+    empty). The text of each tag goes straight to the list of its column,
+    created the first time the tag is seen, and the frame is built from
+    the columns. Comments and processing instructions are skipped.
 
     Returns:
-
+        pandas.DataFrame
     """
+
+    import pandas as pd
+
     style.change_color(style.WHITE)
     linea_reporte = "Exporting XML file to dataframe"
     print(linea_reporte)
 
-    # Extract data
-    data = []
-    for elem in root_xml:
-        row = {}
-        for subelem in elem:
-            row[subelem.tag] = subelem.text
-        data.append(row)
+    # Extract data, column by column
+    num_registros = len(document.registros)
+    columns = {}
+    for row, elem in enumerate(document.registros):
+        for subelem in elem.iterchildren(ET.Element):
+            column = columns.get(subelem.tag)
+            if column is None:
+                column = [None] * num_registros
+                columns[subelem.tag] = column
+            column[row] = subelem.text
 
-    df_datos = pd.DataFrame(data)
+    df_datos = pd.DataFrame(columns, index=pd.RangeIndex(num_registros))
 
     return df_datos
 
 
-def dataframe_to_csv(df_info, output_filename):
+def typed_dataframe(df_info):
+    """Dataframe with typed columns for a binary export: the parts of the
+    dates (DIA_, MES_, ANIO_ tags) as integers and the codes with few
+    distinct values as categoricals. A date part is only converted when
+    every value reads back the same ("01" and "1" would both be 1), so
+    zero-padded ones stay as categoricals or text.
+
+    Returns:
+        New dataframe, df_info isn't changed
     """
 
+    import pandas as pd
+
+    typed = {}
+    for tag in df_info.columns:
+        column = df_info[tag]
+        categorical = column.astype("category")
+        categories = categorical.cat.categories
+
+        if tag.startswith(DATE_PART_PREFIXES) and (
+            categories.str.fullmatch(r"0|[1-9][0-9]{0,3}").all()
+        ):
+            typed[tag] = pd.to_numeric(column).astype("UInt16")
+        elif len(categories) <= len(column) * CATEGORY_MAX_SHARE:
+            typed[tag] = categorical
+        else:
+            typed[tag] = column
+
+    return pd.DataFrame(typed)
+
+
+def export_dataframe(df_info, export_format, output_filename):
+    """Export the dataframe of the xml file as CSV (with its index, as
+    always), compressed Parquet or Feather with typed columns, or nothing
+    (export_format none). Export time and file size go on the report.
+
     Returns:
 
     """
 
+    if export_format == "none":
+        linea_reporte = "# Dataframe export skipped (export_format: none)"
+        style.change_color(style.WHITE)
+        print(f"{linea_reporte}")
+        save_on_report(output_filename, linea_reporte)
+        return
+
     style.change_color(style.WHITE)
-    linea_reporte = "Exporting dataframe to CSV File"
+    linea_reporte = f"Exporting dataframe to {export_format.upper()} File"
     print(linea_reporte)
 
-    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S")
-    output_csv_file = f"./output_files/{timestamp}_dataframe.csv"
-
-    df_info.to_csv(output_csv_file, encoding="utf-8")
+    # Same timestamp (and sequence) of its report file
+    output_export_file = output_filename.replace(
+        "_report.csv", "_dataframe." + export_format
+    )
 
-    linea_reporte = "# Output CSV File generated: " + output_csv_file
+    start = time.perf_counter()
+    try:
+        if export_format == "csv":
+            df_info.to_csv(output_export_file, encoding="utf-8")
+        elif export_format == "parquet":
+            typed_dataframe(df_info).to_parquet(
+                output_export_file,
+                compression=EXPORT_COMPRESSION,
+                index=False,
+            )
+        else:
+            typed_dataframe(df_info).to_feather(
+                output_export_file,
+                compression=EXPORT_COMPRESSION,
+            )
+    except ImportError as error:
+        # Parquet and Feather need pyarrow
+        style.change_color(style.RED)
+        linea_reporte = (
+            f"# Error exporting dataframe to {export_format}|{error}"
+        )
+        print(f"\t{linea_reporte}")
+        save_on_report(output_filename, linea_reporte)
+        return
+    elapsed = time.perf_counter() - start
+    size_mb = os.path.getsize(output_export_file) / (1024 * 1024)
 
+    linea_reporte = (
+        f"# Output {export_format.upper()} File generated: "
+        + output_export_file
+    )
     style.change_color(style.GREEN)
     print(f"\t{linea_reporte}")
     save_on_report(output_filename, linea_reporte)
 
+    linea_reporte = f"# Export time: {elapsed:.3f} s|Size: {size_mb:.2f} MB"
+    style.change_color(style.WHITE)
+    print(f"\t{linea_reporte}")
+    save_on_report(output_filename, linea_reporte)
+
 
-def validate_vs_xsd(input_xml, xsd_filename, xsd_check, output_filename):
+def validate_vs_xsd(document, xsd_filename, xsd_check, output_filename):
     """
 
     Returns:
@@ -417,19 +662,15 @@ def validate_vs_xsd(input_xml, xsd_filename, xsd_check, output_filename):
         print(f"{linea_reporte}", end="\n")
         save_on_report(output_filename, linea_reporte)
 
-        xml_file_path = os.path.join("./", input_xml)
-        xsd_file_path = os.path.join("./archivo_xsd/", xsd_filename)
-        xsd_file_path = StringIO(xsd_file_path)
-
-        xmlschema = ET.XMLSchema(ET.parse(xsd_file_path))
-        tree = ET.parse(xml_file_path)
+        xmlschema = load_xsd_schema(xsd_filename)
 
-        if xmlschema.validate(tree):
+        if xmlschema.validate(document.tree):
             style.change_color(style.GREEN)
             linea_reporte = "# XML CORRECTO vs Definición XSD"
         else:
             style.change_color(style.RED)
             linea_reporte = "# XML MAL FORMADO contra definición XSD"
+            linea_reporte += "|" + str(xmlschema.error_log.last_error)
 
         print(f"\t{linea_reporte}")
         save_on_report(output_filename, linea_reporte)
@@ -445,51 +686,86 @@ def validate_vs_xsd(input_xml, xsd_filename, xsd_check, output_filename):
         print("Validation error:", ve)
 
 
-def append_incidencia(
-    element,
-    xml_tag,
-    xml_value,
-    expected_value,
+def validate_vs_xsd_stream(
+    input_xml,
+    xsd_filename,
+    xsd_check,
     output_filename,
-    lista_inc,
 ):
-    """
+    """Validate XML vs XSD while walking the file with iterparse (--stream).
 
     Returns:
 
     """
 
-    msg = f"{element}|Value on xml tag <{xml_tag}>: "
-    msg += f"{xml_value}, must be {expected_value}"
-    lista_inc.append(msg)
-    save_on_report(output_filename, msg)
+    style.change_color(style.WHITE)
+    linea_reporte = "# Validating XML VS XSD Definition file..."
+    print(linea_reporte)
+    save_on_report(output_filename, linea_reporte)
 
+    if not xsd_check:
+        linea_reporte = "# ...xsd_check=False. Won't check vs XSD File"
+        style.change_color(style.YELLOW)
+        print(f"{linea_reporte}", end="\n")
+        save_on_report(output_filename, linea_reporte)
+        return
 
-def append_validation_failure(
-    element,
-    xml_tag,
-    xml_value,
-    validation_function,
-    function_name,
-    output_filename,
-    lista_inc,
-):
-    """
+    try:
+        style.change_color(style.WHITE)
+        linea_reporte = "# ...xsd_check=True. Initiate check vs XSD File"
+        print(f"{linea_reporte}", end="\n")
+        save_on_report(output_filename, linea_reporte)
+
+        xmlschema = load_xsd_schema(xsd_filename)
+
+        try:
+            for _ in iter_xml_records(input_xml, xmlschema):
+                pass
+            style.change_color(style.GREEN)
+            linea_reporte = "# XML CORRECTO vs Definición XSD"
+        except ET.XMLSyntaxError as error:
+            style.change_color(style.RED)
+            linea_reporte = "# XML MAL FORMADO contra definición XSD"
+            linea_reporte += "|" + str(error)
+
+        print(f"\t{linea_reporte}")
+        save_on_report(output_filename, linea_reporte)
+
+    except FileNotFoundError:
+        style.change_color(style.RED)
+        print("File not found.")
+    except ET.ParseError:
+        style.change_color(style.RED)
+        print("Error parsing XML file.")
+    except ValueError as ve:
+        style.change_color(style.RED)
+        print("Validation error:", ve)
 
-    Returns:
 
+def load_xsd_schema(xsd_filename):
+    """Compile the XSD file of archivo_xsd folder.
+
+    Returns:
+        lxml.etree.XMLSchema
     """
 
-    if not validation_function(xml_value):
-        msg = f"{element}|Value on xml tag <{xml_tag}>: "
-        msg += f"{xml_value}, it's not valid"
-        if function_name:
-            msg += f" ({function_name})"
-        lista_inc.append(msg)
-        save_on_report(output_filename, msg)
+    xsd_file_path = os.path.join("./archivo_xsd/", xsd_filename)
+    key = (os.path.abspath(xsd_file_path), os.path.getmtime(xsd_file_path))
+    xmlschema = _xsd_schemas.get(key)
+    if xmlschema is None:
+        xmlschema = ET.XMLSchema(ET.parse(xsd_file_path))
+        _xsd_schemas[key] = xmlschema
+    return xmlschema
 
 
-def validate_custom_rules(root_data, output_filename):
+def validate_custom_rules(
+    df_datos,
+    rule_plan,
+    rule_jobs,
+    store,
+    context,
+    output_filename,
+):
     """
 
     Returns:
@@ -502,94 +778,15 @@ def validate_custom_rules(root_data, output_filename):
     save_on_report(output_filename, linea_reporte)
 
     try:
-        num_registros = 0
-        num_incidencias = 0
-        # Validate specific tag elements
-        for registro in root_data.findall(".//EMPLEADO"):
-            num_registros += 1
-            lista_incidencias = []
-
-            # Extract CURP value
-            curp_element = registro.find("CURP").text
-
-            if curp_element is None:
-                num_incidencias += 1
-                msg_error = "CURP element not found in XML on record # " + str(
-                    num_registros
-                )
-                raise ValueError(msg_error)
-
-            curp_value = curp_element
-
-            # print("Buscando CURP: " + curp_value )
-            if curp_value:
-                # Extract CURP value
-                tramite_xml = registro.find("TRAMITE").text
-                nss_xml = registro.find("NSS").text
-                tmp = registro.find("DIGITO_VERIFICADOR").text
-                digito_verificador_xml = tmp
-                curp_xml = registro.find("CURP").text
-                nombre_xml = registro.find("NOMBRE").text
-                apellido_paterno_xml = registro.find("APELLIDO_PATERNO").text
-                apellido_materno_xml = registro.find("APELLIDO_MATERNO").text
-                sexo_xml = registro.find("SEXO").text
-                lugar_nacimiento_xml = registro.find("LUGAR_NACIMIENTO").text
-                dia_nacimiento_xml = registro.find("DIA_NACIMIENTO").text
-                mes_nacimiento_xml = registro.find("MES_NACIMIENTO").text
-                anio_nacimiento_xml = registro.find("ANIO_NACIMIENTO").text
-                nombre_padre_xml = registro.find("NOMBRE_PADRE").text
-                apellido_paterno_padre_xml = registro.find(
-                    "APELLIDO_PATERNO_PADRE"
-                ).text
-                apellido_materno_padre_xml = registro.find(
-                    "APELLIDO_MATERNO_PADRE"
-                ).text
-                nombre_madre_xml = registro.find("NOMBRE_MADRE").text
-                apellido_paterno_madre_xml = registro.find(
-                    "APELLIDO_PATERNO_MADRE"
-                ).text
-                apellido_materno_madre_xml = registro.find(
-                    "APELLIDO_MATERNO_MADRE"
-                ).text
-                dia_ingreso_xml = registro.find("DIA_INGRESO").text
-                mes_ingreso_xml = registro.find("MES_INGRESO").text
-                anio_ingreso_xml = registro.find("ANIO_INGRESO").text
-                salario_base_xml = registro.find("SALARIO_BASE").text
-                jornada_semana_xml = registro.find("JORNADA_SEMANA").text
-                tipo_salario_xml = registro.find("TIPO_SALARIO").text
-                ocupacion_xml = registro.find("OCUPACION").text
-                tmp = registro.find("DESCRIPCION_OCUPACION").text
-                descripcion_ocupacion_xml = tmp
-                tipo_trabajo_xml = registro.find("TIPO_TRABAJO").text
-                codigo_postal_xml = registro.find("CODIGO_POSTAL").text
-                tramitado_xml = registro.find("TRAMITADO").text
-
-                # Implement simple checks
-                for tag, expected_value in simple_checks.items():
-                    value = locals()[f"{tag.lower()}_xml"]
-                    if value != expected_value:
-                        append_incidencia(
-                            curp_element,
-                            tag,
-                            value,
-                            expected_value,
-                            output_filename,
-                            lista_incidencias,
-                        )
-
-                # Implement validation checks
-                for tag, function in validation_checks.items():
-                    value = locals()[f"{tag.lower()}_xml"]
-                    if value is not None:
-                        append_validation_failure(
-                            curp_element,
-                            tag,
-                            value,
-                            function,
-                            function.__name__,
-                            output_filename,
-                            lista_incidencias,
-                        )
+        # Validate specific tag elements, all the records at once
+        num_registros, num_incidencias, num_reutilizados = check_records(
+            df_datos,
+            rule_plan,
+            rule_jobs,
+            output_filename,
+            store,
+            context,
+        )
 
         style.change_color(style.WHITE)
         linea_reporte = (
@@ -601,6 +798,13 @@ def validate_custom_rules(root_data, output_filename):
         print(f"{linea_reporte}", end="\n\n")
         save_on_report(output_filename, linea_reporte)
 
+        report_reused_records(
+            store,
+            num_reutilizados,
+            num_registros,
+            output_filename,
+        )
+
     except FileNotFoundError:
         print("XML file not found.")
     except ET.ParseError:
@@ -609,62 +813,460 @@ def validate_custom_rules(root_data, output_filename):
         print("Validation error:", ve)
 
 
-def create_queue(root_xml):
-    """
+def check_records(
+    df_datos,
+    rule_plan,
+    rule_jobs,
+    output_filename,
+    store=None,
+    context=None,
+):
+    """Columnar version of check_record for all the records of a dataframe,
+    saving the same incidences in the same order. Big dataframes are split
+    in chunks of RULE_CHUNK_RECORDS checked on up to rule_jobs processes.
+    Records already on the results store (same fields, same context) reuse
+    their stored incidences and aren't checked again.
 
     Returns:
-
+        Number of records checked, number of incidences, number of records
+        reused from the store
     """
 
-    data_queue = queue.Queue()
-    total_curps = len(root_xml.findall(".//EMPLEADO"))
-    progreso = tqdm(
-        total=total_curps,
-        desc="Recuperando",
-        leave=True,
+    null_curp = df_datos.reindex(columns=["CURP"])["CURP"].isna().to_numpy()
+    num_registros = len(df_datos)
+    if null_curp.any():
+        num_registros = int(null_curp.argmax())
+    df_registros = df_datos.iloc[:num_registros]
+
+    hashes = []
+    stored = {}
+    if store is not None and store.mode != "off":
+        hashes = record_hashes(df_registros)
+        stored = store.get_many(context, hashes)
+        pending = [
+            row
+            for row, record_key in enumerate(hashes)
+            if record_key not in stored
+        ]
+        if len(pending) < num_registros:
+            df_registros = df_registros.iloc[pending]
+
+    chunks = [
+        df_registros.iloc[start : start + RULE_CHUNK_RECORDS]
+        for start in range(0, len(df_registros), RULE_CHUNK_RECORDS)
+    ]
+    if rule_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(
+            max_workers=min(rule_jobs, len(chunks))
+        ) as executor:
+            # map gives the results in the order of the chunks
+            checked = list(
+                executor.map(
+                    rule_incidences,
+                    chunks,
+                    itertools.repeat(rule_plan),
+                )
+            )
+    else:
+        checked = [rule_incidences(chunk, rule_plan) for chunk in chunks]
+    checked = itertools.chain.from_iterable(checked)
+
+    # Incidences of each record, in the order of the records
+    num_incidencias = 0
+    num_reutilizados = 0
+    nuevos = []
+    lineas = []
+    for row in range(num_registros):
+        record_key = hashes[row] if hashes else None
+        if record_key in stored:
+            incidencias = stored[record_key]
+            num_reutilizados += 1
+        else:
+            incidencias = next(checked)
+            if record_key is not None:
+                nuevos.append((record_key, incidencias))
+        num_incidencias += len(incidencias)
+        lineas += incidencias
+
+        if len(lineas) >= RULE_CHUNK_RECORDS:
+            save_lines_on_report(output_filename, lineas)
+            lineas = []
+    save_lines_on_report(output_filename, lineas)
+
+    if nuevos:
+        store.put_many(context, nuevos)
+
+    if num_registros < len(df_datos):
+        msg_error = "CURP element not found in XML on record # " + str(
+            num_registros + 1
+        )
+        raise ValueError(msg_error)
+
+    return num_registros, num_incidencias, num_reutilizados
+
+
+def rule_incidences(df_datos, rule_plan):
+    """Incidences of the rules of rule_plan on the records of a dataframe
+    (all of them with CURP).
+
+    Returns:
+        List with the list of report lines of each record, rule by rule
+    """
+
+    import numpy as np
+
+    frame = df_datos.reindex(columns=rule_plan.tags)
+    failures = rule_plan.failures(frame)
+    values = frame.astype(object).where(frame.notna(), None).to_numpy()
+    curps = df_datos["CURP"].to_numpy()
+
+    # Row by row and rule by rule, like check_record
+    incidencias = [[] for _ in range(len(df_datos))]
+    for row, rule in zip(*np.nonzero(failures)):
+        incidencias[row].append(
+            rule_plan.message(
+                rule_plan.rules[rule],
+                curps[row],
+                values[row, rule],
+            )
+        )
+    return incidencias
+
+
+def report_reused_records(
+    store,
+    num_reutilizados,
+    num_registros,
+    output_filename,
+):
+    """Save how many records reused their stored incidences and how many
+    were validated again.
+
+    Returns:
+
+    """
+
+    if store is None or store.mode == "off":
+        return
+
+    style.change_color(style.WHITE)
+    linea_reporte = (
+        "# Records reused: "
+        + str(num_reutilizados)
+        + "|Records revalidated: "
+        + str(num_registros - num_reutilizados)
+    )
+    print(f"{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+
+def tag_text(registro, tag):
+    """Text of a tag of an EMPLEADO element.
+
+    Returns:
+        str, None if the tag is missing or empty
+    """
+
+    element = registro.find(tag)
+    return element.text if element is not None else None
+
+
+def check_record(registro, num_registros, rule_plan, output_filename):
+    """Apply the rules of rule_plan to an EMPLEADO element.
+
+    Returns:
+        List of incidences found
+    """
+
+    lista_incidencias = []
+
+    # Extract CURP value
+    curp_element = tag_text(registro, "CURP")
+
+    if curp_element is None:
+        msg_error = "CURP element not found in XML on record # " + str(
+            num_registros
+        )
+        raise ValueError(msg_error)
+
+    for rule in rule_plan.rules:
+        value = tag_text(registro, rule.tag)
+        if rule_plan.failed(rule, value):
+            msg = rule_plan.message(rule, curp_element, value)
+            lista_incidencias.append(msg)
+            save_on_report(output_filename, msg)
+
+    return lista_incidencias
+
+
+def validate_xml_stream(
+    input_xml,
+    rule_plan,
+    store,
+    context,
+    output_filename,
+    renapo_check,
+):
+    """Validate Custom Rules walking the EMPLEADO elements one by one
+    (--stream), so memory doesn't grow with the size of the XML file.
+    Records already on the results store reuse their stored incidences.
+
+    Returns:
+        List with the data to search on WS (empty if renapo_check=False)
+    """
+
+    style.change_color(style.WHITE)
+    linea_reporte = "# Validating Custom Rules (CURP values)"
+    print(f"\t{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+    ws_records = []
+
+    try:
+        num_registros = 0
+        num_incidencias = 0
+        num_reutilizados = 0
+        use_store = store is not None and store.mode != "off"
+        nuevos = []
+        # A record without CURP stops the rules (as on the dataframe), its
+        # records still go to the WS RENAPO stage
+        rules_error = None
+        for registro in iter_xml_records(input_xml):
+            if rules_error is not None:
+                if renapo_check:
+                    ws_records.append(ws_record(registro))
+                continue
+
+            num_registros += 1
+            incidencias = None
+            if use_store:
+                record_key = record_hash(
+                    {
+                        elem.tag: elem.text
+                        for elem in registro.iterchildren(ET.Element)
+                    }.items()
+                )
+                incidencias = store.get(context, record_key)
+
+            if incidencias is not None:
+                num_reutilizados += 1
+                save_lines_on_report(output_filename, incidencias)
+            else:
+                try:
+                    incidencias = check_record(
+                        registro,
+                        num_registros,
+                        rule_plan,
+                        output_filename,
+                    )
+                except ValueError as error:
+                    rules_error = error
+                    if renapo_check:
+                        ws_records.append(ws_record(registro))
+                    continue
+                if use_store:
+                    nuevos.append((record_key, incidencias))
+                    if len(nuevos) >= STORE_BATCH_RECORDS:
+                        store.put_many(context, nuevos)
+                        nuevos = []
+
+            num_incidencias += len(incidencias)
+            if renapo_check:
+                ws_records.append(ws_record(registro))
+        if nuevos:
+            store.put_many(context, nuevos)
+        if rules_error is not None:
+            raise rules_error
+
+        style.change_color(style.WHITE)
+        linea_reporte = (
+            "#Total Records: "
+            + str(num_registros)
+            + "|Total Errors: "
+            + str(num_incidencias)
+        )
+        print(f"{linea_reporte}", end="\n\n")
+        save_on_report(output_filename, linea_reporte)
+
+        report_reused_records(
+            store,
+            num_reutilizados,
+            num_registros,
+            output_filename,
+        )
+
+    except FileNotFoundError:
+        print("XML file not found.")
+    except ET.ParseError:
+        print("Error parsing XML file.")
+    except ValueError as ve:
+        print("Validation error:", ve)
+
+    return ws_records
+
+
+def iter_xml_records(input_xml, schema=None):
+    """Walk the EMPLEADO elements of a XML file with iterparse, deleting
+    each one (and the ones before it) once it has been used.
+
+    Returns:
+        Generator of EMPLEADO elements
+    """
+
+    xml_file_path = os.path.join("./", input_xml)
+
+    for _, registro in ET.iterparse(
+        xml_file_path,
+        events=("end",),
+        tag="EMPLEADO",
+        schema=schema,
+    ):
+        yield registro
+
+        registro.clear(keep_tail=True)
+        while registro.getprevious() is not None:
+            del registro.getparent()[0]
+
+
+def create_ws_records(document):
+    """Data of every EMPLEADO element to search on WS RENAPO.
+
+    Returns:
+        List of WsRecord
+    """
+
+    from tqdm import tqdm
+
+    ws_records = []
+    registros = document.registros
+    progreso = tqdm(
+        total=len(registros),
+        desc="Recuperando",
+        leave=True,
         unit="Reg",
     )
 
-    for curp in root_xml.findall(".//EMPLEADO"):
+    for curp in registros:
         progreso.update()
-        data_list = []
-        curp_value = curp.find("CURP").text
-        nombre_xml = curp.find("NOMBRE").text
-        apellido_paterno_xml = curp.find("APELLIDO_PATERNO").text
-        apellido_materno_xml = curp.find("APELLIDO_MATERNO").text
-        sexo_xml = curp.find("SEXO").text
-        lugar_nacimiento_xml = curp.find("LUGAR_NACIMIENTO").text
-        dia_nacimiento_xml = curp.find("DIA_NACIMIENTO").text
-        mes_nacimiento_xml = curp.find("MES_NACIMIENTO").text
-        anio_nacimiento_xml = curp.find("ANIO_NACIMIENTO").text
-
-        nombre_xml = nombre_xml.replace("#", "Ñ")
-        if apellido_paterno_xml:
-            apellido_paterno_xml = apellido_paterno_xml.replace("#", "Ñ")
-        if apellido_materno_xml:
-            apellido_materno_xml = apellido_materno_xml.replace("#", "Ñ")
-
-        data_list.append(curp_value)
-        data_list.append(nombre_xml)
-        data_list.append(apellido_paterno_xml)
-        data_list.append(apellido_materno_xml)
-        data_list.append(sexo_xml)
-        data_list.append(lugar_nacimiento_xml)
-        data_list.append(dia_nacimiento_xml)
-        data_list.append(mes_nacimiento_xml)
-        data_list.append(anio_nacimiento_xml)
-
-        data_queue.put(data_list)
+        ws_records.append(ws_record(curp))
     progreso.close()
+    return ws_records
+
+
+def exclude_invalid_curps(ws_records, rule_plan, output_filename):
+    """Leave out of the WS RENAPO stage the records without CURP or whose
+    CURP breaks its Custom Rule (structure or check digit), RENAPO has no
+    data for them.
+
+    Returns:
+        List of records to search on WS RENAPO
+    """
+
+    curp_rule = rule_plan.rule_of("CURP")
+    if curp_rule is None:
+        return [record_data for record_data in ws_records if record_data.curp]
+
+    valid_records = []
+    num_excluidos = 0
+    for record_data in ws_records:
+        curp_value = record_data.curp
+        if curp_value and not rule_plan.failed(curp_rule, curp_value):
+            valid_records.append(record_data)
+            continue
+
+        num_excluidos += 1
+        incidencia = (
+            str(curp_value)
+            + "|CURP not valid (structure or check digit)"
+            + ", won't search on WS-RENAPO"
+        )
+        save_on_report(output_filename, incidencia)
+
+    style.change_color(style.WHITE)
+    linea_reporte = (
+        "# Records with CURP not valid, not searched on WS RENAPO: "
+        + str(num_excluidos)
+    )
+    print(f"{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+    return valid_records
+
+
+def create_ws_queue(ws_records):
+    """Queue shared by the WS workers with the records to search.
+
+    Returns:
+        queue.Queue
+    """
+
+    data_queue = queue.Queue()
+    for record_data in ws_records:
+        data_queue.put(record_data)
     return data_queue
 
 
+def ws_record(curp):
+    """Data of an EMPLEADO element to search on WS RENAPO.
+
+    Returns:
+        WsRecord
+    """
+
+    curp_value = tag_text(curp, "CURP")
+    nombre_xml = tag_text(curp, "NOMBRE")
+    apellido_paterno_xml = tag_text(curp, "APELLIDO_PATERNO")
+    apellido_materno_xml = tag_text(curp, "APELLIDO_MATERNO")
+    sexo_xml = tag_text(curp, "SEXO")
+    lugar_nacimiento_xml = tag_text(curp, "LUGAR_NACIMIENTO")
+    dia_nacimiento_xml = tag_text(curp, "DIA_NACIMIENTO")
+    mes_nacimiento_xml = tag_text(curp, "MES_NACIMIENTO")
+    anio_nacimiento_xml = tag_text(curp, "ANIO_NACIMIENTO")
+
+    if nombre_xml:
+        nombre_xml = nombre_xml.replace("#", "Ñ")
+    if apellido_paterno_xml:
+        apellido_paterno_xml = apellido_paterno_xml.replace("#", "Ñ")
+    if apellido_materno_xml:
+        apellido_materno_xml = apellido_materno_xml.replace("#", "Ñ")
+
+    # Names, places and dates repeat across the records, each distinct
+    # value is kept only once (the CURP is unique)
+    return WsRecord(
+        curp_value,
+        *[
+            None if value is None else sys.intern(value)
+            for value in (
+                nombre_xml,
+                apellido_paterno_xml,
+                apellido_materno_xml,
+                sexo_xml,
+                lugar_nacimiento_xml,
+                dia_nacimiento_xml,
+                mes_nacimiento_xml,
+                anio_nacimiento_xml,
+            )
+        ],
+    )
+
+
 def search_on_ws(
     url_ws_renapo,
     wsdl_file,
-    root_xml,
+    ws_records,
     renapo_check,
     use_threads,
+    cache_mode,
+    results_mode,
+    engine,
+    soap,
+    in_flight,
+    ws_timeout,
+    concurrency,
+    max_concurrency,
+    retries,
+    breaker_threshold,
+    breaker_cooldown,
     output_filename,
 ):
     """
@@ -673,9 +1275,17 @@ def search_on_ws(
 
     """
 
+    from renapo_client import (
+        CircuitBreaker,
+        RawSoapClientFactory,
+        RetryPolicy,
+        client_factory_loaded,
+        get_client_factory,
+    )
+
     # Use WS RENAPO?
     style.change_color(style.WHITE)
-    linea_reporte = "# Search data on WS RENAPO..."
+    linea_reporte = WS_STAGE_START
     print(linea_reporte)
     save_on_report(output_filename, linea_reporte)
 
@@ -686,27 +1296,311 @@ def search_on_ws(
         save_on_report(output_filename, linea_reporte)
         return
 
+    # --resume looks for the start of this stage on the report file, it
+    # must be there before any CURP is journaled
+    get_report_writer(output_filename).flush()
+
     # Use threads?
     style.change_color(style.WHITE)
     linea_reporte = "# Check vs WS RENAPO. Check thread option..."
     print(f"{linea_reporte}", end="\n")
     save_on_report(output_filename, linea_reporte)
 
-    # Get all the data from xml to search on WS and compare results
-    data_list = create_queue(root_xml)
-    style.change_color(style.WHITE)
-    if use_threads:
-        linea_reporte = "# ...parameter use_threads=True. Will use threads"
-        print(f"\t{linea_reporte}", end="\n")
+    # Local cache of WS responses
+    cache_file, ttl_days, max_entries = _get_cache_settings()
+    cache = RenapoCache(cache_file, ttl_days, max_entries, cache_mode)
+
+    # The cache, store, checkpoint and connections are closed (and the
+    # compare thread finished) even if the stage fails, --serve goes on
+    store = None
+    client_factory = None
+    ws_client_factory = None
+    try:
+        store = open_results_store(results_mode)
+
+        # Parse WSDL only once, each worker gets its own client. Later
+        # files and --serve jobs reuse the WSDL parsed by the first one
+        wsdl_reused = client_factory_loaded(wsdl_file, url_ws_renapo)
+        client_factory = get_client_factory(wsdl_file, url_ws_renapo)
+        wsdl_load_time = client_factory.load_time
+        linea_reporte = (
+            "# WSDL load time: " + f"{wsdl_load_time:.3f}" + " s"
+        )
+        if wsdl_reused:
+            linea_reporte += "|Parsed WSDL reused"
+        print(f"{linea_reporte}", end="\n")
         save_on_report(output_filename, linea_reporte)
 
-        create_threads(data_list, output_filename, url_ws_renapo)
-    else:
-        style.change_color(style.YELLOW)
-        linea_reporte = "# ...parameter use_threads=False. Won't use threads"
-        print(f"\t{linea_reporte}", end="\n")
+        # ConsultaDatosCURP without the suds object model (the async
+        # engine always sends raw SOAP), suds if the raw request can't be
+        # built
+        ws_client_factory = client_factory
+        if engine != "async":
+            if soap == "raw":
+                try:
+                    ws_client_factory = RawSoapClientFactory(
+                        client_factory
+                    )
+                except Exception as error:
+                    soap = "suds"
+                    linea_reporte = (
+                        "# Raw SOAP client not available, using suds|"
+                        + str(error)
+                    )
+                    style.change_color(style.YELLOW)
+                    print(f"{linea_reporte}", end="\n")
+                    save_on_report(output_filename, linea_reporte)
+
+            style.change_color(style.WHITE)
+            linea_reporte = "# SOAP client: " + soap
+            print(f"{linea_reporte}", end="\n")
+            save_on_report(output_filename, linea_reporte)
+
+        # Tune the number of simultaneous queries while running?
+        controller = None
+        if concurrency == "adaptive":
+            if engine == "async":
+                max_concurrency = in_flight
+            controller = AdaptiveConcurrency(
+                initial=min(os.cpu_count(), max_concurrency),
+                minimum=1,
+                maximum=max_concurrency,
+            )
+
+        # Retry failed queries, pause while WS RENAPO is down
+        breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        retry_policy = RetryPolicy(
+            retries,
+            base_delay=RETRY_BASE_DELAY,
+            max_delay=RETRY_MAX_DELAY,
+            breaker=breaker,
+        )
+
+        # Records already compared with WS RENAPO (same data) keep their
+        # stored incidences, unless the cache is refreshed or off
+        ws_context = context_hash("renapo", url_ws_renapo)
+        ws_records, ws_keys = reuse_ws_results(
+            store,
+            ws_context,
+            ws_records,
+            cache_mode == "use",
+            output_filename,
+        )
+
+        # CURPs already searched before the run was interrupted
+        # (--resume)
+        ws_records, ws_keys = resume_ws_records(
+            ws_records, ws_keys, output_filename
+        )
+
+        # Query each distinct CURP only once, its other records get the
+        # same response
+        unique_records, duplicates = dedupe_ws_records(ws_records)
+        num_duplicados = len(ws_records) - len(unique_records)
+        style.change_color(style.WHITE)
+        linea_reporte = (
+            "# Duplicate CURP records: "
+            + str(num_duplicados)
+            + "|Distinct CURPs: "
+            + str(len(unique_records))
+            + "|WS requests saved: "
+            + str(num_duplicados)
+        )
+        print(f"{linea_reporte}", end="\n")
+        save_on_report(output_filename, linea_reporte)
+
+        # All the data from xml to search on WS and compare results
+        data_list = create_ws_queue(unique_records)
+        style.change_color(style.WHITE)
+        if engine == "async":
+            linea_reporte = (
+                "# ...parameter engine=async. Will use an event loop"
+            )
+            print(f"\t{linea_reporte}", end="\n")
+            save_on_report(output_filename, linea_reporte)
+
+            linea_reporte = (
+                "# Using up to " + str(in_flight) + " queries in flight"
+            )
+            style.change_color(style.GREEN)
+            print(f"{linea_reporte}", end="\n")
+            save_on_report(output_filename, linea_reporte)
+        elif use_threads:
+            linea_reporte = (
+                "# ...parameter use_threads=True. Will use threads"
+            )
+            print(f"\t{linea_reporte}", end="\n")
+            save_on_report(output_filename, linea_reporte)
+        else:
+            style.change_color(style.YELLOW)
+            linea_reporte = (
+                "# ...parameter use_threads=False. Won't use threads"
+            )
+            print(f"\t{linea_reporte}", end="\n")
+            save_on_report(output_filename, linea_reporte)
+
+        # CURPs that still fail after all the retries get one more pass at
+        # the end. Incidences of each record (only the ones with
+        # incidences)
+        failed = []
+        ws_results = {}
+        ws_responses = WsResponses(duplicates, ws_results, output_filename)
+        try:
+            run_ws_engine(
+                data_list,
+                engine,
+                use_threads,
+                output_filename,
+                ws_client_factory,
+                cache,
+                in_flight,
+                ws_timeout,
+                controller,
+                retry_policy,
+                failed,
+                ws_responses,
+            )
+
+            if failed:
+                style.change_color(style.WHITE)
+                linea_reporte = (
+                    "# Retrying " + str(len(failed)) + " failed CURP(s)..."
+                )
+                print(f"{linea_reporte}", end="\n")
+                save_on_report(output_filename, linea_reporte)
+
+                run_ws_engine(
+                    create_ws_queue(failed),
+                    engine,
+                    use_threads,
+                    output_filename,
+                    ws_client_factory,
+                    cache,
+                    in_flight,
+                    ws_timeout,
+                    controller,
+                    retry_policy,
+                    None,
+                    ws_responses,
+                )
+        finally:
+            ws_responses.finish()
+
+        store_ws_results(
+            store, ws_context, ws_records, ws_keys, ws_results
+        )
+    finally:
+        if ws_client_factory is not client_factory:
+            ws_client_factory.close()
+        # Journal of the CURPs completed so far, for --resume
+        close_checkpoint(output_filename)
+        if store is not None:
+            store.close()
+        cache.close()
+
+    style.change_color(style.WHITE)
+    linea_reporte = (
+        "# WS retries: "
+        + str(retry_policy.retried)
+        + "|Circuit breaker opened: "
+        + str(breaker.opened)
+        + " time(s)"
+    )
+    print(f"{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+    if controller is not None:
+        controller.finish()
+        style.change_color(style.WHITE)
+        for linea_reporte in controller.report_lines():
+            print(f"{linea_reporte}", end="\n")
+            save_on_report(output_filename, linea_reporte)
+
+    metrics = get_metrics(output_filename)
+    if metrics is not None:
+        metrics.ws.update(
+            wsdl_load_s=wsdl_load_time,
+            wsdl_reused=wsdl_reused,
+            distinct_curps=len(unique_records),
+            duplicate_records=num_duplicados,
+            retries=retry_policy.retried,
+            final_pass_curps=len(failed),
+            circuit_breaker_opened=breaker.opened,
+            cache_hits=cache.hits,
+            cache_misses=cache.misses,
+        )
+
+    if cache_mode != "off":
+        style.change_color(style.WHITE)
+        linea_reporte = (
+            "# Cache hits: "
+            + str(cache.hits)
+            + "|Cache misses: "
+            + str(cache.misses)
+        )
+        print(f"{linea_reporte}", end="\n")
         save_on_report(output_filename, linea_reporte)
 
+
+def run_ws_engine(
+    data_list,
+    engine,
+    use_threads,
+    output_filename,
+    client_factory,
+    cache,
+    in_flight,
+    ws_timeout,
+    controller,
+    retry_policy,
+    failed,
+    responses,
+):
+    """Query WS RENAPO for all the records on data_list with the engine
+    selected. Records whose query fails are added to failed, or reported as
+    an incidence when failed is None. Each response goes to responses
+    (WsResponses), to be compared with its record and the duplicates
+    (other records with the same CURP) of its record.
+
+    Returns:
+
+    """
+
+    from tqdm import tqdm
+
+    if engine == "async":
+        style.change_color(style.GREEN)
+        with tqdm(
+            total=data_list.qsize(),
+            desc="Consultando",
+            leave=True,
+            unit="queries",
+        ) as pbar:
+            consulta_ws_async(
+                data_list,
+                pbar,
+                output_filename,
+                client_factory,
+                cache,
+                in_flight,
+                ws_timeout,
+                controller,
+                retry_policy,
+                failed,
+                responses,
+            )
+    elif use_threads:
+        create_threads(
+            data_list,
+            output_filename,
+            client_factory,
+            cache,
+            controller,
+            retry_policy,
+            failed,
+            responses,
+        )
+    else:
         style.change_color(style.GREEN)
 
         with tqdm(
@@ -719,25 +1613,52 @@ def search_on_ws(
                 data_list,
                 pbar,
                 output_filename,
-                url_ws_renapo,
-                wsdl_file,
+                client_factory,
+                cache,
+                controller,
+                retry_policy,
+                failed,
+                responses,
             )
 
 
-def create_threads(data_list_threads, output_filename, ws_url_renapo):
+def create_threads(
+    data_list_threads,
+    output_filename,
+    client_factory,
+    cache,
+    controller,
+    retry_policy,
+    failed,
+    responses,
+):
     """
 
     Returns:
 
     """
 
-    threads = os.cpu_count()
+    from tqdm import tqdm
+
+    if controller is None:
+        threads = os.cpu_count()
+    else:
+        threads = controller.maximum
 
     linea_reporte = "# Using " + str(threads) + " thread(s)"
     style.change_color(style.GREEN)
     print(f"{linea_reporte}", end="\n")
     save_on_report(output_filename, linea_reporte)
 
+    if controller is not None:
+        linea_reporte = (
+            "# Adaptive concurrency, starting with "
+            + str(controller.limit)
+            + " simultaneous queries"
+        )
+        print(f"{linea_reporte}", end="\n")
+        save_on_report(output_filename, linea_reporte)
+
     with tqdm(
         total=data_list_threads.qsize(),
         desc="Consultando",
@@ -752,208 +1673,940 @@ def create_threads(data_list_threads, output_filename, ws_url_renapo):
                     consulta_ws,
                     data_list_threads,
                     pbar,
-                    output_file,
-                    ws_url_renapo,
-                    wsdl_filename,
+                    output_filename,
+                    client_factory,
+                    cache,
+                    controller,
+                    retry_policy,
+                    failed,
+                    responses,
                 )
                 for i in range(threads)
             ]
 
 
-def consulta_ws(data_list, pbar, output_filename, ws_url_renapo, wsdl_file):
+def consulta_ws(
+    data_list,
+    pbar,
+    output_filename,
+    client_factory,
+    cache,
+    controller,
+    retry_policy,
+    failed,
+    responses,
+):
     """
 
     Returns:
 
     """
 
+    from renapo_client import consulta_datos_curp
+
+    metrics = get_metrics(output_filename)
     while not data_list.empty():
+        try:
+            # Another thread took the last record
+            record_data = data_list.get_nowait()
+        except queue.Empty:
+            break
+
         try:
             style.change_color(style.WHITE)
             # Update the progress bar
             pbar.update(1)
             # total_records = data_list.qsize()
-            record_data = data_list.get_nowait()
             data_list.task_done()
-            curp_value = record_data[0]
-            nombre_xml = record_data[1]
-            ap_paterno_xml = record_data[2]
-            ap_materno_xml = record_data[3]
-            sexo_xml = record_data[4]
-            lugar_nacimiento_xml = record_data[5]
-            dia_nacimiento_xml = record_data[6]
-            mes_nacimiento_xml = record_data[7]
-            anio_nacimiento_xml = record_data[8]
+            curp_value = record_data.curp
 
             style.change_color(style.GREEN)
 
-            path_to_wsdl = urllib.parse.urljoin(
-                "file:",
-                urllib.request.pathname2url(
-                    os.path.abspath(wsdl_file),
-                ),
-            )
-
-            cliente = Client(path_to_wsdl)
-            cliente.set_options(location=ws_url_renapo)
-            response_ws = cliente.service.ConsultaDatosCURP(curp_value)
-
-            # ... process the response_ws ...
-            if response_ws.CodigoError == 0:
-                nombre_xml = nombre_xml.replace("#", "Ñ")
-                if nombre_xml != response_ws.Nombres:
-                    incidencia = (
-                        curp_value
-                        + "|NOMBRE(S) in XML: "
-                        + nombre_xml
-                        + ", doesn't match RENAPO response: "
-                        + response_ws.Nombres
-                    )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-
-                if ap_paterno_xml is not None:
-                    ap_paterno_xml = ap_paterno_xml.replace("#", "Ñ")
-                if ap_paterno_xml != response_ws.Apellido1:
-                    incidencia = (
-                        curp_value
-                        + "|APELLIDO_PATERNO in XML: "
-                        + ap_paterno_xml
-                        + ", doesn't match RENAPO response: "
-                        + response_ws.Apellido1
-                    )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-
-                if ap_materno_xml is not None:
-                    ap_materno_xml = ap_materno_xml.replace("#", "Ñ")
-                if ap_materno_xml != response_ws.Apellido2:
-                    if response_ws.Apellido2 is None:
-                        incidencia = (
-                            curp_value
-                            + "|APELLIDO_MATERNO in XML: "
-                            + ap_materno_xml
-                            + ", doesn't match RENAPO response: NULL"
-                        )
-                    else:
-                        incidencia = (
-                            curp_value
-                            + "|APELLIDO_MATERNO in XML: "
-                            + ap_materno_xml
-                            + ", doesn't match RENAPO response: "
-                            + response_ws.Apellido2
-                        )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-
-                lugar_nacimiento_curp = curp_value[11:13]
-                if RENAPO_ST[lugar_nacimiento_curp] != lugar_nacimiento_xml:
-                    incidencia = (
-                        curp_value
-                        + "|Lugar de nacimiento: "
-                        + lugar_nacimiento_xml
-                        + ", doesn't match RENAPO response: "
-                        + lugar_nacimiento_curp
-                    )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-
-                sexo_curp = curp_value[10:11]
-                if RENAPO_GENDER[sexo_curp] != sexo_xml:
-                    incidencia = (
-                        curp_value
-                        + "|Sexo: "
-                        + sexo_xml
-                        + ", doesn't match RENAPO response: "
-                        + sexo_curp
+            response_ws = cache.get(curp_value)
+            if response_ws is None:
+                cliente = client_factory.get_client()
+                try:
+                    response_ws = consulta_datos_curp(
+                        cliente,
+                        curp_value,
+                        controller,
+                        retry_policy,
+                        metrics,
                     )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-
-                dia_nacimiento_curp = curp_value[8:10]
-                if dia_nacimiento_curp != dia_nacimiento_xml:
-                    incidencia = (
-                        curp_value
-                        + "|Día Nacimiento: "
-                        + dia_nacimiento_xml
-                        + ", doesn't match RENAPO response: "
-                        + dia_nacimiento_curp
-                    )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-
-                mes_nac_curp = curp_value[6:8]
-                if mes_nac_curp != mes_nacimiento_xml:
-                    incidencia = (
-                        curp_value
-                        + "|Mes Nacimiento: "
-                        + mes_nacimiento_xml
-                        + ", doesn't match RENAPO response: "
-                        + mes_nac_curp
-                    )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-
-                anio_nac_curp = curp_value[4:6]
-                dif_homonimia = curp_value[16:17]
-
-                if dif_homonimia.isdigit():
-                    anio_nac_curp = 1900 + int(anio_nac_curp)
-                else:
-                    anio_nac_curp = 2000 + int(anio_nac_curp)
-
-                if anio_nac_curp != int(anio_nacimiento_xml):
-                    incidencia = (
-                        curp_value
-                        + "|Año Nacimiento XML: "
-                        + str(anio_nacimiento_xml)
-                        + ", doesn't match RENAPO response: "
-                        + str(anio_nac_curp)
-                    )
-                    record_data.append(incidencia)
-                    save_on_report(output_filename, incidencia)
-            else:
-                incidencia = curp_value + "|No data from WS-RENAPO"
-                record_data.append(incidencia)
-                save_on_report(output_filename, incidencia)
+                except Exception:
+                    if failed is None:
+                        raise
+                    # Try again on the final pass
+                    failed.append(record_data)
+                    continue
+                cache.put(curp_value, response_ws)
+
+            # Compared later, on the batches of responses
+            responses.add(record_data, response_ws)
 
         except Exception as mensaje:
-            incidencia = curp_value + "|Error? (WS-RENAPO)" + mensaje
-            style.change_color(style.RED)
-            print(incidencia)
-            record_data.append(incidencia)
-            save_on_report(output_filename, incidencia)
+            responses.add_error(record_data, mensaje)
 
 
-def save_on_report(output_filename, linea):
-    """
+def consulta_ws_async(
+    data_list,
+    pbar,
+    output_filename,
+    client_factory,
+    cache,
+    in_flight,
+    ws_timeout,
+    controller,
+    retry_policy,
+    failed,
+    responses,
+):
+    """Query WS RENAPO from a single event loop (--engine async).
 
     Returns:
 
     """
 
-    with open(output_filename, mode="a", newline="", encoding="utf-8") as f:
-        f.write(linea + "\n")
+    from renapo_async import query_all_async
 
+    pending = []
+    while not data_list.empty():
+        record_data = data_list.get_nowait()
+        data_list.task_done()
+
+        response_ws = cache.get(record_data.curp)
+        if response_ws is None:
+            pending.append(record_data)
+            continue
+
+        pbar.update(1)
+        responses.add(record_data, response_ws)
+
+    def on_response(record_data, response_ws):
+        pbar.update(1)
+        curp_value = record_data.curp
+
+        if isinstance(response_ws, Exception) and failed is not None:
+            # Try again on the final pass
+            failed.append(record_data)
+            return
+
+        if isinstance(response_ws, Exception):
+            responses.add_error(record_data, response_ws)
+            return
+
+        cache.put(curp_value, response_ws)
+        responses.add(record_data, response_ws)
+
+    template = client_factory.request_template()
+    query_all_async(
+        pending,
+        template,
+        in_flight,
+        ws_timeout,
+        on_response,
+        controller,
+        retry_policy,
+        get_metrics(output_filename),
+    )
 
-if __name__ == "__main__":
-    # Get user parameters
-    read_user_cli_args()
-    user_args = read_user_cli_args()
 
-    style.change_color(style.BLUE)
-    print(f"\tParameters:{user_args.xml_file}, ")
-    print(f"{user_args.xsd_check}, ")
-    print(f"{user_args.renapo_check}, ")
-    print(f"{user_args.use_threads}, ", end="\n\n")
+def resume_ws_records(ws_records, ws_keys, output_filename):
+    """Save the journaled incidences of the CURPs already on the checkpoint
+    of the report and leave their records (and their record_hash, if any)
+    out of the WS RENAPO stage.
 
-    print(f"\tParameter xml_file:\t{user_args.xml_file}", end="\n")
-    print(f"\tParameter xsd_check:\t{user_args.xsd_check}", end="\n")
-    print(f"\tParameter renapo_check:\t{user_args.renapo_check}", end="\n")
-    print(f"\tParameter use_thread:\t{user_args.use_threads}", end="\n\n")
+    Returns:
+        List of records to search on WS RENAPO, list of their record_hash
+    """
+
+    completed = get_checkpoint(output_filename).completed()
+    if not completed:
+        return ws_records, ws_keys
+
+    pending_records = []
+    pending_keys = []
+    for row, record_data in enumerate(ws_records):
+        if record_data.curp not in completed:
+            pending_records.append(record_data)
+            if ws_keys:
+                pending_keys.append(ws_keys[row])
+
+    for incidencias in completed.values():
+        save_lines_on_report(output_filename, incidencias)
+
+    style.change_color(style.WHITE)
+    linea_reporte = (
+        "# CURPs resumed from checkpoint: "
+        + str(len(completed))
+        + "|Records skipped: "
+        + str(len(ws_records) - len(pending_records))
+    )
+    print(f"{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+    return pending_records, pending_keys
+
+
+def reuse_ws_results(store, context, ws_records, reuse, output_filename):
+    """Save the stored incidences of the records already compared with WS
+    RENAPO (reuse=True) and leave them out of the WS RENAPO stage.
+
+    Returns:
+        List of records to search on WS RENAPO, list of their record_hash
+        (empty if the store is off)
+    """
+
+    if store.mode == "off":
+        return ws_records, []
+
+    ws_keys = [
+        record_hash(zip(WS_RECORD_TAGS, record_data))
+        for record_data in ws_records
+    ]
+    stored = store.get_many(context, ws_keys) if reuse else {}
+
+    pending_records = []
+    pending_keys = []
+    for record_key, record_data in zip(ws_keys, ws_records):
+        incidencias = stored.get(record_key)
+        if incidencias is None:
+            pending_records.append(record_data)
+            pending_keys.append(record_key)
+        else:
+            save_lines_on_report(output_filename, incidencias)
+
+    style.change_color(style.WHITE)
+    linea_reporte = (
+        "# WS RENAPO records reused: "
+        + str(len(ws_records) - len(pending_records))
+        + "|Records searched: "
+        + str(len(pending_records))
+    )
+    print(f"{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+    return pending_records, pending_keys
+
+
+def store_ws_results(store, context, ws_records, ws_keys, ws_results):
+    """Save on the store the incidences of the records compared with WS
+    RENAPO, except the ones whose query failed.
+
+    Returns:
+
+    """
+
+    results = []
+    for record_key, record_data in zip(ws_keys, ws_records):
+        incidencias = ws_results.get(record_data, [])
+        if not any(WS_ERROR in incidencia for incidencia in incidencias):
+            results.append((record_key, incidencias))
+    store.put_many(context, results)
+
+
+def dedupe_ws_records(ws_records):
+    """Keep the first record of each CURP, to query WS RENAPO only once.
+
+    Returns:
+        List of records to query, dict CURP: list of its other records
+    """
+
+    unique_records = []
+    duplicates = {}
+    for record_data in ws_records:
+        curp_value = record_data.curp
+        if curp_value in duplicates:
+            duplicates[curp_value].append(record_data)
+        else:
+            duplicates[curp_value] = []
+            unique_records.append(record_data)
+
+    return unique_records, duplicates
+
+
+class WsResponses:
+    """WS RENAPO responses of the queried records, kept in columns until
+    they are compared with the XML data.
+
+    The WS workers only add each response (add) or failed query
+    (add_error). A thread of its own compares the kept responses with
+    their records and their duplicates at once (report_ws_batch), so the
+    comparisons don't hold up the queries. A batch is compared as soon as
+    WS_COMPARE_BATCH responses are kept, or after WS_COMPARE_INTERVAL
+    seconds, so each CURP is journaled shortly after its response.
+    finish() compares the last batch and waits for all of them.
+    """
+
+    def __init__(self, duplicates, results, output_filename):
+        self.duplicates = duplicates
+        self.results = results
+        self.output_filename = output_filename
+        self._records = []
+        self._columns = tuple([] for _ in RenapoResponse._fields)
+        self._full_batches = []
+        self._ready = threading.Condition()
+        self._finished = False
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._run,
+            name="WS_compare",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def add(self, record_data, response_ws):
+        """Keep the response of a queried record."""
+
+        response = to_renapo_response(response_ws)
+        with self._ready:
+            self._records.append(record_data)
+            for column, value in zip(self._columns, response):
+                column.append(value)
+            if len(self._records) >= WS_COMPARE_BATCH:
+                self._full_batches.append(self._take_batch())
+                self._ready.notify()
+
+    def add_error(self, record_data, error):
+        """Report a failed query for the record and its duplicates."""
+
+        report_ws_error(
+            record_data,
+            error,
+            self.duplicates,
+            self.results,
+            self.output_filename,
+        )
+
+    def finish(self):
+        """Compare the responses still kept and wait for every batch. The
+        first error of a batch is raised again here.
+        """
+
+        with self._ready:
+            self._finished = True
+            self._ready.notify()
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _take_batch(self):
+        # Called with the lock held
+        batch = (self._records, self._columns)
+        self._records = []
+        self._columns = tuple([] for _ in RenapoResponse._fields)
+        return batch
+
+    def _run(self):
+        while True:
+            with self._ready:
+                self._ready.wait_for(
+                    lambda: self._finished or self._full_batches,
+                    timeout=WS_COMPARE_INTERVAL,
+                )
+                finished = self._finished
+                batches, self._full_batches = self._full_batches, []
+                # Woken by the time limit (or finish), not by a full batch
+                if not batches or finished:
+                    batches.append(self._take_batch())
+
+            for records, columns in batches:
+                if not records:
+                    continue
+                try:
+                    report_ws_batch(
+                        records,
+                        columns,
+                        self.duplicates,
+                        self.results,
+                        self.output_filename,
+                    )
+                except Exception as error:
+                    if self._error is None:
+                        self._error = error
+            if finished:
+                return
+
+
+def report_ws_batch(records, responses, duplicates, results, output_filename):
+    """Compare a batch of WS RENAPO responses (columns of RenapoResponse
+    fields, one row per record queried) with the records queried and their
+    duplicates, saving the incidences of each one (also on results, only
+    for the records with incidences) and journaling the CURPs as completed
+    on the checkpoint of the report.
+
+    The records are joined with the responses of their CURPs and compared
+    column by column (compare_ws_batch). The CURPs with a record that
+    can't be compared that way (missing or not numeric values) go through
+    report_ws_response, with the same incidences or error as before.
+
+    Returns:
+
+    """
+
+    import numpy as np
+
+    # Each record queried followed by its duplicates, as report_ws_response
+    rows = []
+    positions = []
+    for position, record_data in enumerate(records):
+        group = [record_data] + duplicates.get(record_data.curp, [])
+        rows += group
+        positions += [position] * len(group)
+
+    # Records x WsRecord fields, joined with records x RenapoResponse
+    # fields of the response of each CURP
+    xml_data = np.array(rows, dtype=object)
+    ws_data = np.array(responses, dtype=object).T[positions]
+
+    row_incidences, comparable = compare_ws_batch(xml_data, ws_data)
+    fallback = set(xml_data[~comparable, 0])
+
+    lineas = []
+    completed = []
+    row = 0
+    for position, record_data in enumerate(records):
+        group = [record_data] + duplicates.get(record_data.curp, [])
+
+        if record_data.curp in fallback:
+            response_ws = RenapoResponse(*(c[position] for c in responses))
+            try:
+                report_ws_response(
+                    record_data,
+                    response_ws,
+                    duplicates,
+                    results,
+                    output_filename,
+                )
+            except Exception as mensaje:
+                report_ws_error(
+                    record_data,
+                    mensaje,
+                    duplicates,
+                    results,
+                    output_filename,
+                )
+            row += len(group)
+            continue
+
+        incidencias = []
+        for record in group:
+            record_incidencias = row_incidences.get(row)
+            if record_incidencias:
+                results[record] = record_incidencias
+                incidencias += record_incidencias
+            row += 1
+        lineas += incidencias
+        completed.append((record_data.curp, incidencias))
+
+    # Most batches have no incidences, nothing to queue for the report
+    if lineas:
+        save_lines_on_report(output_filename, lineas)
+    get_checkpoint(output_filename).record_many(completed)
+
+
+def report_ws_response(
+    record_data,
+    response_ws,
+    duplicates,
+    results,
+    output_filename,
+):
+    """Compare a WS RENAPO response with the record queried and its
+    duplicates, saving the incidences of each one (also on results, only
+    for the records with incidences) and journaling the CURP as completed
+    on the checkpoint of the report.
+
+    Returns:
+
+    """
+
+    incidencias = []
+    for record in [record_data] + duplicates.get(record_data.curp, []):
+        record_incidencias = compare_ws_response(record, response_ws)
+        if record_incidencias:
+            results[record] = record_incidencias
+            incidencias += record_incidencias
+
+    save_lines_on_report(output_filename, incidencias)
+    get_checkpoint(output_filename).record(record_data.curp, incidencias)
+
+
+def report_ws_error(record_data, error, duplicates, results, output_filename):
+    """Save the error of a WS RENAPO query for the record queried and its
+    duplicates (also on results).
+
+    Returns:
+
+    """
+
+    for record in [record_data] + duplicates.get(record_data.curp, []):
+        incidencia = record.curp + WS_ERROR + str(error)
+        style.change_color(style.RED)
+        print(incidencia)
+        results[record] = [incidencia]
+        save_on_report(output_filename, incidencia)
+
+
+def compare_ws_response(record_data, response_ws):
+    """Compare XML data of a record vs the WS RENAPO response.
+
+    Returns:
+        List of incidences found
+    """
+
+    incidencias = []
+    (
+        curp_value,
+        nombre_xml,
+        ap_paterno_xml,
+        ap_materno_xml,
+        sexo_xml,
+        lugar_nacimiento_xml,
+        dia_nacimiento_xml,
+        mes_nacimiento_xml,
+        anio_nacimiento_xml,
+    ) = record_data
+
+    if response_ws.CodigoError == 0:
+        nombre_xml = nombre_xml.replace("#", "Ñ")
+        if nombre_xml != response_ws.Nombres:
+            incidencia = (
+                curp_value
+                + "|NOMBRE(S) in XML: "
+                + nombre_xml
+                + ", doesn't match RENAPO response: "
+                + response_ws.Nombres
+            )
+            incidencias.append(incidencia)
+
+        if ap_paterno_xml is not None:
+            ap_paterno_xml = ap_paterno_xml.replace("#", "Ñ")
+        if ap_paterno_xml != response_ws.Apellido1:
+            incidencia = (
+                curp_value
+                + "|APELLIDO_PATERNO in XML: "
+                + ap_paterno_xml
+                + ", doesn't match RENAPO response: "
+                + response_ws.Apellido1
+            )
+            incidencias.append(incidencia)
+
+        if ap_materno_xml is not None:
+            ap_materno_xml = ap_materno_xml.replace("#", "Ñ")
+        if ap_materno_xml != response_ws.Apellido2:
+            if response_ws.Apellido2 is None:
+                incidencia = (
+                    curp_value
+                    + "|APELLIDO_MATERNO in XML: "
+                    + ap_materno_xml
+                    + ", doesn't match RENAPO response: NULL"
+                )
+            else:
+                incidencia = (
+                    curp_value
+                    + "|APELLIDO_MATERNO in XML: "
+                    + ap_materno_xml
+                    + ", doesn't match RENAPO response: "
+                    + response_ws.Apellido2
+                )
+            incidencias.append(incidencia)
+
+        lugar_nacimiento_curp = curp_value[11:13]
+        if RENAPO_ST[lugar_nacimiento_curp] != lugar_nacimiento_xml:
+            incidencia = (
+                curp_value
+                + "|Lugar de nacimiento: "
+                + lugar_nacimiento_xml
+                + ", doesn't match RENAPO response: "
+                + lugar_nacimiento_curp
+            )
+            incidencias.append(incidencia)
+
+        sexo_curp = curp_value[10:11]
+        if RENAPO_GENDER[sexo_curp] != sexo_xml:
+            incidencia = (
+                curp_value
+                + "|Sexo: "
+                + sexo_xml
+                + ", doesn't match RENAPO response: "
+                + sexo_curp
+            )
+            incidencias.append(incidencia)
+
+        dia_nacimiento_curp = curp_value[8:10]
+        if dia_nacimiento_curp != dia_nacimiento_xml:
+            incidencia = (
+                curp_value
+                + "|Día Nacimiento: "
+                + dia_nacimiento_xml
+                + ", doesn't match RENAPO response: "
+                + dia_nacimiento_curp
+            )
+            incidencias.append(incidencia)
+
+        mes_nac_curp = curp_value[6:8]
+        if mes_nac_curp != mes_nacimiento_xml:
+            incidencia = (
+                curp_value
+                + "|Mes Nacimiento: "
+                + mes_nacimiento_xml
+                + ", doesn't match RENAPO response: "
+                + mes_nac_curp
+            )
+            incidencias.append(incidencia)
+
+        anio_nac_curp = curp_value[4:6]
+        dif_homonimia = curp_value[16:17]
+
+        if dif_homonimia.isdigit():
+            anio_nac_curp = 1900 + int(anio_nac_curp)
+        else:
+            anio_nac_curp = 2000 + int(anio_nac_curp)
+
+        if anio_nac_curp != int(anio_nacimiento_xml):
+            incidencia = (
+                curp_value
+                + "|Año Nacimiento XML: "
+                + str(anio_nacimiento_xml)
+                + ", doesn't match RENAPO response: "
+                + str(anio_nac_curp)
+            )
+            incidencias.append(incidencia)
+    else:
+        incidencia = curp_value + "|No data from WS-RENAPO"
+        incidencias.append(incidencia)
+
+    return incidencias
+
+
+def compare_ws_batch(xml_data, ws_data):
+    """Compare XML data vs WS RENAPO responses of many records (arrays of
+    records x WsRecord fields and records x RenapoResponse fields) column
+    by column, with the same incidences as compare_ws_response. Each
+    distinct value of a column is normalized or converted only once.
+
+    Returns:
+        Dict row: list of incidences (only the rows with incidences),
+        boolean array of the rows that could be compared (the other ones
+        are left out)
+    """
+
+    import numpy as np
+
+    (
+        curp,
+        nombre,
+        ap_paterno,
+        ap_materno,
+        sexo,
+        lugar_nacimiento,
+        dia_nacimiento,
+        mes_nacimiento,
+        anio_nacimiento,
+    ) = xml_data.T
+    codigo_error, nombres, apellido1, apellido2 = ws_data.T
+    found = codigo_error == 0
+
+    # Characters of the CURPs, to take their parts without a loop
+    curps = curp.astype(str)
+    width = max(18, curps.dtype.itemsize // 4)
+    chars = curps.astype(f"U{width}").view("U1").reshape(len(curps), width)
+    digits = (chars >= "0") & (chars <= "9")
+
+    lugar_nacimiento_curp = _curp_part(chars, 11, 13)
+    estado, in_renapo_st = _mapped(lugar_nacimiento_curp, RENAPO_ST)
+    sexo_curp = _curp_part(chars, 10, 11)
+    genero, in_renapo_gender = _mapped(sexo_curp, RENAPO_GENDER)
+    anio_xml, anio_is_number = _years(anio_nacimiento)
+
+    # Values compare_ws_response would fail on
+    present = ~(
+        np.equal(xml_data, None).any(axis=1)
+        | np.equal(nombres, None)
+        | np.equal(apellido1, None)
+    )
+    comparable = np.not_equal(curp, None) & (
+        ~found
+        | (
+            present
+            & anio_is_number
+            & digits[:, 4]
+            & digits[:, 5]
+            & in_renapo_st
+            & in_renapo_gender
+        )
+    )
+    compared = found & comparable
+
+    row_incidences = {}
+
+    def add_incidences(differs, incidencia):
+        for row in np.flatnonzero(compared & differs):
+            row_incidences.setdefault(row, []).append(incidencia(row))
+
+    nombre_xml = _normalized(nombre)
+    add_incidences(
+        nombre_xml != nombres,
+        lambda row: curp[row]
+        + "|NOMBRE(S) in XML: "
+        + nombre_xml[row]
+        + ", doesn't match RENAPO response: "
+        + nombres[row],
+    )
+
+    ap_paterno_xml = _normalized(ap_paterno)
+    add_incidences(
+        ap_paterno_xml != apellido1,
+        lambda row: curp[row]
+        + "|APELLIDO_PATERNO in XML: "
+        + ap_paterno_xml[row]
+        + ", doesn't match RENAPO response: "
+        + apellido1[row],
+    )
+
+    ap_materno_xml = _normalized(ap_materno)
+    add_incidences(
+        ap_materno_xml != apellido2,
+        lambda row: curp[row]
+        + "|APELLIDO_MATERNO in XML: "
+        + ap_materno_xml[row]
+        + ", doesn't match RENAPO response: "
+        + ("NULL" if apellido2[row] is None else apellido2[row]),
+    )
+
+    add_incidences(
+        estado != lugar_nacimiento,
+        lambda row: curp[row]
+        + "|Lugar de nacimiento: "
+        + lugar_nacimiento[row]
+        + ", doesn't match RENAPO response: "
+        + lugar_nacimiento_curp[row],
+    )
+
+    add_incidences(
+        genero != sexo,
+        lambda row: curp[row]
+        + "|Sexo: "
+        + sexo[row]
+        + ", doesn't match RENAPO response: "
+        + sexo_curp[row],
+    )
+
+    dia_nacimiento_curp = _curp_part(chars, 8, 10)
+    add_incidences(
+        dia_nacimiento_curp != dia_nacimiento,
+        lambda row: curp[row]
+        + "|Día Nacimiento: "
+        + dia_nacimiento[row]
+        + ", doesn't match RENAPO response: "
+        + dia_nacimiento_curp[row],
+    )
+
+    mes_nac_curp = _curp_part(chars, 6, 8)
+    add_incidences(
+        mes_nac_curp != mes_nacimiento,
+        lambda row: curp[row]
+        + "|Mes Nacimiento: "
+        + mes_nacimiento[row]
+        + ", doesn't match RENAPO response: "
+        + mes_nac_curp[row],
+    )
+
+    # Digit on the homonymy differentiator: born before 2000
+    anio_nac_curp = np.where(
+        digits[:, 4] & digits[:, 5], _curp_part(chars, 4, 6), "0"
+    ).astype(int) + np.where(np.char.isdigit(chars[:, 16]), 1900, 2000)
+    add_incidences(
+        anio_nac_curp != anio_xml,
+        lambda row: curp[row]
+        + "|Año Nacimiento XML: "
+        + str(anio_nacimiento[row])
+        + ", doesn't match RENAPO response: "
+        + str(anio_nac_curp[row]),
+    )
+
+    for row in np.flatnonzero(comparable & ~found):
+        row_incidences[row] = [curp[row] + "|No data from WS-RENAPO"]
+
+    return row_incidences, comparable
+
+
+def _curp_part(chars, start, stop):
+    """Characters start:stop of each CURP of a records x width array of
+    characters (curp[start:stop]).
+
+    Returns:
+        Object array of str
+    """
+
+    import numpy as np
+
+    part = np.ascontiguousarray(chars[:, start:stop])
+    return part.view(f"U{stop - start}").ravel().astype(object)
+
+
+def _mapped(column, mapping):
+    """Value of mapping for each value of a column, looked up once per
+    distinct value.
+
+    Returns:
+        Object array of values (None if not on mapping), boolean array
+        True where the value is on mapping
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(column)
+    values = np.array(
+        [mapping.get(value) for value in uniques] + [None], dtype=object
+    )
+    known = np.array(
+        [value in mapping for value in uniques] + [False], dtype=bool
+    )
+    return values[codes], known[codes]
+
+
+def _normalized(column):
+    """Values of a column with # as Ñ (like the names of RENAPO), replaced
+    once per distinct value; None stays None.
+
+    Returns:
+        Object array
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(column)
+    values = np.array(
+        [value.replace("#", "Ñ") for value in uniques] + [None],
+        dtype=object,
+    )
+    return values[codes]
+
+
+def _years(column):
+    """Year of each value of a column, converted once per distinct value.
+
+    Returns:
+        Integer array (-1 if not a number), boolean array True where the
+        value is a number
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    codes, uniques = pd.factorize(column)
+    is_number = [
+        bool(re.fullmatch("[0-9]{1,9}", value)) for value in uniques
+    ]
+    years = np.array(
+        [int(value) if ok else -1 for value, ok in zip(uniques, is_number)]
+        + [-1]
+    )
+    return years[codes], np.array(is_number + [False], dtype=bool)[codes]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process.
+
+    Returns:
+        MB or None if not available (Windows)
+    """
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # bytes on macOS, KB on Linux
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
+def report_peak_memory(output_filename):
+    """Save the peak resident memory of the run on the report.
+
+    Returns:
+
+    """
+
+    peak = peak_rss_mb()
+    linea_reporte = "# Peak memory (RSS): "
+    linea_reporte += "n/a" if peak is None else f"{peak:.1f} MB"
+
+    style.change_color(style.WHITE)
+    print(f"{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+
+def save_metrics(output_filename):
+    """Save the metrics file of a report (--metrics) and its name on the
+    report.
+
+    Returns:
+
+    """
+
+    metrics_file = finish_metrics(output_filename, peak_rss_mb())
+    if metrics_file is None:
+        return
+
+    style.change_color(style.GREEN)
+    linea_reporte = "# Metrics File: " + metrics_file
+    print(f"\t{linea_reporte}", end="\n")
+    save_on_report(output_filename, linea_reporte)
+
+
+def expand_xml_files(xml_files):
+    """List the xml files of the command line, expanding folders (their
+    .xml files) and glob patterns.
+
+    Returns:
+        List of xml filenames, without repeated ones
+    """
+
+    expanded = []
+    for xml_file in xml_files:
+        if os.path.isdir(xml_file):
+            expanded += sorted(glob.glob(os.path.join(xml_file, "*.xml")))
+        elif any(char in xml_file for char in "*?["):
+            # No match: keep it, so it's reported as not found
+            expanded += sorted(glob.glob(xml_file)) or [xml_file]
+        else:
+            expanded.append(xml_file)
+
+    return list(dict.fromkeys(expanded))
+
+
+def validate_xml_file(user_args, input_xml_file):
+    """Run every stage selected on user_args for one xml file.
+
+    Returns:
+        Dict with the summary of the report
+    """
+
+    output_file, ws_records = check_xml_file(user_args, input_xml_file)
+    if ws_records is not None:
+        search_xml_file_on_ws(user_args, ws_records, output_file)
+
+    save_metrics(output_file)
+    close_report_writer(output_file)
+    return summarize_report(output_file)
+
+
+def check_xml_file(user_args, input_xml_file):
+    """Create the report of a xml file and run the stages before WS RENAPO
+    (XSD, dataframe and Custom Rules).
+
+    Returns:
+        Report filename and list of records to search on WS RENAPO
+        (None if the xml file can't be read)
+    """
 
     # Testing getting a secret
-    input_xml_file = user_args.xml_file[0]
     print(f"\tInput XML File:\t{input_xml_file}", end="\n")
 
     ws_url = _get_ws_url()
@@ -965,6 +2618,11 @@ if __name__ == "__main__":
     xsd_file = _get_xsd_file()
     print(f"\tXSD File:\t{xsd_file}", end="\n")
 
+    rules_file = _get_rules_file()
+    print(f"\tRules File:\t{rules_file}", end="\n")
+    # Compiled only the first time the rules file is seen on this process
+    rule_plan = load_rule_plan(rules_file)
+
     # Create output file and save params
     output_file = create_report_file(
         input_xml_file,
@@ -972,39 +2630,526 @@ if __name__ == "__main__":
         user_args.xsd_check,
         user_args.renapo_check,
         user_args.use_threads,
+        user_args.stream,
+        user_args.cache_mode,
+        user_args.results_mode,
+        user_args.export_format,
+        user_args.engine,
+        user_args.concurrency,
     )
+    if user_args.metrics:
+        start_metrics(output_file)
 
     # Check that XML File exist
-    if check_xml_input_file(input_xml_file, output_file):
-        # Validate vs XSD file
+    if not check_xml_input_file(input_xml_file, output_file):
+        return output_file, None
+
+    # Records keep their stored incidences while the rules and XSD files
+    # don't change
+    rules_context = context_hash(
+        "rules",
+        rule_plan.digest,
+        file_digest(os.path.join("./archivo_xsd/", xsd_file)),
+    )
+
+    if user_args.stream:
+        # Validate vs XSD file, record by record
+        with stage_timer(output_file, "validate_vs_xsd_stream"):
+            validate_vs_xsd_stream(
+                input_xml_file,
+                xsd_file,
+                user_args.xsd_check,
+                output_file,
+            )
+
+        # Validate vs Custom Rules and get the data to search on WS
+        store = open_results_store(user_args.results_mode)
+        try:
+            with stage_timer(output_file, "validate_xml_stream"):
+                ws_records = validate_xml_stream(
+                    input_xml_file,
+                    rule_plan,
+                    store,
+                    rules_context,
+                    output_file,
+                    user_args.renapo_check,
+                )
+        finally:
+            store.close()
+        if user_args.renapo_check:
+            with stage_timer(output_file, "exclude_invalid_curps"):
+                ws_records = exclude_invalid_curps(
+                    ws_records,
+                    rule_plan,
+                    output_file,
+                )
+        return output_file, ws_records
+
+    try:
+        # Read XML, only once for all the stages
+        with stage_timer(output_file, "read_xml_tree"):
+            document = read_xml_tree(input_xml_file)
+    except ET.ParseError as error:
+        style.change_color(style.RED)
+        linea_reporte = "# Error parsing XML file|" + str(error)
+        print(f"\t{linea_reporte}")
+        save_on_report(output_file, linea_reporte)
+        report_peak_memory(output_file)
+        return output_file, None
+
+    # Validate vs XSD file
+    with stage_timer(output_file, "validate_vs_xsd"):
         validate_vs_xsd(
-            input_xml_file,
+            document,
             xsd_file,
             user_args.xsd_check,
             output_file,
         )
 
-        # Read XML
-        root = read_xml_tree(input_xml_file)
+    # Transform to dataframe
+    with stage_timer(output_file, "read_xml_to_dataframe"):
+        df = read_xml_to_dataframe(document)
+
+    # Export to csv, parquet or feather
+    with stage_timer(output_file, "export_dataframe"):
+        export_dataframe(df, user_args.export_format, output_file)
+
+    # Validate vs Custom Rules
+    store = open_results_store(user_args.results_mode)
+    try:
+        with stage_timer(output_file, "validate_custom_rules"):
+            validate_custom_rules(
+                df,
+                rule_plan,
+                user_args.rule_jobs,
+                store,
+                rules_context,
+                output_file,
+            )
+    finally:
+        store.close()
+
+    # Get all the data from xml to search on WS
+    ws_records = []
+    if user_args.renapo_check:
+        with stage_timer(output_file, "create_ws_records"):
+            ws_records = create_ws_records(document)
+        with stage_timer(output_file, "exclude_invalid_curps"):
+            ws_records = exclude_invalid_curps(
+                ws_records,
+                rule_plan,
+                output_file,
+            )
+    return output_file, ws_records
 
-        # Transform to dataframe
-        df = read_xml_to_dataframe(root)
 
-        # Transform to csv
-        dataframe_to_csv(df, output_file)
+def resume_xml_file(user_args, output_file):
+    """Continue the WS RENAPO stage of a report file (--resume). The report
+    is cut back to the start of that stage, the CURPs on its checkpoint get
+    their journaled incidences and only the other ones are searched.
 
-        # Validate vs Custom Rules
-        validate_custom_rules(
-            root,
-            output_file,
-        )
+    Returns:
+        Dict with the summary of the report (None if it can't be resumed)
+    """
+
+    print(f"\tResume Report File:\t{output_file}", end="\n")
+
+    input_xml_file = None
+    ws_started = False
+    lineas = []
+    try:
+        with open(output_file, encoding="utf-8") as f:
+            for linea in f:
+                if linea.startswith(WS_STAGE_START):
+                    ws_started = True
+                    break
+                if linea.startswith("# Input XML File:"):
+                    input_xml_file = linea[17:].rstrip("\n")
+                lineas.append(linea)
+    except FileNotFoundError:
+        style.change_color(style.RED)
+        print(f"\t{output_file}|Report file not found.")
+        return None
+
+    if not ws_started or input_xml_file is None:
+        style.change_color(style.RED)
+        print(f"\t{output_file}|WS RENAPO stage not started, run it again.")
+        return None
+
+    # Lines of the interrupted WS RENAPO stage are written again from the
+    # checkpoint
+    lineas.append(
+        "# Resuming WS RENAPO stage, checkpoint: "
+        + checkpoint_filename(output_file)
+        + "\n"
+    )
+    with open(output_file, mode="w", newline="", encoding="utf-8") as f:
+        f.writelines(lineas)
+
+    print(f"\tInput XML File:\t{input_xml_file}", end="\n")
+    rule_plan = load_rule_plan(_get_rules_file())
+    curp_rule = rule_plan.rule_of("CURP")
+
+    # Same records of the interrupted run, without the invalid CURPs
+    ws_records = []
+    for registro in iter_xml_records(input_xml_file):
+        record_data = ws_record(registro)
+        if not record_data.curp:
+            continue
+        if curp_rule is None or not rule_plan.failed(
+            curp_rule, record_data.curp
+        ):
+            ws_records.append(record_data)
 
-        # Validate vs WS
+    user_args = argparse.Namespace(**vars(user_args))
+    user_args.renapo_check = True
+    search_xml_file_on_ws(user_args, ws_records, output_file)
+
+    save_metrics(output_file)
+    close_report_writer(output_file)
+    return summarize_report(output_file)
+
+
+def check_xml_file_job(user_args, input_xml_file):
+    """check_xml_file on a process of --jobs, leaving the report file
+    closed for the WS RENAPO stage on the main process.
+
+    Returns:
+        Report filename and list of records to search on WS RENAPO
+    """
+
+    # The files already use all the processes
+    user_args = argparse.Namespace(**vars(user_args))
+    user_args.rule_jobs = 1
+
+    output_file, ws_records = check_xml_file(user_args, input_xml_file)
+    # Continued by the main process
+    finish_metrics(output_file, peak_rss_mb())
+    close_report_writer(output_file)
+    return output_file, ws_records
+
+
+def search_xml_file_on_ws(user_args, ws_records, output_file):
+    """Run the WS RENAPO stage of a xml file and close its report.
+
+    Returns:
+
+    """
+
+    if user_args.metrics:
+        start_metrics(output_file)
+
+    # Validate vs WS
+    with stage_timer(output_file, "search_on_ws"):
         search_on_ws(
-            ws_url,
-            wsdl_filename,
-            root,
+            _get_ws_url(),
+            _get_wsdl_filename(),
+            ws_records,
             user_args.renapo_check,
             user_args.use_threads,
+            user_args.cache_mode,
+            user_args.results_mode,
+            user_args.engine,
+            user_args.soap,
+            user_args.in_flight,
+            user_args.ws_timeout,
+            user_args.concurrency,
+            user_args.max_concurrency,
+            user_args.retries,
+            user_args.breaker_threshold,
+            user_args.breaker_cooldown,
             output_file,
         )
+
+    report_peak_memory(output_file)
+
+
+def validate_xml_files(user_args, xml_files):
+    """Validate several xml files, with the stages before WS RENAPO on up
+    to user_args.jobs processes and WS RENAPO on this process, one file at
+    a time, as soon as each one is ready.
+
+    Returns:
+        List of summaries (in the order of xml_files), summary report
+    """
+
+    summaries = {}
+    jobs = max(1, min(user_args.jobs, len(xml_files)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(check_xml_file_job, user_args, xml_file): xml_file
+            for xml_file in xml_files
+        }
+        for future in as_completed(futures):
+            xml_file = futures[future]
+            try:
+                output_file, ws_records = future.result()
+            except Exception as error:
+                style.change_color(style.RED)
+                print(f"\t{xml_file}|Error: {error}")
+                summaries[xml_file] = {"error": str(error)}
+                continue
+
+            if user_args.metrics:
+                start_metrics(output_file)
+            if ws_records is not None:
+                search_xml_file_on_ws(user_args, ws_records, output_file)
+            save_metrics(output_file)
+            close_report_writer(output_file)
+            summaries[xml_file] = summarize_report(output_file)
+
+    summaries = [summaries[xml_file] for xml_file in xml_files]
+    summary_file = create_summary_report(xml_files, summaries, jobs)
+    return summaries, summary_file
+
+
+def create_summary_report(xml_files, summaries, jobs):
+    """Create the merged report of several xml files.
+
+    Returns:
+        .csv filename with timestamp on output_files folder
+    """
+
+    timestamp = datetime.datetime.now().strftime("%Y_%m_%d_%H%M%S")
+    summary_file = f"./output_files/{timestamp}_summary.csv"
+
+    lineas = []
+    lineas.append("# Input XML Files:" + str(len(xml_files)))
+    lineas.append("# jobs:" + str(jobs))
+    lineas.append("# xml_file|report|records|incidences|xsd")
+
+    total_registros = 0
+    total_incidencias = 0
+    for xml_file, summary in zip(xml_files, summaries):
+        if "error" in summary:
+            lineas.append(f"{xml_file}|Error: {summary['error']}")
+            continue
+
+        lineas.append(
+            f"{xml_file}|{summary['report']}|{summary['records']}"
+            f"|{summary['incidences']}|{summary['xsd']}"
+        )
+        total_registros += summary["records"] or 0
+        total_incidencias += summary["incidences"]
+
+    lineas.append(
+        "#Total Records: "
+        + str(total_registros)
+        + "|Total Incidences: "
+        + str(total_incidencias)
+    )
+
+    with open(summary_file, mode="w", newline="", encoding="utf-8") as f:
+        for linea in lineas:
+            f.write(linea + "\n")
+
+    style.change_color(style.GREEN)
+    print(f"\n\tSummary File:\t{summary_file}", end="\n\n")
+    for linea in lineas:
+        print(f"\t{linea}")
+    style.change_color(style.RESET)
+
+    return summary_file
+
+
+def summarize_report(output_filename):
+    """Summary of a report file, for the answer of a --serve job.
+
+    Returns:
+        Dict with report path, records, incidences and XSD result
+    """
+
+    summary = {
+        "report": os.path.abspath(output_filename),
+        "records": None,
+        "incidences": 0,
+        "xsd": None,
+    }
+    with open(output_filename, encoding="utf-8") as f:
+        for linea in f:
+            if not linea.startswith("#"):
+                summary["incidences"] += 1
+            elif linea.startswith("#Total Records: "):
+                summary["records"] = int(linea[16:].split("|")[0])
+            elif linea.startswith("# XML CORRECTO"):
+                summary["xsd"] = "CORRECTO"
+            elif linea.startswith("# XML MAL FORMADO"):
+                summary["xsd"] = "MAL FORMADO"
+    return summary
+
+
+class ValidationJobHandler(BaseHTTPRequestHandler):
+    """Jobs of --serve: POST /validate {"args": [xml_files, options...]}."""
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "unknown path " + self.path})
+            return
+        self._send_json(200, {"status": "ok", "jobs": self.server.jobs})
+
+    def do_POST(self):
+        if self.path != "/validate":
+            self._send_json(404, {"error": "unknown path " + self.path})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length))
+            job_args = read_user_cli_args([str(arg) for arg in job["args"]])
+        except (ValueError, KeyError, TypeError, SystemExit):
+            self._send_json(400, {"error": "invalid job, see --help"})
+            return
+        if job_args.serve:
+            self._send_json(400, {"error": "--serve is not a job option"})
+            return
+
+        try:
+            xml_files = expand_xml_files(job_args.xml_file)
+            if job_args.resume:
+                summary = resume_xml_file(job_args, job_args.resume)
+            elif len(xml_files) == 1:
+                summary = validate_xml_file(job_args, xml_files[0])
+            else:
+                summaries, summary_file = validate_xml_files(
+                    job_args, xml_files
+                )
+                summary = {
+                    "summary": os.path.abspath(summary_file),
+                    "files": summaries,
+                }
+        except Exception as error:
+            try:
+                close_report_writers()
+            except Exception:
+                # The job already failed, its error is the one sent back
+                pass
+            style.change_color(style.RED)
+            print(f"\tJob error:\t{error}")
+            self._send_json(500, {"error": str(error)})
+            return
+
+        self.server.jobs += 1
+        self._send_json(200, summary)
+
+    def _send_json(self, status, content):
+        content = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def warm_up():
+    """Compile the XSD and rules, parse the WSDL and import the modules of
+    the stages before the first --serve job.
+
+    Returns:
+
+    """
+
+    from renapo_client import get_client_factory
+
+    # Imported on first use by the stages (see the imports of this file)
+    for module in LAZY_MODULES:
+        importlib.import_module(module)
+
+    style.change_color(style.WHITE)
+    try:
+        load_xsd_schema(_get_xsd_file())
+        print(f"\tXSD File:\t{_get_xsd_file()} (compiled)")
+    except Exception as error:
+        style.change_color(style.YELLOW)
+        print(f"\tXSD not loaded:\t{error}")
+
+    try:
+        load_rule_plan(_get_rules_file())
+        print(f"\tRules File:\t{_get_rules_file()} (compiled)")
+    except Exception as error:
+        style.change_color(style.YELLOW)
+        print(f"\tRules not loaded:\t{error}")
+
+    try:
+        client_factory = get_client_factory(
+            _get_wsdl_filename(),
+            _get_ws_url(),
+        )
+        client_factory.request_template()
+        print(f"\tWSDL File:\t{_get_wsdl_filename()} (parsed)")
+    except Exception as error:
+        style.change_color(style.YELLOW)
+        print(f"\tWSDL not loaded:\t{error}")
+
+
+def serve(host, port):
+    """Take validation jobs over localhost HTTP, one at a time, keeping
+    the imports, compiled XSD and parsed WSDL between jobs.
+
+    Returns:
+
+    """
+
+    warm_up()
+
+    server = HTTPServer((host, port), ValidationJobHandler)
+    server.jobs = 0
+    style.change_color(style.GREEN)
+    print(f"\tServing on:\thttp://{host}:{port}/validate", end="\n\n")
+    style.change_color(style.RESET)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def save_lines_on_report(output_filename, lineas):
+    """Queue several lines for the report file at once.
+
+    Returns:
+
+    """
+
+    get_report_writer(output_filename).write_lines(lineas)
+
+
+def save_on_report(output_filename, linea):
+    """Queue a line for the report file, safe to call from any thread.
+
+    Returns:
+
+    """
+
+    get_report_writer(output_filename).write(linea)
+
+
+if __name__ == "__main__":
+    # Get user parameters
+    user_args = read_user_cli_args()
+
+    if user_args.serve:
+        serve(user_args.host, user_args.port)
+        sys.exit(0)
+
+    style.change_color(style.BLUE)
+    print(f"\tParameters:{user_args.xml_file}, ")
+    print(f"{user_args.xsd_check}, ")
+    print(f"{user_args.renapo_check}, ")
+    print(f"{user_args.use_threads}, ", end="\n\n")
+
+    print(f"\tParameter xml_file:\t{user_args.xml_file}", end="\n")
+    print(f"\tParameter xsd_check:\t{user_args.xsd_check}", end="\n")
+    print(f"\tParameter renapo_check:\t{user_args.renapo_check}", end="\n")
+    print(f"\tParameter use_thread:\t{user_args.use_threads}", end="\n\n")
+
+    xml_files = expand_xml_files(user_args.xml_file)
+    if user_args.resume:
+        resume_xml_file(user_args, user_args.resume)
+    elif len(xml_files) == 1:
+        validate_xml_file(user_args, xml_files[0])
+    elif xml_files:
+        validate_xml_files(user_args, xml_files)
+    else:
+        style.change_color(style.RED)
+        print(f"\tNo xml files found on:\t{user_args.xml_file}")